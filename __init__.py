@@ -36,6 +36,7 @@ bl_info = {
 
 from blase.batoms import Batoms
 from blase.batom import Batom
+from blase.bnodes import register_color_by_frame_handler, unregister_color_by_frame_handler
 
 import bpy
 from bpy.types import (Panel,
@@ -97,6 +98,7 @@ def register():
     bpy.types.Object.species = bpy.props.StringProperty(name = 'species')
     bpy.types.Object.element = bpy.props.StringProperty(name = 'element')
     bpy.types.Object.batom = bpy.props.PointerProperty(name = 'batom', type = gui_blase.BatomSettings)
+    register_color_by_frame_handler()
 
 
     bpy.utils.register_class(gui_uilist.ListItem)
@@ -114,6 +116,7 @@ def register():
 
 def unregister():
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import_blase)
+    unregister_color_by_frame_handler()
 
     del bpy.types.Scene.my_list
     del bpy.types.Scene.list_index
@@ -7,12 +7,12 @@ This module defines the Batom object in the blase package.
 import bpy
 import bmesh
 from mathutils import Vector
-from blase.btools import object_mode
-from blase.data import material_styles_dict
-from blase.tools import get_atom_kind
-from blase.bdraw import draw_text
+from blase.btools import object_mode, remove_objects
+from blase.tools import get_atom_kind, get_chunk_ids
+from blase.bdraw import draw_text, get_sphere_mesh, get_atom_material, set_object_material
+from blase.bnodes import set_attribute, get_attribute
+from blase.profiler import profiler
 import numpy as np
-import time
 
 subcollections = ['atom', 'bond', 'instancer', 'instancer_atom', 'polyhedra', 'isosurface', 'text']
 
@@ -105,55 +105,50 @@ class Batom():
             self.material_style = material_style
             self.bsdf_inputs = bsdf_inputs
             self.species_data = get_atom_kind(self.element, scale = scale, props = self.kind_props, color_style = self.color_style)
-            self.radius = self.species_data['radius']
             self.set_material()
             self.set_instancer()
             self.set_object(positions)
         else:
             self.from_batom(from_batom)
-            #todo self.radius = self.species_data['radius']
 
         self.bond_data = {}
         self.polyhedra_data = {}
         if draw:
             self.draw_atom()
+    @profiler.timeit('Batom.set_material')
     def set_material(self):
-        name = 'material_atom_{0}_{1}'.format(self.label, self.species)
-        if name not in bpy.data.materials:
-            if not self.bsdf_inputs:
-                bsdf_inputs = material_styles_dict[self.material_style]
-            material = bpy.data.materials.new(name)
-            material.diffuse_color = np.append(self.species_data['color'], self.species_data['transmit'])
-            material.metallic = bsdf_inputs['Metallic']
-            material.roughness = bsdf_inputs['Roughness']
-            material.blend_method = 'BLEND'
-            material.use_nodes = True
-            principled_node = material.node_tree.nodes['Principled BSDF']
-            principled_node.inputs['Base Color'].default_value = np.append(self.species_data['color'], self.species_data['transmit'])
-            principled_node.inputs['Alpha'].default_value = self.species_data['transmit']
-            for key, value in bsdf_inputs.items():
-                principled_node.inputs[key].default_value = value
+        """
+        Use the material shared by atoms of the same element and style.
+        """
+        self._material = get_atom_material(self.element, self.species_data['color'],
+                        self.species_data['transmit'], color_style = self.color_style,
+                        material_style = self.material_style, bsdf_inputs = self.bsdf_inputs)
     def object_mode(self):
         for object in bpy.data.objects:
             if object.mode == 'EDIT':
                 bpy.ops.object.mode_set(mode = 'OBJECT')
+    @profiler.timeit('Batom.set_instancer')
     def set_instancer(self):
+        """
+        The instancer uses the shared unit sphere, scaled by radius*scale.
+        """
         object_mode()
         name = 'instancer_atom_{0}_{1}'.format(self.label, self.species)
         if name not in bpy.data.objects:
-            bpy.ops.mesh.primitive_uv_sphere_add(radius = self.species_data['radius']) #, segments=32, ring_count=16)
-            sphere = bpy.context.view_layer.objects.active
+            sphere = bpy.data.objects.new(name, get_sphere_mesh())
+            bpy.data.collections['Collection'].objects.link(sphere)
             if isinstance(self.species_data['scale'], float):
                 self.species_data['scale'] = [self.species_data['scale']]*3
-            sphere.scale = self.species_data['scale']
-            sphere.name = 'instancer_atom_{0}_{1}'.format(self.label, self.species)
-            sphere.data.materials.append(self.material)
-            bpy.ops.object.shade_smooth()
+            sphere.batom.radius = self.species_data['radius']
+            sphere.scale = np.array(self.species_data['scale'])*self.species_data['radius']
+            set_object_material(sphere, self._material)
             sphere.hide_set(True)
+    @profiler.timeit('Batom.set_object')
     def set_object(self, positions):
         """
         build child object and add it to main objects.
         """
+        profiler.count(atoms = len(positions))
         if self.name not in bpy.data.objects:
             mesh = bpy.data.meshes.new(self.name)
             obj_atom = bpy.data.objects.new(self.name, mesh)
@@ -192,7 +187,23 @@ class Batom():
     def material(self):
         return self.get_material()
     def get_material(self):
-        return bpy.data.materials['material_atom_%s_%s'%(self.label, self.species)]
+        """
+        The material is shared with other atoms of the same element and style.
+        """
+        return self.instancer.material_slots[0].material
+    @property
+    def radius(self):
+        return self.get_radius()
+    @radius.setter
+    def radius(self, radius):
+        self.set_radius(radius)
+    def get_radius(self):
+        # instancers built before the shared sphere have the radius in the mesh
+        return self.instancer.batom.radius or 1.0
+    def set_radius(self, radius):
+        scale = self.scale
+        self.instancer.batom.radius = radius
+        self.scale = scale
     @property
     def scale(self):
         return self.get_scale()
@@ -203,11 +214,162 @@ class Batom():
         """
         self.set_scale(scale)
     def get_scale(self):
-        return self.instancer.scale
+        return np.array(self.instancer.scale)/self.radius
     def set_scale(self, scale):
         if isinstance(scale, float) or isinstance(scale, int):
             scale = [scale]*3
-        self.instancer.scale = scale
+        self.instancer.scale = np.array(scale)*self.radius
+        for instancer in self.get_chunk_instancers():
+            instancer.scale = self.instancer.scale
+    @property
+    def chunk_size(self):
+        return self.get_chunk_size()
+    @chunk_size.setter
+    def chunk_size(self, chunk_size):
+        self.set_chunk_size(chunk_size)
+    def get_chunk_size(self):
+        return self.batom.batom.chunk_size
+    def set_chunk_size(self, chunk_size, cell = None):
+        """
+        chunk_size: float
+            in Angstrom, 0 for one object for the species.
+        """
+        if chunk_size:
+            self.chunk(chunk_size, cell)
+        else:
+            self.unchunk()
+    def get_chunk_collection(self):
+        name = '%s_chunk'%self.label
+        if name not in bpy.data.collections:
+            coll = bpy.data.collections.new(name)
+            if self.label in bpy.data.collections:
+                bpy.data.collections[self.label].children.link(coll)
+            else:
+                self.scene.collection.children.link(coll)
+        return bpy.data.collections[name]
+    def get_chunks(self):
+        """
+        Return a dict of chunk id: chunk object.
+        """
+        name = '%s_chunk'%self.label
+        if name not in bpy.data.collections:
+            return {}
+        return {obj.batom.chunk_id: obj for obj in bpy.data.collections[name].objects
+                if obj.species == self.species and obj.is_batom}
+    def get_chunk_instancers(self):
+        return [obj.children[0] for obj in self.get_chunks().values() if obj.children]
+    @profiler.timeit('Batom.chunk')
+    def chunk(self, size = 10.0, cell = None):
+        """
+        Split the atoms into chunk objects on a grid aligned with the cell,
+        about size Angstrom per chunk. Moving, adding or deleting atoms
+        then only rewrites the chunks they leave or enter, and chunks can
+        be hidden one by one, e.g. outside the camera view.
+
+        The species object keeps all positions and is hidden, the chunks
+        are its children and follow its transform.
+        Animations from load_frames are on the species object, unchunk to
+        play them.
+
+        >>> au.chunk(10.0, cell = au_atoms.cell)
+        """
+        batom = self.batom
+        batom.batom.chunk_size = size
+        batom.batom.chunk_cell = np.zeros(9) if cell is None else np.array(cell[:]).flatten()
+        batom.instance_type = 'NONE'
+        batom.hide_viewport = True
+        batom.hide_render = True
+        self.instancer.hide_render = True
+        self.update_chunks()
+    def unchunk(self):
+        """
+        Remove the chunk objects, and show the species object again.
+        """
+        chunks = list(self.get_chunks().values())
+        remove_objects([obj.children[0] for obj in chunks if obj.children] + chunks)
+        batom = self.batom
+        batom.batom.chunk_size = 0.0
+        batom.instance_type = 'VERTS'
+        batom.hide_viewport = False
+        batom.hide_render = False
+        self.instancer.hide_render = False
+    def update_chunks(self, index = None, ids = None):
+        """
+        Rebuild the chunks which contain, or contained, the atoms in index,
+        plus the chunks in ids. Without both, rebuild all chunks.
+        """
+        batom = self.batom
+        mesh = batom.data
+        n = len(mesh.vertices)
+        size = batom.batom.chunk_size
+        cell = np.array(batom.batom.chunk_cell).reshape(3, 3)
+        local_positions = np.empty(n*3, dtype = np.float32)
+        mesh.vertices.foreach_get('co', local_positions)
+        local_positions = local_positions.reshape(-1, 3)
+        # the grid is in world coordinates
+        matrix = np.array(batom.matrix_world)
+        positions = np.dot(local_positions, matrix[:3, :3].T) + matrix[:3, 3]
+        if index is None and ids is None:
+            chunk_ids = get_chunk_ids(positions, cell, size)
+            ids = np.union1d(chunk_ids, list(self.get_chunks().keys()))
+        else:
+            chunk_ids = get_attribute(mesh, 'chunk', 'INT') if mesh.attributes.get('chunk') \
+                        else get_chunk_ids(positions, cell, size)
+            ids = [] if ids is None else list(ids)
+            if index is not None:
+                index = np.asarray(list(index), dtype = int)
+                ids = np.union1d(ids, chunk_ids[index])
+                chunk_ids[index] = get_chunk_ids(positions[index], cell, size)
+                ids = np.union1d(ids, chunk_ids[index])
+        set_attribute(mesh, 'chunk', chunk_ids.astype(np.int32))
+        profiler.count(chunks = len(ids))
+        # group the atoms of the chunks to update, in one sort
+        select = np.where(np.isin(chunk_ids, ids))[0]
+        select = select[np.argsort(chunk_ids[select], kind = 'stable')]
+        keys, starts = np.unique(chunk_ids[select], return_index = True)
+        groups = dict(zip(keys, np.split(select, starts[1:])))
+        chunks = self.get_chunks()
+        for i in ids:
+            i = int(i)
+            group = groups.get(i, [])
+            obj = chunks.get(i)
+            if len(group) == 0:
+                if obj is not None:
+                    remove_objects(list(obj.children) + [obj])
+                continue
+            if obj is None:
+                obj = self.new_chunk(i)
+            chunk_mesh = obj.data
+            if len(chunk_mesh.vertices) != len(group):
+                chunk_mesh.clear_geometry()
+                chunk_mesh.vertices.add(len(group))
+            chunk_mesh.vertices.foreach_set('co', local_positions[group].ravel())
+            chunk_mesh.update()
+    def new_chunk(self, chunk_id):
+        """
+        Build an empty chunk object, with its own instancer, which shares the
+        sphere mesh and the material of the species instancer.
+        """
+        name = 'chunk_%s_%s_%s'%(self.label, self.species, chunk_id)
+        coll = self.get_chunk_collection()
+        obj = bpy.data.objects.new(name, bpy.data.meshes.new(name))
+        obj.is_batom = True
+        obj.species = self.species
+        obj.element = self.element
+        obj.label = self.label
+        obj.batom.chunk_id = chunk_id
+        coll.objects.link(obj)
+        obj.parent = self.batom
+        obj.instance_type = 'VERTS'
+        instancer = self.instancer
+        sphere = bpy.data.objects.new('instancer_%s'%name, instancer.data)
+        coll.objects.link(sphere)
+        sphere.scale = instancer.scale
+        sphere.display_type = instancer.display_type
+        set_object_material(sphere, self.material)
+        sphere.parent = obj
+        sphere.hide_set(True)
+        return obj
     @property
     def positions(self):
         return self.get_positions()
@@ -218,7 +380,13 @@ class Batom():
         """
         Get array of positions.
         """
-        return np.array([self.batom.matrix_world @ self.batom.data.vertices[i].co for i in range(len(self))])
+        batom = self.batom
+        n = len(batom.data.vertices)
+        local_positions = np.empty(n*3, dtype = np.float32)
+        batom.data.vertices.foreach_get('co', local_positions)
+        local_positions = local_positions.reshape(-1, 3).astype(float)
+        matrix = np.array(batom.matrix_world)
+        return np.dot(local_positions, matrix[:3, :3].T) + matrix[:3, 3]
     def set_positions(self, positions):
         """
         Set positions
@@ -227,31 +395,47 @@ class Batom():
         if len(positions) != natom:
             raise ValueError('positions has wrong shape %s != %s.' %
                                 (len(positions), natom))
-        for i in range(natom):
-            self.batom.data.vertices[i].co = np.array(positions[i]) - np.array(self.batom.location)
+        chunk_size = self.chunk_size
+        if chunk_size:
+            old = self.positions
+        positions = np.asarray(positions, dtype = float)
+        batom = self.batom
+        local_positions = positions - np.array(batom.location)
+        batom.data.vertices.foreach_set('co', local_positions.astype(np.float32).ravel())
+        batom.data.update()
+        if chunk_size:
+            moved = np.where(np.any(abs(positions - old) > 1e-6, axis = 1))[0]
+            self.update_chunks(moved)
         
     def clean_blase_objects(self, object):
         """
         remove all bond object in the bond collection
         """
-        for obj in bpy.data.collections['%s_%s'%(self.label, object)].all_objects:
-            if obj.name == '%s_%s_%s'%(object, self.label, self.species):
-                bpy.data.objects.remove(obj)
+        objs = [obj for obj in bpy.data.collections['%s_%s'%(self.label, object)].all_objects
+                if obj.name == '%s_%s_%s'%(object, self.label, self.species)]
+        remove_objects(objs)
     def delete_verts(self, index = []):
         """
         delete verts
         """
         object_mode()
         obj = self.batom
+        chunk_size = self.chunk_size
+        if chunk_size:
+            ids = np.unique(get_attribute(obj.data, 'chunk', 'INT')[list(index)])
         bm = bmesh.new()
         bm.from_mesh(obj.data)
         bm.verts.ensure_lookup_table()
         verts_select = [bm.verts[i] for i in index] 
         bmesh.ops.delete(bm, geom=verts_select, context='VERTS')
         if len(bm.verts) == 0:
-            bpy.data.objects.remove(obj)
+            if chunk_size:
+                self.unchunk()
+            remove_objects([obj, self.instancer])
         else:
             bm.to_mesh(obj.data)
+            if chunk_size:
+                self.update_chunks(ids = ids)
     def delete(self, index = []):
         """
         delete atom.
@@ -281,6 +465,7 @@ class Batom():
                 for n, i in enumerate(c.index):
                     self.constrainatom += [i]
     
+    @profiler.timeit('Batom.load_frames')
     def load_frames(self, images = []):
         """
         images: list
@@ -338,6 +523,8 @@ class Batom():
         if isinstance(index, list):
             for i in index:
                 batom.data.vertices[i].co = np.array(value[i]) - np.array(batom.location)
+        if self.chunk_size:
+            self.update_chunks(np.atleast_1d(index))
 
     def repeat(self, m, cell):
         """
@@ -420,6 +607,7 @@ class Batom():
         """
         """
         object_mode()
+        n = len(self)
         bm = bmesh.new()
         bm.from_mesh(self.batom.data)
         bm.verts.ensure_lookup_table()
@@ -427,6 +615,8 @@ class Batom():
         for pos in positions:
             bm.verts.new(pos)
         bm.to_mesh(self.batom.data)
+        if self.chunk_size:
+            self.update_chunks(range(n, len(self)))
     def translate(self, displacement):
         """Translate atomic positions.
 
@@ -10,17 +10,48 @@ from blase.batom import Batom
 from blase.bondsetting import Bondsetting
 import bpy
 import bmesh
-from mathutils import Vector
+from mathutils import Vector, Matrix
 from copy import copy
+from contextlib import contextmanager
 from blase.tools import get_bondpairs, get_cell_vertices, get_bond_kind, \
-                        get_polyhedra_kind, search_pbc, get_bbox
-from blase.bdraw import draw_cell, draw_bond_kind, draw_polyhedra_kind, draw_text, draw_isosurface, bond_source, cylinder_mesh_from_instance, clean_default
-from blase.btools import object_mode
+                        get_polyhedra_kind, search_pbc, get_bbox, get_hash, get_buried_atoms, get_bulk_atoms, \
+                        get_frustum_mask, get_symmetry_groups, get_image_bonds, get_image_polyhedra, \
+                        search_bonded_images, get_molecules, get_hydrogen_bonds
+from blase.bdraw import draw_cell, draw_bond_kind, draw_polyhedra_kind, draw_text, draw_isosurface, bond_source, cylinder_mesh_from_instance, clean_default, \
+                        get_sphere_mesh, get_lod, lod_levels, viewport_policy, set_object_material
+from blase.btools import object_mode, remove_objects, purge_orphans, mesh_memory, animation_memory, estimate_mesh_bytes, \
+                         undo_push, apply_large_scene_policy, large_scene_policy
+from blase.bnodes import draw_atoms_nodes, get_atoms_material, set_attribute, get_attribute, \
+                         set_material_colormap, register_color_by_frame_handler, set_modifier_input
+from blase.profiler import profiler
 import numpy as np
-import time
+import warnings
 
 subcollections = ['atom', 'bond', 'instancer', 'instancer_atom', 'cell', 'polyhedra', 'isosurface', 'virtual', 'boundary', 'text']
 
+# bond pairs of the last bond search per Batoms label: {label: (key, bondlist)}.
+# Batoms objects are rebuilt from the collection by the GUI, the cache
+# lives as long as the session.
+bondlist_cache = {}
+
+# bond and polyhedra data of the atoms in the cell, per Batoms label:
+# {label: (key, kinds)}. The boundary images are translated from them.
+bond_data_cache = {}
+polyhedra_data_cache = {}
+
+# symmetry groups of the last search per Batoms label: {label: (key, groups)}
+symmetry_cache = {}
+
+# scale of the atoms for every model_type
+atom_scales = {'0': 1.0, '1': 0.4, '2': 0.4, '3': 0.01}
+
+def warn_memory_budget(batoms, stage, nbytes, budget):
+    """
+    Default hook called when a draw would exceed the memory budget.
+    Use a hook which raises an exception to stop the draw instead.
+    """
+    warnings.warn('%s: %s needs about %.1f MB, more than the memory budget %.1f MB.'
+                  %(batoms.label, stage, nbytes/1e6, budget/1e6), ResourceWarning)
 
 
   
@@ -77,6 +108,30 @@ class Batoms():
         search atoms at the boundary
     add_bonds: dict
         add bonds not in the default
+    hydrogen_bond: float or list
+        draw hydrogen bonds D-H...A as dashed bonds, H...A shorter than the
+        value, or [distance, angle] with the smallest D-H...A angle in
+        degree (default 120).
+    memory_budget: float
+        in MB. on_memory_budget is called when a draw would need more.
+    on_memory_budget: function
+        called as on_memory_budget(batoms, stage, nbytes, budget)
+    backend: str
+        'instancer', one instancer sphere per species. 'geometry_nodes', one
+        object with per-atom attributes (radius, color, show, select),
+        instanced by a geometry nodes modifier. Needs Blender 3.2.
+    quality: str
+        level of detail of spheres and bond cylinders. 'auto' chooses it
+        from the atom count and the size of an atom on the image, or one of
+        'low', 'medium', 'high', 'ultra'.
+    viewport: str
+        'auto', 'full' or 'proxy'. A proxy shows atoms as boxes (points with
+        the geometry nodes backend) and bonds as bounding boxes in the
+        viewport, renders are not changed. 'auto' uses the proxy above
+        viewport_policy['natoms'] atoms.
+    undo: str
+        'draw', a draw is one undo step. 'none', draws do not push undo
+        steps. Above large_scene_policy['natoms'] atoms the policy is used.
     
     Examples:
     >>> from blase.batoms import Batoms
@@ -109,9 +164,18 @@ class Batoms():
                 bsdf_inputs = None,
                 movie = False,
                 draw = True, 
+                memory_budget = None,
+                on_memory_budget = warn_memory_budget,
+                undo = None,
+                backend = None,
+                quality = None,
+                viewport = None,
                  ):
         #
-        self.batoms_boundary = {}
+        self._batch = 0
+        self._pending = set()
+        self.culled_bonds = 0
+        self.on_memory_budget = on_memory_budget
         self.batoms_bond = {}
         self.scene = bpy.context.scene
         self.bondlist = bondlist
@@ -148,6 +212,16 @@ class Batoms():
             self.from_collection(from_collection)
         else:
             raise Exception("Failed, species_dict, atoms or coll should be provided!"%self.label)
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
+        if undo is not None:
+            self.undo = undo
+        if backend is not None:
+            self.coll.blase.backend = backend
+        if quality is not None:
+            self.coll.blase.quality = quality
+        if viewport is not None:
+            self.coll.blase.viewport = viewport
         if draw:
             self.draw()
         if movie:
@@ -165,9 +239,11 @@ class Batoms():
             elif isinstance(data, Batom):
                 self.coll.children['%s_atom'%self.label].objects.link(data.batom)
                 self.coll.children['%s_instancer'%self.label].objects.link(data.instancer)
+    @profiler.timeit('Batoms.from_ase')
     def from_ase(self, atoms):
         """
         """
+        profiler.count(atoms = len(atoms))
         if 'species' not in atoms.info:
             atoms.info['species'] = atoms.get_chemical_symbols()
         species_list = list(set(atoms.info['species']))
@@ -258,11 +334,11 @@ class Batoms():
         if np.max(abs(cell_vertices)) < 1e-6:
             return 0
         print('--------------Draw cell--------------')
-        self.clean_blase_objects('cell')
-        for obj in self.coll.children['%s_cell'%self.label].all_objects:
-            bpy.data.objects.remove(obj)
         if self.show_unit_cell:
             draw_cell(self.coll.children['%s_cell'%self.label], cell_vertices, label = self.label)
+        else:
+            self.clean_blase_objects('cell')
+    @profiler.timeit('Batoms.draw_bonds')
     def draw_bonds(self):
         """
         Draw bonds.
@@ -275,15 +351,57 @@ class Batoms():
         print('--------------Draw bonds--------------')
         # if not self.bondlist:
         object_mode()
-        atoms = self.get_atoms_boundary()
-        self.bondlist = get_bondpairs(atoms, self.bondsetting.data)
+        self.set_collection_visible('bond', True)
+        atoms = self.atoms
+        base_key = self.get_bond_key(atoms)
+        vertices = lod_levels[self.coll.blase.lod]['vertices']
+        # the dashed hydrogen bonds end at the atom surfaces
+        scales = None
         if self.hydrogen_bond:
-            self.hydrogen_bondlist = get_bondpairs(self.atoms, cutoff = {('O', 'H'): self.hydrogen_bond})
-        self.calc_bond_data(atoms, self.bondlist)
-        for species, bond_data in self.bond_kinds.items():
-            print('Bond %s'%species)
-            draw_bond_kind(species, bond_data, label = self.label, 
-                        coll = self.coll.children['%s_bond'%self.label])
+            scales = sorted((species, tuple(batom.scale)) for species, batom in self.batoms.items())
+        key = get_hash(base_key, vertices, self.coll.blase.cull, self.get_frustum_key(),
+                       self.hydrogen_bond, scales)
+        image_index, image_offsets = self.get_boundary_images()
+        boundary_key = get_hash(key, image_index, image_offsets)
+        if boundary_key == self.coll.blase.bond_key:
+            print('Bonds are up to date.')
+            return
+        source = bond_source(vertices = vertices)
+        names = []
+        if self.coll.blase.bond_key and self.label in bond_data_cache and bond_data_cache[self.label][0] == key:
+            # only the boundary changed, the bonds in the cell are kept
+            bond_kinds = bond_data_cache[self.label][1]
+            names.extend('bond_%s_%s'%(self.label, species) for species in bond_kinds)
+        else:
+            self.bondlist = self.filter_bondlist(atoms, self.get_bondlist(atoms, base_key))
+            with profiler.stage('calc_bond_data'):
+                self.calc_bond_data(atoms, self.bondlist)
+            if self.hydrogen_bond:
+                self.hydrogen_bondlist = self.get_hydrogen_bondlist(atoms)
+                self.calc_hydrogen_bond_data(atoms, self.hydrogen_bondlist)
+            if self.coll.blase.cull:
+                self.cull_bonds()
+            bond_kinds = self.bond_kinds
+            # n-vertex cylinder: 2n verts, 3n edges, n + 2 faces, 6n loops
+            nbond = sum(len(bond_data['centers']) for bond_data in bond_kinds.values())
+            self.check_memory_budget('draw_bonds', estimate_mesh_bytes(2*vertices*nbond, 3*vertices*nbond,
+                                     (vertices + 2)*nbond, 6*vertices*nbond), replace = 'bond')
+            for species, bond_data in bond_kinds.items():
+                print('Bond %s'%species)
+                obj = draw_bond_kind(species, bond_data, label = self.label, 
+                            coll = self.coll.children['%s_bond'%self.label], source = source)
+                names.append(obj.name)
+            bond_data_cache[self.label] = (key, bond_kinds)
+        # half bonds of the boundary atoms, translated from their atoms
+        with profiler.stage('boundary bonds'):
+            image_kinds = get_image_bonds(bond_kinds, image_index, image_offsets, self.cell)
+            for species, bond_data in image_kinds.items():
+                obj = draw_bond_kind(species, bond_data, label = '%s_bd'%self.label,
+                            coll = self.coll.children['%s_bond'%self.label], source = source)
+                names.append(obj.name)
+        self.remove_stale_objects('bond', names)
+        self.coll.blase.bond_key = boundary_key
+    @profiler.timeit('Batoms.draw_polyhedras')
     def draw_polyhedras(self):
         """
         Draw bonds.
@@ -294,11 +412,108 @@ class Batoms():
         """
         object_mode()
         print('--------------Draw polyhedras--------------')
-        self.calc_polyhedra_data(atoms = self.atoms, bondlist = self.bondlist)
-        for species, polyhedra_data in self.polyhedra_kinds.items():
-            print('Polyhedra %s'%species)
-            draw_polyhedra_kind(species, polyhedra_data, label = self.label,
-                        coll = self.coll.children['%s_polyhedra'%self.label])
+        self.set_collection_visible('polyhedra', True)
+        atoms = self.atoms
+        base_key = self.get_bond_key(atoms)
+        key = get_hash(base_key, self.get_frustum_key())
+        image_index, image_offsets = self.get_boundary_images()
+        boundary_key = get_hash(key, image_index, image_offsets)
+        if boundary_key == self.coll.blase.polyhedra_key:
+            print('Polyhedra are up to date.')
+            return
+        names = []
+        if self.coll.blase.polyhedra_key and self.label in polyhedra_data_cache \
+                and polyhedra_data_cache[self.label][0] == key:
+            # only the boundary changed, the polyhedra in the cell are kept
+            polyhedra_kinds = polyhedra_data_cache[self.label][1]
+            for species in polyhedra_kinds:
+                names.extend(['polyhedra_%s_%s_face'%(self.label, species), 'polyhedra_%s_%s_edge'%(self.label, species)])
+        else:
+            bondlist = self.filter_bondlist(atoms, self.get_bondlist(atoms, base_key))
+            with profiler.stage('calc_polyhedra_data'):
+                self.calc_polyhedra_data(atoms = atoms, bondlist = bondlist)
+            polyhedra_kinds = self.polyhedra_kinds
+            # faces and 4-vertex edge cylinders: 8 verts, 12 edges, 6 faces, 24 loops
+            nbytes = 0
+            for data in polyhedra_kinds.values():
+                nface = len(data['faces'])
+                nedge = len(data['edge_cylinder']['centers'])
+                nbytes += estimate_mesh_bytes(len(data['vertices']) + 8*nedge, 3*nface + 12*nedge, nface + 6*nedge, 3*nface + 24*nedge)
+            self.check_memory_budget('draw_polyhedras', nbytes, replace = 'polyhedra')
+            for species, polyhedra_data in polyhedra_kinds.items():
+                print('Polyhedra %s'%species)
+                objs = draw_polyhedra_kind(species, polyhedra_data, label = self.label,
+                            coll = self.coll.children['%s_polyhedra'%self.label])
+                names.extend([obj.name for obj in objs])
+            polyhedra_data_cache[self.label] = (key, polyhedra_kinds)
+        # polyhedra of the boundary atoms, translated from their atoms
+        with profiler.stage('boundary polyhedra'):
+            image_kinds = get_image_polyhedra(polyhedra_kinds, image_index, image_offsets, self.cell)
+            for species, polyhedra_data in image_kinds.items():
+                objs = draw_polyhedra_kind(species, polyhedra_data, label = '%s_bd'%self.label,
+                            coll = self.coll.children['%s_polyhedra'%self.label])
+                names.extend([obj.name for obj in objs])
+        self.remove_stale_objects('polyhedra', names)
+        self.coll.blase.polyhedra_key = boundary_key
+    def get_bond_key(self, atoms):
+        """
+        Hash of everything the bond list and polyhedra depend on: positions,
+        species, cell and bond setting. Not the atom scales, so switching
+        model_type does not search the bonds again.
+        """
+        return get_hash(atoms.positions, atoms.info['species'], atoms.cell[:], atoms.pbc,
+                        sorted(self.bondsetting.data.items()))
+    def get_bondlist(self, atoms, key = None):
+        """
+        Return bond pairs of atoms, reuse the last bond search if nothing
+        changed.
+        """
+        if key is None:
+            key = self.get_bond_key(atoms)
+        if self.label in bondlist_cache and bondlist_cache[self.label][0] == key:
+            return bondlist_cache[self.label][1]
+        bondlist = get_bondpairs(atoms, self.bondsetting.data)
+        bondlist_cache[self.label] = (key, bondlist)
+        return bondlist
+    @profiler.timeit('Batoms.molecules')
+    def molecules(self, apply = False):
+        """
+        Find the molecules, i.e. the atoms connected by bonds of the bond
+        setting, and unwrap them across the periodic boundary.
+
+        Parameters:
+
+        apply: bool
+            move the atoms of every molecule next to each other, so that the
+            molecules are whole.
+
+        Return the molecule id of every atom, in the order of self.atoms.
+
+        >>> h2o = Batoms(label = 'h2o', atoms = read('h2o-10-10-10.in'))
+        >>> ids = h2o.molecules(apply = True)
+        """
+        atoms = self.atoms
+        bondlist = self.get_bondlist(atoms)
+        with profiler.stage('get_molecules', atoms = len(atoms)):
+            ids, offsets = get_molecules(len(atoms), bondlist)
+        if apply and offsets.any():
+            positions = atoms.positions + np.dot(offsets, atoms.cell)
+            with self.batch():
+                start = 0
+                for species, batom in self.batoms.items():
+                    batom.positions = positions[start:start + len(batom)]
+                    start += len(batom)
+                self.defer_edit()
+        return ids
+    def set_collection_visible(self, object, visible):
+        """
+        Show or hide a subcollection in viewport and render. Hidden objects
+        are kept, so that they can be shown again without rebuilding.
+        """
+        coll = self.coll.children['%s_%s'%(self.label, object)]
+        coll.hide_viewport = not visible
+        coll.hide_render = not visible
+    @profiler.timeit('Batoms.draw_isosurface')
     def draw_isosurface(self, isosurface = []):
         """
         Draw bonds.
@@ -309,35 +524,108 @@ class Batoms():
             isosurface data.
         """
         object_mode()
+        self.clean_blase_objects('isosurface')
         if not isosurface:
             isosurface = self.isosurface
         volume = self.isosurface[0]
         icolor = 0
         if len(self.isosurface) == 1:
-            draw_isosurface(self.coll.children['%s_isosurface'%self.label], volume, cell = self.atoms.cell, level=None, icolor = icolor)
+            draw_isosurface(self.coll.children['%s_isosurface'%self.label], volume, cell = self.atoms.cell, level=None, icolor = icolor, label = self.label)
         for level in self.isosurface[1:]:
-            draw_isosurface(self.coll.children['%s_isosurface'%self.label], volume, cell = self.atoms.cell, level=level, icolor = icolor)
+            draw_isosurface(self.coll.children['%s_isosurface'%self.label], volume, cell = self.atoms.cell, level=level, icolor = icolor, label = self.label)
             icolor += 1
-    def draw_cavity(self, radius):
+    @profiler.timeit('Batoms.draw_cavity')
+    def draw_cavity(self, radius, step = 1.0):
         """
         cavity
-        for porous materials
+        for porous materials, one sphere at the center of every pore whose
+        points are farther than radius from the atoms, see find_cage.
+
+        step: float
+            grid step in Å, e.g. 0.5 for narrow pores.
+
         >>> from ase.io import read
         >>> atoms = read('docs/source/_static/datas/mof-5.cif')
         """
         from blase.tools import find_cage
         object_mode()
         self.clean_blase_objects('virtual')
-        positions = find_cage(self.cell, self.atoms.positions, radius)
+        with profiler.stage('find_cage') as stage:
+            positions = find_cage(self.cell, self.atoms.positions, radius, step = step, pbc = self.pbc)
+            stage.count(atoms = len(positions))
+        if len(positions) == 0:
+            print('No cavity larger than %s'%radius)
+            return
         ba = Batom(self.label, 'Au_cavity', positions, scale = radius/2.8, material_style='blase', bsdf_inputs=self.bsdf_inputs, color_style=self.color_style)
         self.coll.children['%s_virtual'%self.label].objects.link(ba.batom)
         self.coll.children['%s_virtual'%self.label].objects.link(ba.instancer)
+    @profiler.timeit('Batoms.draw_pores')
+    def draw_pores(self, step = 0.5, probe = 0.0, min_volume = 1.0,
+                   colors = {True: [0.2, 0.5, 1.0, 1.0], False: [1.0, 0.6, 0.1, 1.0]}):
+        """
+        Draw the largest included sphere of every pore, see blase.pore.
+        The spheres are one geometry nodes object with a radius per pore,
+        colored by whether the pore percolates along any cell vector.
+        Needs Blender 3.2.
+
+        step: float
+            grid step in Å.
+        probe: float
+            radius of the probe sphere in Å.
+
+        Return the pores, see get_pores.
+
+        >>> mof = Batoms(label = 'mof', atoms = read('mof-5.cif'))
+        >>> pores = mof.draw_pores(step = 0.5, probe = 1.2)
+        """
+        from blase.pore import get_pores
+        object_mode()
+        self.clean_blase_objects('virtual')
+        pores = get_pores(self.atoms, step = step, probe = probe, min_volume = min_volume)
+        if len(pores['centers']) == 0:
+            print('No pore for a probe of %s'%probe)
+            return pores
+        percolation = pores['percolation'].any(axis = 1)
+        attributes = {'radius': pores['radii'],
+                      'color': np.array([colors[bool(p)] for p in percolation]),
+                      'show': True,
+                      'select': False,
+                      }
+        material = get_atoms_material('material_pores_%s'%self.label,
+                        material_style = self.material_style, bsdf_inputs = self.bsdf_inputs)
+        draw_atoms_nodes('pores_%s'%self.label, self.coll.children['%s_virtual'%self.label],
+                         pores['centers'], attributes, material)
+        return pores
     def clean_blase_objects(self, object):
         """
-        remove all bond object in the bond collection
+        remove all objects in the subcollection, and free their meshes
+        and materials.
+        """
+        remove_objects(self.coll.children['%s_%s'%(self.label, object)].all_objects)
+        if object == 'bond':
+            self.coll.blase.bond_key = ''
+            bond_data_cache.pop(self.label, None)
+        elif object == 'polyhedra':
+            self.coll.blase.polyhedra_key = ''
+            polyhedra_data_cache.pop(self.label, None)
+    def remove_stale_objects(self, object, names):
+        """
+        remove objects in the subcollection which are not in names, e.g.
+        bonds of a kind which does not exist any more.
         """
-        for obj in self.coll.children['%s_%s'%(self.label, object)].all_objects:
-            bpy.data.objects.remove(obj)
+        remove_objects([obj for obj in self.coll.children['%s_%s'%(self.label, object)].all_objects
+                        if obj.name not in names])
+    def purge(self):
+        """
+        Remove all meshes, materials and curves without users, e.g. left by
+        objects deleted by hand. Return the number of removed datablocks.
+
+        >>> h2o.purge()
+        """
+        object_mode()
+        nremoved = purge_orphans()
+        print('Purge: %s datablocks removed.'%nremoved)
+        return nremoved
     def show_index(self, index_type = 0):
         """
         """
@@ -347,6 +635,7 @@ class Batoms():
                 overlay = a.spaces.active.overlay
                 overlay.show_extra_indices = True
                 
+    @profiler.timeit('Batoms.draw')
     def draw(self, model_type = None):
         """
         Draw atoms, bonds, polyhedra.
@@ -359,13 +648,28 @@ class Batoms():
         if not model_type:
             model_type = self.model_type
         else:
-            self.model_type = model_type
+            self.coll.blase.model_type = str(model_type)
+        if self.defer('draw'):
+            return
+        natoms = sum(len(batom) for batom in self.batoms.values())
+        profiler.count(atoms = natoms)
+        undo = self.undo
+        if apply_large_scene_policy(natoms):
+            undo = large_scene_policy['undo']
+        self.update_lod(natoms)
         self.draw_cell()
-        bpy.ops.ed.undo_push()
-        self.clean_blase_objects('bond')
-        bpy.ops.ed.undo_push()
-        self.clean_blase_objects('polyhedra')
-        bpy.ops.ed.undo_push()
+        if self.symmetry:
+            self.draw_symmetry(model_type)
+            undo_push('Draw %s'%self.label, undo)
+            return
+        elif '%s_symmetry'%self.label in self.coll.children:
+            self.clean_symmetry()
+        # bond and polyhedra objects are kept and hidden when the model does
+        # not show them, they are only rebuilt if the geometry changed.
+        if model_type in ['0', '1', '3']:
+            self.set_collection_visible('polyhedra', False)
+        if model_type == '0':
+            self.set_collection_visible('bond', False)
         if model_type == '0':
             for batom in self.batoms.values():
                 batom.scale = 1.0
@@ -400,8 +704,18 @@ class Batoms():
                 batom.scale = 0.01
             # self.clean_atoms
             self.draw_bonds()
+        if self.backend == 'geometry_nodes':
+            self.draw_atoms_backend()
+        self.update_viewport(natoms)
+        if self.coll.blase.frustum and self.backend == 'geometry_nodes':
+            self.update_frustum()
+        if self.chunk_size:
+            self.update_chunk_frustum(verbose = False)
         if self.isosurface:
             self.draw_isosurface()
+        if np.prod(self.replicate) > 1:
+            self.draw_replicate()
+        undo_push('Draw %s'%self.label, undo)
     def replace(self, species1, species2, index = []):
         """
         replace atoms.
@@ -435,7 +749,10 @@ class Batoms():
             ba = Batom(self.label, species2, positions, material_style=self.material_style, bsdf_inputs=self.bsdf_inputs, color_style=self.color_style)
             self.coll.children['%s_atom'%self.label].objects.link(ba.batom)
             self.coll.children['%s_instancer'%self.label].objects.link(ba.instancer)
+            if self.chunk_size:
+                ba.chunk(self.chunk_size, self.cell)
         self.batoms[species1].delete(index)
+        self.defer_edit()
             
     
     def delete(self, species, index = []):
@@ -454,6 +771,69 @@ class Batoms():
 
         """
         self.batoms[species].delete(index)
+        self.defer_edit()
+    @contextmanager
+    def batch(self):
+        """
+        Defer redraws until the end of the block. Boundary search, bond search
+        and mesh updates then run once for the final state.
+
+        >>> with au.batch():
+        ...     au.replace('Au', 'Pt', [0, 1])
+        ...     au.delete('Au', [2])
+        ...     au.bondsetting[('Pt', 'Au')] = [3.0, False, False]
+        ...     au.boundary = 0.1
+        ...     au.model_type = '1'
+        """
+        if self._batch == 0:
+            bondsetting = self.bondsetting.data
+        self._batch += 1
+        completed = False
+        try:
+            yield self
+            completed = True
+        finally:
+            # also on KeyboardInterrupt, or all later redraws stay deferred
+            self._batch -= 1
+            if self._batch == 0:
+                if not completed:
+                    self._pending = set()
+                else:
+                    if self.bondsetting.data != bondsetting:
+                        self._pending.add('draw')
+                    self.flush()
+    def defer(self, task):
+        """
+        Inside batch(), remember the task and return True.
+
+        task: str
+            'boundary', 'cell' or 'draw'
+        """
+        if self._batch:
+            self._pending.add(task)
+            return True
+        return False
+    def defer_edit(self):
+        """
+        Atoms were added or removed, redraw at the end of batch().
+        """
+        if self._batch:
+            self._pending.add('draw')
+            if np.array(self.boundary).any():
+                self._pending.add('boundary')
+    def flush(self):
+        """
+        Run the redraws deferred by batch().
+        """
+        pending = self._pending
+        self._pending = set()
+        if 'boundary' in pending or ('cell' in pending and np.array(self.boundary).any()):
+            self.set_boundary(self.boundary)
+            pending.add('draw')
+        if 'draw' in pending:
+            self.draw()
+        elif 'cell' in pending:
+            self.draw_cell()
     def translate(self, displacement):
         """Translate atomic positions.
 
@@ -551,8 +931,7 @@ class Batoms():
 
     def remove_collection(self, name):
         collection = bpy.data.collections.get(name)
-        for obj in collection.all_objects:
-            bpy.data.objects.remove(obj, do_unlink=True)
+        remove_objects(collection.all_objects)
         for coll in collection.children:
             bpy.data.collections.remove(coll)
         bpy.data.collections.remove(collection)
@@ -577,6 +956,200 @@ class Batoms():
         
         """
         self.__imul__(rep)
+    @property
+    def replicate(self):
+        return self.get_replicate()
+    @replicate.setter
+    def replicate(self, replicate):
+        self.set_replicate(replicate)
+    def get_replicate(self):
+        return np.array(self.coll.blase.replicate)
+    def set_replicate(self, replicate):
+        """
+        Show the cell repeated along the cell vectors, without copying
+        atoms. The atoms, bonds, polyhedra and isosurfaces of the unit cell
+        are shown again as collection instances, offset by the cell
+        vectors, so memory and bond search stay at one cell, and changing
+        the count only adds or removes instances. Bonds are periodic
+        half bonds, the halves of a bond crossing the cell meet in the
+        neighbouring instance. Use repeat to really copy atoms.
+
+        >>> au = Batoms(atoms = bulk('Au', cubic = True), model_type = '1')
+        >>> au.replicate = [10, 10, 10]
+        >>> au.replicate = 1
+        """
+        if isinstance(replicate, int):
+            replicate = [replicate]*3
+        replicate = np.array(replicate, dtype = int)
+        if (replicate < 1).any():
+            raise ValueError('replicate should be at least 1, not %s'%replicate)
+        pbc = self.pbc
+        for i in range(3):
+            if replicate[i] > 1 and not pbc[i]:
+                raise ValueError('Cannot replicate along axis %s, pbc is False, '
+                                 'bonds across the cell would be missing.'%i)
+        self.coll.blase.replicate = replicate
+        self.draw_replicate()
+    def draw_replicate(self):
+        """
+        Build the unit collection, which links the atom, bond, polyhedra
+        and isosurface subcollections, and one collection instance of it
+        per repeated cell.
+        """
+        replicate = self.replicate
+        name = '%s_lattice'%self.label
+        if name not in self.coll.children:
+            self.coll.children.link(bpy.data.collections.new(name))
+        lattice = self.coll.children[name]
+        # the unit is not linked to the scene, only shown by the instances
+        unit_name = '%s_unit'%self.label
+        unit = bpy.data.collections.get(unit_name)
+        if unit is None:
+            unit = bpy.data.collections.new(unit_name)
+        for sub in ['atom', 'instancer', 'bond', 'polyhedra', 'isosurface', 'chunk', 'nodes', 'symmetry']:
+            coll = self.coll.children.get('%s_%s'%(self.label, sub))
+            if coll is not None and coll.name not in unit.children:
+                unit.children.link(coll)
+        cell = self.cell
+        names = set()
+        for i in range(replicate[0]):
+            for j in range(replicate[1]):
+                for k in range(replicate[2]):
+                    if i == j == k == 0: continue
+                    obj_name = 'lattice_%s_%s_%s_%s'%(self.label, i, j, k)
+                    names.add(obj_name)
+                    if obj_name in lattice.objects: continue
+                    obj = bpy.data.objects.new(obj_name, None)
+                    obj.instance_type = 'COLLECTION'
+                    obj.instance_collection = unit
+                    obj.location = np.dot([i, j, k], cell)
+                    obj.empty_display_size = 0.1
+                    lattice.objects.link(obj)
+        remove_objects([obj for obj in lattice.objects if obj.name not in names])
+        # the cell may have changed
+        for obj in lattice.objects:
+            i, j, k = [int(x) for x in obj.name.split('_')[-3:]]
+            obj.location = np.dot([i, j, k], cell)
+        profiler.count(instances = len(names))
+    @property
+    def symmetry(self):
+        return self.get_symmetry()
+    @symmetry.setter
+    def symmetry(self, symmetry):
+        self.set_symmetry(symmetry)
+    def get_symmetry(self):
+        return self.coll.blase.symmetry
+    def set_symmetry(self, symmetry):
+        """
+        Build atoms, bonds and polyhedra of the asymmetric unit only, and
+        show the rest of the cell as instances of it, moved by the symmetry
+        operations found by spglib. Needs spglib. The tolerance is
+        coll.blase.symprec.
+
+        >>> mof = Batoms(atoms = read('mof-5.cif'), model_type = '2')
+        >>> mof.symmetry = True
+        """
+        self.coll.blase.symmetry = symmetry
+        if self.defer('draw'):
+            return
+        self.draw()
+    def get_symmetry_groups(self, atoms):
+        """
+        Return the asymmetric unit and the transforms of its images, reuse
+        the last search if the atoms did not change.
+        """
+        symprec = self.coll.blase.symprec
+        key = get_hash(atoms.positions, atoms.numbers, atoms.cell[:], symprec)
+        if self.label in symmetry_cache and symmetry_cache[self.label][0] == key:
+            return symmetry_cache[self.label][1]
+        with profiler.stage('get_symmetry_groups', atoms = len(atoms)):
+            groups = get_symmetry_groups(atoms, symprec)
+        symmetry_cache[self.label] = (key, groups)
+        return groups
+    @profiler.timeit('Batoms.draw_symmetry')
+    def draw_symmetry(self, model_type):
+        """
+        Every atom a of the asymmetric unit has a site collection, with its
+        sphere, its half bonds and its polyhedron. The atoms which share a
+        transform are a group collection, which links their site
+        collections, and is shown by one empty per transform.
+        """
+        object_mode()
+        print('--------------Draw symmetry--------------')
+        self.clean_symmetry()
+        atoms = self.atoms
+        asym, groups = self.get_symmetry_groups(atoms)
+        batoms = self.batoms
+        for batom in batoms.values():
+            batom.scale = atom_scales[model_type]
+        for sub in ['atom', 'bond', 'polyhedra', 'boundary', 'chunk', 'nodes']:
+            if '%s_%s'%(self.label, sub) in self.coll.children:
+                self.set_collection_visible(sub, False)
+        name = '%s_symmetry'%self.label
+        if name not in self.coll.children:
+            self.coll.children.link(bpy.data.collections.new(name))
+        coll = self.coll.children[name]
+        self.set_collection_visible('symmetry', True)
+        if model_type in ['1', '2', '3']:
+            bondlist = self.get_bondlist(atoms)
+            source = bond_source(vertices = lod_levels[self.coll.blase.lod]['vertices'])
+        # the site collections are not linked to the scene
+        sites = {}
+        for a in asym:
+            site = bpy.data.collections.new('%s_site_%s'%(self.label, a))
+            sites[a] = site
+            batom = batoms[atoms.info['species'][a]]
+            obj = bpy.data.objects.new('symmetry_atom_%s_%s'%(self.label, a), batom.instancer.data)
+            obj.location = atoms.positions[a]
+            obj.scale = batom.instancer.scale
+            set_object_material(obj, batom.material)
+            site.objects.link(obj)
+            label = '%s_site_%s'%(self.label, a)
+            if model_type in ['1', '2', '3'] and a in bondlist:
+                self.calc_bond_data(atoms, {a: bondlist[a]})
+                for species, bond_data in self.bond_kinds.items():
+                    if bond_data['centers']:
+                        draw_bond_kind(species, bond_data, label = label, coll = site, source = source)
+            if model_type == '2':
+                self.calc_polyhedra_data(atoms = atoms, bondlist = {a: bondlist.get(a, [])})
+                for species, polyhedra_data in self.polyhedra_kinds.items():
+                    if polyhedra_data['faces']:
+                        draw_polyhedra_kind(species, polyhedra_data, label = label, coll = site)
+        group_colls = {}
+        for i, (matrix, indices) in enumerate(groups):
+            key = tuple(indices)
+            if key not in group_colls:
+                group = bpy.data.collections.new('%s_group_%s'%(self.label, len(group_colls)))
+                for a in indices:
+                    group.children.link(sites[a])
+                group_colls[key] = group
+            obj = bpy.data.objects.new('symmetry_%s_%s'%(self.label, i), None)
+            obj.instance_type = 'COLLECTION'
+            obj.instance_collection = group_colls[key]
+            obj.matrix_world = Matrix(matrix)
+            obj.empty_display_size = 0.1
+            coll.objects.link(obj)
+        profiler.count(atoms = len(asym), instances = len(groups))
+        print('Asymmetric unit: %s of %s atoms, %s transforms.'%(len(asym), len(atoms), len(groups)))
+    def clean_symmetry(self):
+        """
+        Remove the symmetry instances, and show the full cell again.
+        """
+        prefixes = ['%s_site_'%self.label, '%s_group_'%self.label]
+        colls = [coll for coll in bpy.data.collections
+                 if any(coll.name.startswith(prefix) for prefix in prefixes)]
+        objs = [obj for coll in colls for obj in coll.objects]
+        name = '%s_symmetry'%self.label
+        if name in self.coll.children:
+            objs.extend(self.coll.children[name].objects)
+        remove_objects(objs)
+        for coll in colls:
+            bpy.data.collections.remove(coll)
+        if not self.symmetry:
+            for sub in ['atom', 'boundary']:
+                self.set_collection_visible(sub, True)
+            if name in self.coll.children:
+                self.set_collection_visible('symmetry', False)
     def __mul__(self, rep):
         self.repeat(rep)
         return self
@@ -655,6 +1228,8 @@ class Batoms():
             M = np.linalg.solve(oldcell.complete(), cell.complete())
             for ba in self.batoms.values():
                 ba.set_positions(np.dot(ba.get_positions(), M))
+        if self.defer('cell'):
+            return
         self.draw_cell()
     @property
     def pbc(self):
@@ -676,6 +1251,7 @@ class Batoms():
         self.set_boundary(boundary)
     def get_boundary(self):
         return np.array(self.coll.blase.boundary)
+    @profiler.timeit('Batoms.set_boundary')
     def set_boundary(self, boundary):
         """
         >>> from blase.batoms import Batoms
@@ -684,18 +1260,169 @@ class Batoms():
         >>> tio2 = Batoms(label = 'tio2', atoms = atoms, model_type = '2', polyhedra_dict = {'Ti': ['O']}, color_style="VESTA")
         >>> tio2.boundary = 0.5
         """
-        self.clean_blase_objects('boundary')
         if isinstance(boundary, (int, float)):
             boundary = [boundary]*3
-        flag =  np.array(boundary[:]) > 0.0
-        if self.atoms.pbc.any() and flag.any():
-            for species, batom in self.batoms.items():
-                positions = search_pbc(batom.positions, self.cell, boundary)
-                ba = Batom(self.label, '%s_bd'%species, positions, scale = batom.scale)
-                self.coll.children['%s_boundary'%self.label].objects.link(ba.batom)
-                self.batoms_boundary['%s_bd'%species] = ba
+        if self.defer('boundary'):
+            self.coll.blase.boundary = boundary
+            return
+        boundary = np.array(boundary[:], dtype = float)
+        search_pairs = [key for key, value in self.bondsetting.data.items() if value[2]]
+        atoms = self.atoms
+        if not (atoms.pbc.any() and ((boundary > 0.0).any() or search_pairs)):
+            self.clean_blase_objects('boundary')
+        else:
+            cell = self.cell
+            batoms = self.batoms
+            batoms_boundary = self.batoms_boundary
+            windows = {}
+            for species, batom in batoms.items():
+                windows[species] = self.get_boundary_window(batom, batoms_boundary.get('%s_bd'%species), cell, boundary)
+            searches = {}
+            if search_pairs:
+                searches = self.get_search_images(atoms, batoms, windows, search_pairs)
+            for species, batom in batoms.items():
+                self.write_boundary(batom, batoms_boundary.get('%s_bd'%species), cell, boundary,
+                                    windows[species], searches.get(species))
         self.coll.blase.boundary = boundary
-        # todo: update bond and polyhedra
+        # bonds and polyhedra of the boundary atoms, the others are kept
+        if not self.symmetry:
+            if self.model_type in ['1', '2', '3']:
+                self.draw_bonds()
+            if self.model_type == '2':
+                self.draw_polyhedras()
+    def get_boundary_window(self, batom, ba, cell, boundary):
+        """
+        Return the (index, offsets) of the images of one species within the
+        boundary. The images are cached on the boundary object with their
+        atom ('source'), cell offset ('offset') and scaled position
+        ('scaled'). If the atoms did not move, a smaller boundary only
+        removes images, selected by their scaled position, and a larger one
+        only adds the new images.
+        """
+        positions = batom.positions
+        cached = ba is not None and len(ba) > 0 and ba.batom.data.attributes.get('scaled') is not None
+        if cached:
+            old_boundary = np.array(ba.batom.batom.boundary)
+            mesh = ba.batom.data
+            index = get_attribute(mesh, 'source', 'INT')
+            offsets = np.round(get_attribute(mesh, 'offset', 'FLOAT_VECTOR')).astype(int)
+            # the cache is valid if the images are still images of the atoms
+            cached = index.max() < len(positions) and \
+                     np.allclose(positions[index] + np.dot(offsets, cell), ba.positions, atol = 1e-4)
+        if cached:
+            # images added by the bond search are searched again
+            window = ~get_attribute(mesh, 'search', 'BOOLEAN')
+            scaled = get_attribute(mesh, 'scaled', 'FLOAT_VECTOR')[window]
+            index, offsets = index[window], offsets[window]
+        if cached and (boundary <= old_boundary).all():
+            inside = (scaled > -boundary) & (scaled < 1 + boundary)
+            keep = np.all(inside | (offsets == 0), axis = 1)
+            return index[keep], offsets[keep]
+        with profiler.stage('search_pbc') as stage:
+            bdpos, new_index, new_offsets = search_pbc(positions, cell, boundary)
+            stage.count(atoms = len(bdpos))
+        if not cached:
+            return new_index, new_offsets
+        # keep the order of the images which stay, add the others
+        old_keys = set(zip(index, *offsets.T))
+        new_keys = set(zip(new_index, *new_offsets.T))
+        keep = np.array([key in new_keys for key in zip(index, *offsets.T)], dtype = bool)
+        add = np.array([key not in old_keys for key in zip(new_index, *new_offsets.T)], dtype = bool)
+        return (np.concatenate([index[keep], new_index[add]]).astype(int),
+                np.concatenate([offsets[keep], new_offsets[add]]).astype(int))
+    def get_search_images(self, atoms, batoms, windows, search_pairs):
+        """
+        Complete molecules and polyhedra across the cell: follow the bonds
+        with the search flag from the atoms in the cell and the boundary
+        images, see search_bonded_images. Return {species: (index, offsets)}
+        of the added images.
+        """
+        starts = {}
+        start = 0
+        index = [np.arange(len(atoms))]
+        offsets = [np.zeros((len(atoms), 3), dtype = int)]
+        # same order as batoms2atoms
+        for species, batom in batoms.items():
+            starts[species] = start
+            index.append(windows[species][0] + start)
+            offsets.append(windows[species][1].reshape(-1, 3))
+            start += len(batom)
+        bondlist = self.get_bondlist(atoms)
+        with profiler.stage('search_bonded_images') as stage:
+            new_index, new_offsets = search_bonded_images(bondlist, atoms.info['species'], search_pairs,
+                                                          np.concatenate(index), np.concatenate(offsets))
+            stage.count(atoms = len(new_index))
+        searches = {}
+        for species, start in starts.items():
+            mask = (new_index >= start) & (new_index < start + len(batoms[species]))
+            searches[species] = (new_index[mask] - start, new_offsets[mask])
+        return searches
+    def write_boundary(self, batom, ba, cell, boundary, window, search = None):
+        """
+        Write the images of one species to its boundary object: the images
+        within the boundary, then the images added by the bond search. The
+        mesh is not touched if the images did not change.
+        """
+        index, offsets = window
+        flags = np.zeros(len(index), dtype = bool)
+        if search is not None and len(search[0]):
+            index = np.concatenate([index, search[0]])
+            offsets = np.concatenate([offsets.reshape(-1, 3), search[1]])
+            flags = np.concatenate([flags, np.ones(len(search[0]), dtype = bool)])
+        index = np.asarray(index, dtype = int)
+        offsets = np.asarray(offsets, dtype = int).reshape(-1, 3)
+        positions = batom.positions
+        if ba is not None and len(ba) == len(index) and ba.batom.data.attributes.get('search') is not None:
+            mesh = ba.batom.data
+            if np.array_equal(get_attribute(mesh, 'source', 'INT'), index) and \
+               np.array_equal(np.round(get_attribute(mesh, 'offset', 'FLOAT_VECTOR')), offsets) and \
+               np.array_equal(get_attribute(mesh, 'search', 'BOOLEAN'), flags) and \
+               np.allclose(positions[index] + np.dot(offsets, cell), ba.positions, atol = 1e-4):
+                ba.batom.batom.boundary = boundary
+                return
+        bdpos = positions[index] + np.dot(offsets, cell)
+        profiler.count(atoms = len(bdpos))
+        self.check_memory_budget('set_boundary', estimate_mesh_bytes(len(bdpos)))
+        if len(bdpos) == 0:
+            if ba is not None:
+                remove_objects([ba.batom, ba.instancer])
+            return
+        if ba is None:
+            ba = Batom(self.label, '%s_bd'%batom.species, bdpos, scale = batom.scale)
+            self.coll.children['%s_boundary'%self.label].objects.link(ba.batom)
+            self.coll.children['%s_boundary'%self.label].objects.link(ba.instancer)
+        else:
+            mesh = ba.batom.data
+            if len(mesh.vertices) != len(bdpos):
+                mesh.clear_geometry()
+                mesh.vertices.add(len(bdpos))
+            local_positions = bdpos - np.array(ba.batom.location)
+            mesh.vertices.foreach_set('co', local_positions.astype(np.float32).ravel())
+        mesh = ba.batom.data
+        scaled = np.linalg.solve(cell.T, positions[index].T).T + offsets
+        set_attribute(mesh, 'source', index.astype(np.int32))
+        set_attribute(mesh, 'offset', offsets.astype(np.float32))
+        set_attribute(mesh, 'scaled', scaled.astype(np.float32))
+        set_attribute(mesh, 'search', flags)
+        ba.batom.batom.boundary = boundary
+    def get_boundary_images(self):
+        """
+        Return the index in self.atoms and the cell offset of every
+        boundary image.
+        """
+        batoms_boundary = self.batoms_boundary
+        index = [np.zeros(0, dtype = int)]
+        offsets = [np.zeros((0, 3), dtype = int)]
+        start = 0
+        # same order as batoms2atoms
+        for species, batom in self.batoms.items():
+            ba = batoms_boundary.get('%s_bd'%species)
+            if ba is not None and len(ba) > 0 and ba.batom.data.attributes.get('source') is not None:
+                mesh = ba.batom.data
+                index.append(get_attribute(mesh, 'source', 'INT') + start)
+                offsets.append(np.round(get_attribute(mesh, 'offset', 'FLOAT_VECTOR')).astype(int))
+            start += len(batom)
+        return np.concatenate(index), np.concatenate(offsets)
     @property
     def model_type(self):
         return self.get_model_type()
@@ -706,6 +1433,8 @@ class Batoms():
         return np.array(self.coll.blase.model_type)
     def set_model_type(self, model_type):
         self.coll.blase.model_type = str(model_type)
+        if self.defer('draw'):
+            return
         self.draw()
     @property
     def show_unit_cell(self):
@@ -717,8 +1446,615 @@ class Batoms():
         return self.coll.blase.show_unit_cell
     def set_show_unit_cell(self, show_unit_cell):
         self.coll.blase.show_unit_cell = show_unit_cell
+        if self.defer('cell'):
+            return
         self.draw_cell()
     @property
+    def memory_budget(self):
+        return self.get_memory_budget()
+    @memory_budget.setter
+    def memory_budget(self, memory_budget):
+        self.set_memory_budget(memory_budget)
+    def get_memory_budget(self):
+        return self.coll.blase.memory_budget
+    def set_memory_budget(self, memory_budget):
+        """
+        memory_budget: float
+            in MB, 0 or None for no limit.
+        """
+        if not memory_budget:
+            memory_budget = 0.0
+        self.coll.blase.memory_budget = memory_budget
+    @property
+    def backend(self):
+        return self.get_backend()
+    @backend.setter
+    def backend(self, backend):
+        self.set_backend(backend)
+    def get_backend(self):
+        return self.coll.blase.backend
+    def set_backend(self, backend):
+        """
+        backend: str
+            'instancer' or 'geometry_nodes'
+
+        >>> au.backend = 'geometry_nodes'
+        >>> au.set_attribute('radius', 0.5, index = [0, 1])
+        """
+        if backend not in ['instancer', 'geometry_nodes']:
+            raise ValueError("backend should be 'instancer' or 'geometry_nodes', not %s"%backend)
+        self.coll.blase.backend = backend
+        if self.defer('draw'):
+            return
+        self.draw_atoms_backend()
+    def draw_atoms_backend(self):
+        """
+        Show the atoms with the current backend, hide the other one.
+        """
+        nodes = self.backend == 'geometry_nodes'
+        chunked = self.chunk_size > 0
+        for batom in self.batoms.values():
+            batom.batom.hide_viewport = nodes or chunked
+            batom.batom.hide_render = nodes or chunked
+        if '%s_chunk'%self.label in self.coll.children:
+            self.set_collection_visible('chunk', chunked and not nodes)
+        if nodes:
+            self.draw_atoms_nodes()
+        elif '%s_nodes'%self.label in self.coll.children:
+            self.set_collection_visible('nodes', False)
+    def draw_atoms_nodes(self):
+        """
+        Build or update the geometry nodes atoms object from the species.
+        Radius, color and color_index are set from the species, show and
+        select are kept unless the number of atoms changed.
+        """
+        name = '%s_nodes'%self.label
+        if name not in self.coll.children:
+            self.coll.children.link(bpy.data.collections.new(name))
+        self.set_collection_visible('nodes', True)
+        positions = []
+        radius = []
+        color = []
+        color_index = []
+        for i, batom in enumerate(self.batoms.values()):
+            n = len(batom)
+            positions.append(batom.positions)
+            # all vertices of the uv sphere are on its radius
+            radius.append(np.full(n, batom.instancer.data.vertices[0].co.length*batom.instancer.scale[0]))
+            color.append(np.tile(batom.material.diffuse_color, (n, 1)))
+            color_index.append(np.full(n, i))
+        positions = np.concatenate(positions)
+        attributes = {'radius': np.concatenate(radius),
+                      'color': np.concatenate(color),
+                      'color_index': np.concatenate(color_index),
+                      }
+        obj_name = 'atoms_nodes_%s'%self.label
+        if obj_name not in bpy.data.objects or len(bpy.data.objects[obj_name].data.vertices) != len(positions):
+            attributes['show'] = True
+            attributes['select'] = False
+            attributes['culled'] = False
+            attributes['outside'] = False
+        material = get_atoms_material('material_atoms_nodes_%s'%self.label,
+                        material_style = self.material_style, bsdf_inputs = self.bsdf_inputs)
+        return draw_atoms_nodes(obj_name, self.coll.children[name], positions, attributes, material)
+    def get_nodes_object(self):
+        if self.backend != 'geometry_nodes':
+            raise Exception("Per-atom attributes need backend = 'geometry_nodes'.")
+        name = 'atoms_nodes_%s'%self.label
+        if name not in bpy.data.objects:
+            return self.draw_atoms_nodes()
+        return bpy.data.objects[name]
+    def set_attribute(self, name, values, index = None):
+        """
+        Write per-atom values, e.g. radius, color, show or select, in one
+        call. Atoms are in the order of self.atoms.
+
+        index: list
+            only change these atoms.
+
+        >>> au.set_attribute('show', False, index = [0, 1, 2])
+        >>> au.set_attribute('color', [[1, 0, 0, 1]]*len(au.atoms))
+        """
+        set_attribute(self.get_nodes_object().data, name, values, index)
+    def get_attribute(self, name):
+        """
+        Return per-atom values of an attribute as an array.
+        """
+        return get_attribute(self.get_nodes_object().data, name)
+    def color_by(self, values, colormap = 'viridis', vmin = None, vmax = None):
+        """
+        Color atoms by per-atom values, e.g. charge, layer or force, with the
+        geometry nodes backend. Recoloring is one attribute write, no species
+        is added.
+
+        values: array
+            (natoms,), or (nframes, natoms) for one color per frame, updated
+            by a frame change handler. Atoms are in the order of self.atoms.
+            None to color by species again.
+        colormap: str
+            'viridis', 'plasma', 'coolwarm', 'jet', 'gray', or a matplotlib
+            colormap name.
+        vmin, vmax: float
+            values mapped to the ends of the colormap, default min and max.
+
+        >>> charges = np.random.random(len(pt.atoms))
+        >>> pt.color_by(charges, colormap = 'coolwarm', vmin = 0, vmax = 1)
+        """
+        if self.backend != 'geometry_nodes':
+            self.backend = 'geometry_nodes'
+        obj = self.get_nodes_object()
+        mesh = obj.data
+        for name in [att.name for att in mesh.attributes if att.name.startswith('color_value_')]:
+            mesh.attributes.remove(mesh.attributes[name])
+        self.coll.blase.color_by_frames = 0
+        if values is None:
+            set_material_colormap(obj.data.materials[0], None)
+            return
+        values = np.asarray(values, dtype = float)
+        if values.shape[-1] != len(mesh.vertices):
+            raise ValueError('values has %s atoms, Batoms has %s.'%(values.shape[-1], len(mesh.vertices)))
+        if vmin is None:
+            vmin = values.min()
+        if vmax is None:
+            vmax = values.max()
+        if vmax > vmin:
+            values = np.clip((values - vmin)/(vmax - vmin), 0.0, 1.0)
+        else:
+            values = np.zeros(values.shape)
+        if values.ndim == 2:
+            for i, frame_values in enumerate(values):
+                set_attribute(mesh, 'color_value_%s'%i, frame_values)
+            self.coll.blase.color_by_frames = len(values)
+            register_color_by_frame_handler()
+            frame = self.scene.frame_current - self.scene.frame_start
+            values = values[min(max(frame, 0), len(values) - 1)]
+        set_attribute(mesh, 'color_value', values)
+        set_material_colormap(obj.data.materials[0], colormap)
+    @property
+    def quality(self):
+        return self.get_quality()
+    @quality.setter
+    def quality(self, quality):
+        self.set_quality(quality)
+    def get_quality(self):
+        return self.coll.blase.quality
+    def set_quality(self, quality):
+        """
+        quality: str
+            'auto', 'low', 'medium', 'high' or 'ultra'
+
+        The atom spheres are switched at once, bonds at the next draw.
+        """
+        if quality != 'auto' and quality not in lod_levels:
+            raise ValueError('quality should be auto or one of %s, not %s'%(list(lod_levels), quality))
+        self.coll.blase.quality = quality
+        if self.defer('draw'):
+            return
+        self.update_lod()
+    def get_atom_pixels(self):
+        """
+        Mean diameter of an atom on the image in pixels, for an orthographic
+        camera. None otherwise.
+        """
+        camera = self.scene.camera
+        if camera is None or camera.data.type != 'ORTHO':
+            return None
+        render = self.scene.render
+        resolution = max(render.resolution_x, render.resolution_y)*render.resolution_percentage/100.0
+        radius = np.mean([batom.radius*batom.scale[0] for batom in self.batoms.values()])
+        return 2*radius/camera.data.ortho_scale*resolution
+    def update_lod(self, natoms = None):
+        """
+        Choose the level of detail and switch the instancer meshes to the
+        shared sphere of this level. No object is rebuilt.
+        Return the level.
+        """
+        batoms = self.batoms
+        if natoms is None:
+            natoms = sum(len(batom) for batom in batoms.values())
+        level = get_lod(natoms, self.get_atom_pixels(), self.quality)
+        lod = lod_levels[level]
+        sphere = get_sphere_mesh(lod['segments'], lod['ring_count'])
+        for batom in list(batoms.values()) + list(self.batoms_boundary.values()):
+            instancer = batom.instancer
+            # instancers built before the shared sphere have the radius in the mesh
+            if instancer.batom.radius > 0 and instancer.data != sphere:
+                instancer.data = sphere
+            # chunk instancers share the sphere of the species instancer
+            for chunk_instancer in batom.get_chunk_instancers():
+                if chunk_instancer.data != instancer.data:
+                    chunk_instancer.data = instancer.data
+        obj = bpy.data.objects.get('atoms_nodes_%s'%self.label)
+        if obj is not None and 'blase_atoms' in obj.modifiers:
+            set_modifier_input(obj.modifiers['blase_atoms'], 'Segments', lod['segments'])
+            set_modifier_input(obj.modifiers['blase_atoms'], 'Rings', lod['ring_count'])
+            obj.update_tag()
+        self.coll.blase.lod = level
+        return level
+    @property
+    def viewport(self):
+        return self.get_viewport()
+    @viewport.setter
+    def viewport(self, viewport):
+        self.set_viewport(viewport)
+    def get_viewport(self):
+        return self.coll.blase.viewport
+    def set_viewport(self, viewport):
+        """
+        viewport: str
+            'auto', 'full' or 'proxy'
+        """
+        if viewport not in ['auto', 'full', 'proxy']:
+            raise ValueError("viewport should be 'auto', 'full' or 'proxy', not %s"%viewport)
+        self.coll.blase.viewport = viewport
+        if self.defer('draw'):
+            return
+        self.update_viewport()
+    def update_viewport(self, natoms = None):
+        """
+        Show the full model or the proxy in the viewport. Only display
+        settings change, the render uses the full model in both cases.
+        Return True if the proxy is used.
+        """
+        batoms = self.batoms
+        if natoms is None:
+            natoms = sum(len(batom) for batom in batoms.values())
+        viewport = self.viewport
+        proxy = viewport == 'proxy' or (viewport == 'auto' and natoms >= viewport_policy['natoms'])
+        display_type = 'BOUNDS' if proxy else 'TEXTURED'
+        for batom in list(batoms.values()) + list(self.batoms_boundary.values()):
+            batom.instancer.display_type = display_type
+            for instancer in batom.get_chunk_instancers():
+                instancer.display_type = display_type
+        for object in ['bond', 'polyhedra']:
+            for obj in self.coll.children['%s_%s'%(self.label, object)].all_objects:
+                obj.display_type = display_type
+        obj = bpy.data.objects.get('atoms_nodes_%s'%self.label)
+        if obj is not None and 'blase_atoms' in obj.modifiers:
+            set_modifier_input(obj.modifiers['blase_atoms'], 'Viewport Points', proxy)
+            obj.update_tag()
+        return proxy
+    def cull(self, cull = True, resolution = 0.2, coordination = None):
+        """
+        Hide atoms which can not be seen from any direction, and bonds
+        between them, for renders with opaque atoms. Uses the 'show'
+        attribute of the geometry nodes backend, cull(False) shows them again.
+
+        The voxel test is conservative (see tools.get_buried_atoms): a visible atom
+        is never hidden. Only atoms are occluders: bonds are culled, but
+        they do not hide anything.
+
+        resolution: float
+            voxel size in Angstrom. The voxels must fit in the gaps between
+            the atoms, e.g. 0.1 for overlapping metal atoms.
+        coordination: int
+            also hide atoms whose neighbours in the bond list all have at
+            least coordination bonds, e.g. 12 for fcc metals, see
+            tools.get_bulk_atoms. This culls touching spheres too, but it
+            is not exact: slivers of these atoms can be seen through the
+            gaps at grazing angles.
+
+        Return the number of culled atoms and bonds.
+
+        >>> au.backend = 'geometry_nodes'
+        >>> report = au.cull()
+        >>> au.cull(False)
+        """
+        if self.backend != 'geometry_nodes':
+            raise Exception("cull needs backend = 'geometry_nodes'.")
+        mesh = self.get_nodes_object().data
+        show = get_attribute(mesh, 'show')
+        culled = get_attribute(mesh, 'culled')
+        show[culled] = True
+        culled[:] = False
+        if cull:
+            positions, radius = self.get_occluders(mesh, show)
+            index = np.where(show)[0]
+            buried, grid = get_buried_atoms(positions, radius, resolution)
+            culled[index[buried]] = True
+            if coordination is not None:
+                culled |= get_bulk_atoms(len(show), self.get_bondlist(self.atoms), coordination, show)
+            show[culled] = False
+        set_attribute(mesh, 'show', show)
+        set_attribute(mesh, 'culled', culled)
+        self.coll.blase.cull = cull
+        self.coll.blase.cull_resolution = resolution
+        report = {'atoms': int(culled.sum()), 'natoms': len(culled), 'bonds': 0}
+        if self.model_type in ['1', '2', '3']:
+            # the hidden atoms changed, even if the bond key did not
+            self.coll.blase.bond_key = ''
+            bond_data_cache.pop(self.label, None)
+            self.draw_bonds()
+            report['bonds'] = self.culled_bonds
+        print('Culled %s of %s atoms, %s bonds.'%(report['atoms'], report['natoms'], report['bonds']))
+        return report
+    def frustum_cull(self, frustum = True, margin = 2.0):
+        """
+        Only build atoms, bonds and polyhedra inside the view of the scene
+        camera, widened by margin. Atoms outside stay in the species meshes
+        as data, but are not instanced, and their bonds and polyhedra are not
+        built. Redrawn after the camera moved, at the next draw or render.
+        Needs backend = 'geometry_nodes', or chunks (see chunk_size) with the
+        instancer backend, then whole chunks are hidden.
+
+        margin: float
+            in Angstrom, added to the atom radius.
+
+        Return the number of atoms outside.
+
+        >>> au.backend = 'geometry_nodes'
+        >>> au.frustum_cull(margin = 3.0)
+        >>> au.render(output_image = 'site.png')
+        >>> au.frustum_cull(False)
+        """
+        if frustum and self.scene.camera is None:
+            raise Exception('frustum_cull needs a scene camera.')
+        chunked = self.chunk_size and self.backend == 'instancer'
+        if not chunked and self.backend != 'geometry_nodes':
+            raise Exception("frustum_cull needs backend = 'geometry_nodes', or chunk_size with the instancer backend.")
+        self.coll.blase.frustum = frustum
+        self.coll.blase.frustum_margin = margin
+        if chunked:
+            # whole chunks are hidden at the next draw
+            self.draw()
+            return self.update_chunk_frustum()
+        report = self.update_frustum()
+        self.draw()
+        return report
+    def get_frustum_key(self):
+        """
+        Hash of the camera view, None if frustum culling is off.
+        """
+        camera = self.scene.camera
+        # every replicated cell shows the same atoms, nothing can be culled
+        if not self.coll.blase.frustum or camera is None or np.prod(self.replicate) > 1:
+            return None
+        render = self.scene.render
+        return get_hash(np.array(camera.matrix_world), camera.data.type, camera.data.ortho_scale,
+                        camera.data.lens, camera.data.sensor_width, camera.data.clip_start,
+                        camera.data.clip_end, render.resolution_x, render.resolution_y,
+                        self.coll.blase.frustum_margin)
+    def get_frustum_mask(self, positions, radius = 0.0):
+        """
+        Mask of positions seen by the scene camera, None if frustum culling
+        is off.
+        """
+        camera = self.scene.camera
+        if not self.coll.blase.frustum or camera is None or np.prod(self.replicate) > 1:
+            return None
+        render = self.scene.render
+        aspect = render.resolution_x*render.pixel_aspect_x/(render.resolution_y*render.pixel_aspect_y)
+        data = camera.data
+        return get_frustum_mask(positions, np.array(camera.matrix_world), data.type, data.ortho_scale,
+                    data.lens, data.sensor_width, aspect, data.clip_start, data.clip_end,
+                    self.coll.blase.frustum_margin + radius)
+    def filter_bondlist(self, atoms, bondlist):
+        """
+        Keep bonds with at least one atom seen by the camera.
+        """
+        # a margin for the longest bond
+        mask = self.get_frustum_mask(atoms.positions, 3.0)
+        if mask is None:
+            return bondlist
+        return {i: [bond for bond in pairs if mask[i] or mask[bond[0]]]
+                for i, pairs in bondlist.items()}
+    def update_frustum(self):
+        """
+        Hide the atoms outside the camera view with the 'show' attribute,
+        show those hidden before which are inside now.
+        """
+        mesh = self.get_nodes_object().data
+        show = get_attribute(mesh, 'show')
+        outside = get_attribute(mesh, 'outside')
+        show[outside] = True
+        outside[:] = False
+        positions = np.empty(len(mesh.vertices)*3, dtype = np.float32)
+        mesh.vertices.foreach_get('co', positions)
+        mask = self.get_frustum_mask(positions.reshape(-1, 3), get_attribute(mesh, 'radius'))
+        if mask is not None:
+            outside = show & ~mask
+            show[outside] = False
+        set_attribute(mesh, 'show', show)
+        set_attribute(mesh, 'outside', outside)
+        report = {'atoms': int(outside.sum()), 'natoms': len(outside)}
+        print('%s of %s atoms outside the camera view.'%(report['atoms'], report['natoms']))
+        return report
+    def update_chunk_frustum(self, verbose = True):
+        """
+        Hide the chunk objects outside the camera view, show the others.
+        """
+        report = {'chunks': 0, 'nchunks': 0}
+        for batom in self.batoms.values():
+            chunks = list(batom.get_chunks().values())
+            if not chunks:
+                continue
+            corners = np.array([[obj.matrix_world @ Vector(corner) for corner in obj.bound_box]
+                                for obj in chunks])
+            centers = corners.mean(axis = 1)
+            half = np.linalg.norm(corners - centers[:, None, :], axis = 2).max(axis = 1)
+            mask = self.get_frustum_mask(centers, half + batom.radius*np.max(batom.scale))
+            if mask is None:
+                mask = np.ones(len(chunks), dtype = bool)
+            for obj, visible in zip(chunks, mask):
+                obj.hide_viewport = not visible
+                obj.hide_render = not visible
+            report['chunks'] += int((~mask).sum())
+            report['nchunks'] += len(chunks)
+        if verbose:
+            print('%s of %s chunks outside the camera view.'%(report['chunks'], report['nchunks']))
+        return report
+    def get_occluders(self, mesh, mask):
+        """
+        Positions and radii of the atoms in mask, as drawn.
+        """
+        positions = np.empty(len(mesh.vertices)*3, dtype = np.float32)
+        mesh.vertices.foreach_get('co', positions)
+        positions = positions.reshape(-1, 3).astype(float)
+        radius = get_attribute(mesh, 'radius').astype(float)
+        return positions[mask], radius[mask]
+    def cull_bonds(self, bondlinewidth = 0.10):
+        """
+        Remove bonds which can not be seen from bond_kinds, the atoms hidden
+        by cull still hide them.
+        """
+        self.culled_bonds = 0
+        obj = bpy.data.objects.get('atoms_nodes_%s'%self.label)
+        if obj is None:
+            return
+        mesh = obj.data
+        mask = get_attribute(mesh, 'show') | get_attribute(mesh, 'culled') | get_attribute(mesh, 'outside')
+        positions, radius = self.get_occluders(mesh, mask)
+        buried, grid = get_buried_atoms(positions, radius, self.coll.blase.cull_resolution)
+        for kind, datas in self.bond_kinds.items():
+            nbond = len(datas['centers'])
+            if nbond == 0:
+                continue
+            centers = np.array(datas['centers'])
+            normals = np.array(datas['normals'])
+            lengths = np.array(datas['lengths'])
+            # points along the half bond, not more than a voxel apart
+            nsample = int(np.ceil(2*lengths.max()/grid.h)) + 1
+            t = np.linspace(-1, 1, nsample)
+            samples = centers[:, None, :] + t[None, :, None]*(normals*lengths[:, None])[:, None, :]
+            visible = grid.near(samples.reshape(-1, 3), bondlinewidth + grid.half)
+            visible = visible.reshape(nbond, nsample).any(axis = 1)
+            self.culled_bonds += int(nbond - visible.sum())
+            datas['centers'] = list(centers[visible])
+            datas['normals'] = list(normals[visible])
+            datas['lengths'] = list(lengths[visible])
+            datas['indices'] = list(np.array(datas['indices'])[visible])
+            # dashed kinds, e.g. hydrogen bonds, have no verts
+            if len(datas['verts']) == 4*nbond:
+                verts = np.array(datas['verts']).reshape(-1, 4, 3)[visible]
+                datas['verts'] = list(verts.reshape(-1, 3))
+                datas['faces'] = [[4*i + 0, 4*i + 2, 4*i + 1, 4*i + 3] for i in range(len(verts))]
+    @property
+    def chunk_size(self):
+        return self.get_chunk_size()
+    @chunk_size.setter
+    def chunk_size(self, chunk_size):
+        self.set_chunk_size(chunk_size)
+    def get_chunk_size(self):
+        return self.coll.blase.chunk_size
+    def set_chunk_size(self, chunk_size):
+        """
+        Split every species into chunk objects on a grid aligned with the
+        cell, about chunk_size Angstrom per chunk. Edits then only rewrite
+        the chunks they touch, and frustum_cull hides whole chunks. 0 goes
+        back to one object per species.
+
+        >>> au.chunk_size = 10.0
+        >>> au['Au'][10] = [0, 0, 1.5]   # rewrites one or two chunks
+        """
+        if chunk_size < 0:
+            raise ValueError('chunk_size should be positive, not %s'%chunk_size)
+        self.coll.blase.chunk_size = chunk_size
+        cell = self.cell
+        with profiler.stage('Batoms.set_chunk_size'):
+            for batom in self.batoms.values():
+                batom.set_chunk_size(chunk_size, cell)
+        self.draw_atoms_backend()
+        self.update_viewport()
+    @property
+    def undo(self):
+        return self.get_undo()
+    @undo.setter
+    def undo(self, undo):
+        self.set_undo(undo)
+    def get_undo(self):
+        return self.coll.blase.undo
+    def set_undo(self, undo):
+        """
+        undo: str
+            'draw' or 'none'
+        """
+        if undo not in ['draw', 'none']:
+            raise ValueError("undo should be 'draw' or 'none', not %s"%undo)
+        self.coll.blase.undo = undo
+    def check_memory_budget(self, stage, nbytes, replace = None):
+        """
+        Call on_memory_budget if the current memory plus nbytes, which a draw
+        will add, exceeds the memory budget.
+
+        replace: str
+            subcollection whose objects the draw will replace.
+        """
+        budget = self.memory_budget*1e6
+        if not budget or self.on_memory_budget is None:
+            return
+        report = self.memory_report(verbose = False)
+        total = report['total']['bytes'] + nbytes
+        if replace:
+            total -= report[replace]['bytes']
+        if total > budget:
+            self.on_memory_budget(self, stage, total, budget)
+    def memory_report(self, verbose = True):
+        """
+        Count objects, meshes, materials, vertices, faces and loops, and
+        estimate the bytes used per subcollection, plus the animation data
+        and the worst case of the undo history.
+
+        >>> h2o.memory_report()
+        """
+        keys = ['objects', 'meshes', 'materials', 'instances', 'verts', 'edges', 'faces', 'loops', 'bytes']
+        report = {}
+        total = {key: 0 for key in keys}
+        animation = {'fcurves': 0, 'keyframes': 0, 'bytes': 0}
+        for coll in self.coll.children:
+            name = coll.name[len(self.label) + 1:]
+            data = {key: 0 for key in keys}
+            meshes = set()
+            materials = set()
+            for obj in coll.all_objects:
+                data['objects'] += 1
+                for slot in obj.material_slots:
+                    if slot.material:
+                        materials.add(slot.material.name)
+                for id_data in [obj, obj.data]:
+                    if id_data is None: continue
+                    for key, value in animation_memory(id_data).items():
+                        animation[key] += value
+                if obj.type != 'MESH':
+                    continue
+                if obj.instance_type == 'VERTS' and obj.children:
+                    data['instances'] += len(obj.data.vertices)*len(obj.children)
+                if obj.data.name in meshes:
+                    continue
+                meshes.add(obj.data.name)
+                for key, value in mesh_memory(obj.data).items():
+                    data[key] += value
+            data['meshes'] = len(meshes)
+            data['materials'] = len(materials)
+            report[name] = data
+            for key in keys:
+                total[key] += data[key]
+        total['bytes'] += animation['bytes']
+        report['animation'] = animation
+        report['total'] = total
+        edit = bpy.context.preferences.edit
+        report['undo'] = {'steps': edit.undo_steps,
+                          'memory_limit': edit.undo_memory_limit,
+                          'bytes': edit.undo_steps*total['bytes'],
+                          }
+        if verbose:
+            print(self.format_memory_report(report))
+        return report
+    def format_memory_report(self, report):
+        s = '-'*84 + '\n'
+        s += '{0:14s} {1:>7s} {2:>7s} {3:>9s} {4:>10s} {5:>10s} {6:>10s} {7:>10s}\n'.format(
+             'collection', 'objects', 'meshes', 'materials', 'instances', 'verts', 'faces', 'MB')
+        for name, data in report.items():
+            if name in ['animation', 'undo']: continue
+            s += '{0:14s} {1:7d} {2:7d} {3:9d} {4:10d} {5:10d} {6:10d} {7:10.2f}\n'.format(
+                name, data['objects'], data['meshes'], data['materials'], data['instances'],
+                data['verts'], data['faces'], data['bytes']/1e6)
+        data = report['animation']
+        s += 'animation: {0} fcurves, {1} keyframes, {2:.2f} MB\n'.format(data['fcurves'], data['keyframes'], data['bytes']/1e6)
+        data = report['undo']
+        s += 'undo: {0} steps, limit {1} MB, worst case {2:.2f} MB\n'.format(data['steps'], data['memory_limit'], data['bytes']/1e6)
+        s += '-'*84 + '\n'
+        return s
+    @property
     def atoms(self):
         return self.get_atoms()
     def get_atoms(self):
@@ -748,6 +2084,18 @@ class Batoms():
             species.append(ba.species)
         return species
     @property
+    def batoms_boundary(self):
+        return self.get_batoms_boundary()
+    def get_batoms_boundary(self):
+        """
+        build the dict of boundary batom from the boundary collection.
+        """
+        batoms = {}
+        for ba in self.coll.children['%s_boundary'%self.label].objects:
+            if ba.is_batom:
+                batoms[ba.species] = Batom(from_batom=ba.name)
+        return batoms
+    @property
     def batoms(self):
         return self.get_batoms()
     def get_batoms(self):
@@ -820,11 +2168,15 @@ class Batoms():
         # Draw atoms
         #
         object_mode()
-        coll_highlight = bpy.data.collections.new('highlight')
-        self.coll.children.link(coll_highlight)
+        name = '%s_highlight'%self.label
+        if name in self.coll.children:
+            coll_highlight = self.coll.children[name]
+            remove_objects(coll_highlight.all_objects)
+        else:
+            coll_highlight = bpy.data.collections.new(name)
+            self.coll.children.link(coll_highlight)
         # build materials
-        material = bpy.data.materials.new('highlight')
-        material.name = 'highlight'
+        material = bpy.data.materials.new('highlight_%s'%self.label)
         material.diffuse_color = color + (transmit,)
         # material.alpha_threshold = 0.2
         material.blend_method = 'BLEND'
@@ -845,6 +2197,7 @@ class Batoms():
             ball.data.materials.append(material)
             ball.show_transparent = True
             coll_highlight.objects.link(ball)
+    @profiler.timeit('Batoms.load_frames')
     def load_frames(self, images = None):
         """
         images: list
@@ -869,6 +2222,7 @@ class Batoms():
             index = [atom.index for atom in atoms if atoms.info['species'][atom.index] == species]
             ba.load_frames(positions[:, index])
     
+    @profiler.timeit('Batoms.render')
     def render(self, bbox = None, output_image = None, animation = False, **kwargs):
         """
         Render the atoms, and save to a png image.
@@ -892,31 +2246,29 @@ class Batoms():
         for function in bobj.functions:
             name, paras = function
             getattr(bobj, name)(**paras)
+        if self.coll.blase.frustum:
+            # the camera is set now, rebuild what it sees
+            self.draw()
         # bobj.load_frames()
         bobj.render()
     def calc_bond_data(self, atoms, bondlist):
         """
         """
         bond_kinds = {}
-        batoms = self.batoms
         for ind1, pairs in bondlist.items():
             kind1 = atoms.info['species'][ind1]
             element = kind1.split('_')[0]
             bond_kind = get_bond_kind(element)
+            bond_kind['indices'] = []
             if kind1 not in bond_kinds:
                 bond_kinds[kind1] = bond_kind
             # print(ind1, kind, pairs)
             for bond in pairs:
                 ind2, offset = bond
-                kind2 = atoms.info['species'][ind2]
                 R = np.dot(offset, atoms.cell)
-                vec = atoms.positions[ind1] - (atoms.positions[ind2] + R)
-                length = np.linalg.norm(vec)
-                nvec = vec/length
-                radius1 = covalent_radii[chemical_symbols.index(kind1.split('_')[0])]
-                radius2 = covalent_radii[chemical_symbols.index(kind2.split('_')[0])]
-                pos = [atoms.positions[ind1] - nvec*radius1*batoms[kind1].scale[0]*0.5,
-                    atoms.positions[ind2] + R + nvec*radius2*batoms[kind2].scale[0]*0.5]
+                # the half bonds start at the atom centers, hidden by the
+                # spheres at any scale, so they do not depend on model_type
+                pos = [atoms.positions[ind1], atoms.positions[ind2] + R]
                 center0 = (pos[0] + pos[1])/2.0
                 vec = pos[0] - pos[1]
                 length = np.linalg.norm(vec)
@@ -930,6 +2282,7 @@ class Batoms():
                 #
                 center = (center0 + pos[0])/2.0
                 bond_kinds[kind1]['centers'].append(center)
+                bond_kinds[kind1]['indices'].append(ind1)
                 bond_kinds[kind1]['lengths'].append(length/4.0)
                 bond_kinds[kind1]['normals'].append(nvec)
                 nvert = len(bond_kinds[kind1]['verts'])
@@ -941,6 +2294,48 @@ class Batoms():
         for kind, bond_data in bond_kinds.items():
             self.batoms[kind].bond_data = bond_data
         self.bond_kinds = bond_kinds
+    def get_hydrogen_bondlist(self, atoms):
+        """
+        Return the hydrogen bonds (i, j, offsets) of atoms, see
+        get_hydrogen_bonds.
+        """
+        hydrogen_bond = self.hydrogen_bond
+        if isinstance(hydrogen_bond, (int, float)):
+            hydrogen_bond = [hydrogen_bond]
+        return get_hydrogen_bonds(atoms, *hydrogen_bond)
+    def calc_hydrogen_bond_data(self, atoms, hydrogen_bondlist, dash = 0.3):
+        """
+        Dashed bonds from the hydrogen atoms to the acceptors, added to
+        bond_kinds as the 'hydrogen_bond' kind. Every bond is cut into
+        cylinders of length dash/2, dash apart.
+        """
+        i, j, offsets = hydrogen_bondlist
+        bond_kind = get_bond_kind('H', props = {'color': [0.3, 0.6, 1.0], 'bondlinewidth': 0.04})
+        bond_kind['indices'] = []
+        self.bond_kinds['hydrogen_bond'] = bond_kind
+        if len(i) == 0:
+            return
+        species = np.array(atoms.info['species'])
+        batoms = self.batoms
+        radii = {kind: covalent_radii[chemical_symbols.index(kind.split('_')[0])]*batoms[kind].scale[0]*0.5
+                 for kind in set(species[i]) | set(species[j])}
+        pos1 = atoms.positions[i]
+        pos2 = atoms.positions[j] + np.dot(offsets, atoms.cell)
+        vec = pos1 - pos2
+        nvec = vec/np.linalg.norm(vec, axis = 1)[:, None]
+        # from the surface of the hydrogen to the surface of the acceptor
+        pos1 = pos1 - nvec*np.array([radii[kind] for kind in species[i]])[:, None]
+        pos2 = pos2 + nvec*np.array([radii[kind] for kind in species[j]])[:, None]
+        lengths = np.linalg.norm(pos1 - pos2, axis = 1)
+        ndash = np.maximum(np.round(lengths/dash).astype(int), 1)
+        bond = np.repeat(np.arange(len(i)), ndash)
+        step = np.arange(ndash.sum()) - np.repeat(np.cumsum(ndash) - ndash, ndash)
+        t = (step + 0.5)/ndash[bond]
+        centers = pos1[bond] - (pos1 - pos2)[bond]*t[:, None]
+        bond_kind['centers'] = list(centers)
+        bond_kind['normals'] = list(nvec[bond] + 1e-8)
+        bond_kind['lengths'] = list(lengths[bond]/ndash[bond]/4.0)
+        bond_kind['indices'] = list(i[bond])
     def calc_polyhedra_data(self, atoms = None, bondlist = {}, transmit = 0.8, polyhedra_dict = {}):
         """
         Two modes:
@@ -948,7 +2343,6 @@ class Batoms():
         polyhedra_dict: {'kind': ligands}
         """
         from scipy.spatial import ConvexHull
-        tstart = time.time()
         polyhedra_kinds = {}
         if not polyhedra_dict:
             polyhedra_dict = {}
@@ -964,10 +2358,13 @@ class Batoms():
             if kind not in polyhedra_kinds.keys():
                 element = kind.split('_')[0]
                 polyhedra_kinds[kind] = get_polyhedra_kind(element)
+                # center of every vertex and edge, to translate polyhedra to the boundary
+                polyhedra_kinds[kind]['indices'] = []
+                polyhedra_kinds[kind]['edge_cylinder']['indices'] = []
             inds = [atom.index for atom in atoms if atom.symbol == kind]
             for ind in inds:
                 vertice = []
-                for bond in bondlist[ind]:
+                for bond in bondlist.get(ind, []):
                     a2, offset = bond
                     if atoms[a2].symbol in ligand:
                         temp_pos = atoms[a2].position + np.dot(offset, atoms.cell)
@@ -989,6 +2386,8 @@ class Batoms():
                         edge.append([f[0], f[2]])
                         edge.append([f[1], f[2]])
                     polyhedra_kinds[kind]['vertices'] = polyhedra_kinds[kind]['vertices'] + list(vertice)
+                    polyhedra_kinds[kind]['indices'] = polyhedra_kinds[kind]['indices'] + [ind]*len(vertice)
+                    polyhedra_kinds[kind]['edge_cylinder']['indices'] = polyhedra_kinds[kind]['edge_cylinder']['indices'] + [ind]*len(edge)
                     polyhedra_kinds[kind]['edges'] = polyhedra_kinds[kind]['edges'] + list(edge)
                     polyhedra_kinds[kind]['faces'] = polyhedra_kinds[kind]['faces'] + list(face)
                     #
@@ -1003,7 +2402,7 @@ class Batoms():
                         polyhedra_kinds[kind]['edge_cylinder']['lengths'].append(length/2.0)
                         polyhedra_kinds[kind]['edge_cylinder']['centers'].append(center)
                         polyhedra_kinds[kind]['edge_cylinder']['normals'].append(nvec)
-        print('get_polyhedra_kind: {0:10.2f} s'.format(time.time() - tstart))
+                    profiler.count(polyhedra = 1)
         for kind, polyhedra_data in polyhedra_kinds.items():
             self.batoms[kind].polyhedra_data = polyhedra_data
         self.polyhedra_kinds = polyhedra_kinds
@@ -3,34 +3,236 @@ import numpy as np
 from mathutils import Matrix
 from scipy.spatial.transform import Rotation as R
 from blase.data import material_styles_dict
-from blase.tools import get_cell_vertices
-import time
+from blase.tools import get_cell_vertices, get_hash
+from blase.profiler import profiler
 ######################################################
 #========================================================
+def set_material(name, color, transmit = 1.0, bsdf_inputs = None, material_style = 'blase', blend = False):
+    """
+    Return the material called name, update it in place if it exists.
+    """
+    if not bsdf_inputs:
+        bsdf_inputs = material_styles_dict[material_style]
+    color = np.append(color[:3], transmit)
+    if name in bpy.data.materials:
+        material = bpy.data.materials[name]
+    else:
+        material = bpy.data.materials.new(name)
+        material.use_nodes = True
+    material.diffuse_color = color
+    if 'Metallic' in bsdf_inputs:
+        material.metallic = bsdf_inputs['Metallic']
+    if 'Roughness' in bsdf_inputs:
+        material.roughness = bsdf_inputs['Roughness']
+    if blend:
+        material.blend_method = 'BLEND'
+    principled_node = material.node_tree.nodes['Principled BSDF']
+    principled_node.inputs['Base Color'].default_value = color
+    principled_node.inputs['Alpha'].default_value = transmit
+    for key, value in bsdf_inputs.items():
+        principled_node.inputs[key].default_value = value
+    return material
+
+def set_mesh_data(mesh, verts, faces = [], smooth = True):
+    """
+    Refill the geometry of a mesh in place (clear_geometry, vertices.add,
+    foreach_set), instead of building a new mesh.
+
+    Return False and leave the mesh untouched if the geometry is the same.
+    """
+    verts = np.asarray(verts, dtype = np.float32).reshape(-1, 3)
+    nvert = len(verts)
+    if isinstance(faces, np.ndarray) and faces.ndim == 2:
+        loop_totals = np.full(len(faces), faces.shape[1], dtype = np.int32)
+        loops = faces.astype(np.int32).ravel()
+    else:
+        loop_totals = np.array([len(face) for face in faces], dtype = np.int32)
+        if len(faces) > 0:
+            loops = np.concatenate([np.asarray(face, dtype = np.int32) for face in faces])
+        else:
+            loops = np.zeros(0, dtype = np.int32)
+    nface = len(loop_totals)
+    nloop = len(loops)
+    if len(mesh.vertices) == nvert and len(mesh.polygons) == nface and len(mesh.loops) == nloop:
+        co = np.empty(nvert*3, dtype = np.float32)
+        mesh.vertices.foreach_get('co', co)
+        old_loops = np.empty(nloop, dtype = np.int32)
+        mesh.loops.foreach_get('vertex_index', old_loops)
+        if np.allclose(co, verts.ravel(), atol = 1e-6) and np.array_equal(old_loops, loops):
+            return False
+    mesh.clear_geometry()
+    mesh.vertices.add(nvert)
+    mesh.vertices.foreach_set('co', verts.ravel())
+    if nface > 0:
+        loop_starts = np.zeros(nface, dtype = np.int32)
+        loop_starts[1:] = np.cumsum(loop_totals)[:-1]
+        mesh.loops.add(nloop)
+        mesh.loops.foreach_set('vertex_index', loops)
+        mesh.polygons.add(nface)
+        mesh.polygons.foreach_set('loop_start', loop_starts)
+        if bpy.app.version < (4, 0, 0):
+            mesh.polygons.foreach_set('loop_total', loop_totals)
+        mesh.polygons.foreach_set('use_smooth', np.full(nface, smooth, dtype = bool))
+    mesh.update(calc_edges = True)
+    return True
+
+def set_object_material(obj, material):
+    """
+    Link material to the object, not to its mesh, so that objects sharing a
+    template mesh can have different materials.
+    """
+    if len(obj.material_slots) == 0:
+        obj.data.materials.append(None)
+    slot = obj.material_slots[0]
+    slot.link = 'OBJECT'
+    slot.material = material
+
+def get_mesh_object(name, coll, material = None):
+    """
+    Return the object called name with its mesh, build it and link it to
+    coll if it does not exist.
+    """
+    if name in bpy.data.objects:
+        obj = bpy.data.objects[name]
+    else:
+        mesh = bpy.data.meshes.new(name)
+        obj = bpy.data.objects.new(name, mesh)
+        coll.objects.link(obj)
+    if material is not None:
+        if len(obj.data.materials) == 0:
+            obj.data.materials.append(material)
+        elif obj.data.materials[0] != material:
+            obj.data.materials[0] = material
+    return obj
+
+def get_template_mesh(name, build):
+    """
+    Return the shared template mesh called name, build it with
+    build(bmesh) if it does not exist. Templates have a fake user, so that
+    they are kept when no object uses them.
+    """
+    if name in bpy.data.meshes:
+        return bpy.data.meshes[name]
+    import bmesh
+    bm = bmesh.new()
+    build(bm)
+    mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(mesh)
+    bm.free()
+    # one slot, objects link their own material to it
+    mesh.materials.append(None)
+    smooth = np.ones(len(mesh.polygons), dtype = bool)
+    mesh.polygons.foreach_set('use_smooth', smooth)
+    mesh.use_fake_user = True
+    return mesh
+
+# level of detail: segments and rings of the atom spheres, vertices of the
+# bond cylinders.
+lod_levels = {'low': {'segments': 8, 'ring_count': 4, 'vertices': 6},
+              'medium': {'segments': 16, 'ring_count': 8, 'vertices': 8},
+              'high': {'segments': 32, 'ring_count': 16, 'vertices': 16},
+              'ultra': {'segments': 64, 'ring_count': 32, 'vertices': 32},
+              }
+# the level is the lowest of the levels chosen by atom count and by the
+# diameter of an atom on the image in pixels, (threshold, level) in order.
+lod_policy = {'natoms': [(100000, 'low'), (10000, 'medium'), (0, 'high')],
+              'pixels': [(64, 'ultra'), (16, 'high'), (6, 'medium'), (0, 'low')],
+              }
+
+# above 'natoms' atoms, the viewport shows a proxy of the atoms and bonds,
+# see Batoms.viewport
+viewport_policy = {'natoms': 500000}
+
+def get_lod(natoms = 0, pixels = None, quality = 'auto'):
+    """
+    Return the level of detail, a key of lod_levels.
+
+    quality: str
+        'auto', or a level which is used as is.
+    pixels: float
+        diameter of an atom on the image, None if unknown.
+    """
+    if quality != 'auto':
+        if quality not in lod_levels:
+            raise KeyError('Unknown quality %s, use auto or one of %s.'%(quality, list(lod_levels)))
+        return quality
+    order = list(lod_levels)
+    levels = []
+    for threshold, level in lod_policy['natoms']:
+        if natoms >= threshold:
+            levels.append(level)
+            break
+    if pixels is not None:
+        for threshold, level in lod_policy['pixels']:
+            if pixels >= threshold:
+                levels.append(level)
+                break
+    if not levels:
+        return 'high'
+    return min(levels, key = order.index)
+
+def get_sphere_mesh(segments = 32, ring_count = 16):
+    """
+    Shared uv sphere of radius 1.
+    """
+    import bmesh
+    def build(bm):
+        if bpy.app.version >= (3, 0, 0):
+            bmesh.ops.create_uvsphere(bm, u_segments = segments, v_segments = ring_count, radius = 1.0)
+        else:
+            bmesh.ops.create_uvsphere(bm, u_segments = segments, v_segments = ring_count, diameter = 1.0)
+    return get_template_mesh('blase_sphere_%s_%s'%(segments, ring_count), build)
+
+def get_cylinder_mesh(vertices = 16):
+    """
+    Shared cylinder of radius 1 and depth 2 along z, the same as
+    primitive_cylinder_add.
+    """
+    import bmesh
+    def build(bm):
+        if bpy.app.version >= (3, 0, 0):
+            bmesh.ops.create_cone(bm, cap_ends = True, segments = vertices, radius1 = 1.0, radius2 = 1.0, depth = 2.0)
+        else:
+            bmesh.ops.create_cone(bm, cap_ends = True, segments = vertices, diameter1 = 1.0, diameter2 = 1.0, depth = 2.0)
+    return get_template_mesh('blase_cylinder_%s'%vertices, build)
+
+def get_atom_material(element, color, transmit = 1.0, color_style = 'JMOL',
+                      material_style = 'blase', bsdf_inputs = None):
+    """
+    Return the material shared by all atoms with the same element, color
+    style, material style and bsdf inputs. The color and bsdf inputs are in
+    the name, so that atoms with a custom color get their own material.
+    """
+    key = get_hash(np.round(color, 6), transmit, sorted(bsdf_inputs.items()) if bsdf_inputs else None)[:8]
+    name = 'material_atom_{0}_{1}_{2}_{3}'.format(element, color_style, material_style, key)
+    if name in bpy.data.materials:
+        return bpy.data.materials[name]
+    return set_material(name, color, transmit, bsdf_inputs = bsdf_inputs,
+                        material_style = material_style, blend = True)
+
+@profiler.timeit('draw_cell')
 def draw_cell(coll_cell, cell_vertices, label = None, celllinewidth = 0.01):
     """
-    Draw unit cell
+    Draw unit cell. The objects are reused if they exist.
     """
     if cell_vertices is not None:
         # build materials
-        material = bpy.data.materials.new('cell_{0}'.format(label))
-        # material.label = 'cell'
-        material.diffuse_color = (0.8, 0.25, 0.25, 1.0)
+        material = set_material('cell_{0}'.format(label), (0.8, 0.25, 0.25), 1.0)
         # draw points
-        bpy.ops.mesh.primitive_uv_sphere_add(radius = celllinewidth) #, segments=32, ring_count=16)
-        sphere = bpy.context.view_layer.objects.active
-        sphere.name = 'instancer_cell_%s_sphere'%label
-        sphere.data.materials.append(material)
-        bpy.ops.object.shade_smooth()
-        sphere.hide_set(True)
-        mesh = bpy.data.meshes.new('point_cell' )
-        obj_cell = bpy.data.objects.new('cell_%s_point'%label, mesh )
+        name = 'instancer_cell_%s_sphere'%label
+        if name in bpy.data.objects:
+            sphere = bpy.data.objects[name]
+        else:
+            sphere = bpy.data.objects.new(name, get_sphere_mesh())
+            sphere.scale = [celllinewidth]*3
+            coll_cell.objects.link(sphere)
+            set_object_material(sphere, material)
+            sphere.hide_set(True)
+        obj_cell = get_mesh_object('cell_%s_point'%label, coll_cell)
         # Associate the vertices
-        obj_cell.data.from_pydata(cell_vertices, [], [])
+        set_mesh_data(obj_cell.data, cell_vertices)
         sphere.parent = obj_cell
         obj_cell.instance_type = 'VERTS'
-        coll_cell.objects.link(sphere)
-        coll_cell.objects.link(obj_cell)
         #
         # edges
         edges = [[0, 1], [0, 2], [0, 4], 
@@ -53,21 +255,12 @@ def draw_cell(coll_cell, cell_vertices, label = None, celllinewidth = 0.01):
         #
         source = bond_source(vertices=4)
         verts, faces = cylinder_mesh_from_instance(cell_edges['centers'], cell_edges['normals'], cell_edges['lengths'], celllinewidth, source)
-        # print(verts)
-        mesh = bpy.data.meshes.new("edge_cell")
-        mesh.from_pydata(verts, [], faces)  
-        mesh.update()
-        for f in mesh.polygons:
-            f.use_smooth = True
-        obj_edge = bpy.data.objects.new("cell_%s_edge"%label, mesh)
-        obj_edge.data = mesh
-        obj_edge.data.materials.append(material)
-        bpy.ops.object.shade_smooth()
-        coll_cell.objects.link(obj_edge)
+        obj_edge = get_mesh_object("cell_%s_edge"%label, coll_cell, material)
+        set_mesh_data(obj_edge.data, verts, faces)
 
 
+@profiler.timeit('draw_text')
 def draw_text(coll_text = None, atoms = None, type = None):
-    tstart = time.time()
     positions = atoms.positions
     n = len(positions)
     for i in range(n):
@@ -80,9 +273,10 @@ def draw_text(coll_text = None, atoms = None, type = None):
             ob.data.body = "%s"%atoms[i].symbol
         ob.location = location
         coll_text.objects.link(ob)
-    print('text: {0:10.2f} s'.format(time.time() - tstart))
+    profiler.count(atoms = n)
 
 
+@profiler.timeit('draw_bond_kind')
 def draw_bond_kind(kind, 
                    datas, 
                    label = None,
@@ -90,39 +284,31 @@ def draw_bond_kind(kind,
                    source = None, 
                    bondlinewidth = 0.10,
                    bsdf_inputs = None, 
-                   material_style = 'plastic'):
-    if not bsdf_inputs:
-        bsdf_inputs = material_styles_dict[material_style]
-    vertices = 16
-    source = bond_source(vertices = vertices)
-    tstart = time.time()
-    material = bpy.data.materials.new('bond_kind_{0}'.format(kind))
-    material.diffuse_color = np.append(datas['color'], datas['transmit'])
-    material.metallic = bsdf_inputs['Metallic']
-    material.roughness = bsdf_inputs['Roughness']
-    # material.blend_method = 'BLEND'
-    material.use_nodes = True
-    principled_node = material.node_tree.nodes['Principled BSDF']
-    principled_node.inputs['Base Color'].default_value = np.append(datas['color'], datas['transmit'])
-    principled_node.inputs['Alpha'].default_value = datas['transmit']
-    for key, value in bsdf_inputs.items():
-        principled_node.inputs[key].default_value = value
+                   material_style = 'plastic',
+                   vertices = 16):
+    """
+    Draw bonds of one kind. The object, mesh and material are reused if
+    they exist, the mesh is only refilled if the bonds changed.
+
+    vertices: int
+        vertices of the cylinders, used if source is None.
+    """
+    if source is None:
+        source = bond_source(vertices = vertices)
+    bondlinewidth = datas.get('bondlinewidth', bondlinewidth)
+    with profiler.stage('material'):
+        material = set_material('bond_{0}_{1}'.format(label, kind), datas['color'], datas['transmit'],
+                                bsdf_inputs = bsdf_inputs, material_style = material_style)
     datas['materials'] = material
     #
     verts, faces = cylinder_mesh_from_instance(datas['centers'], datas['normals'], datas['lengths'], bondlinewidth, source)
-    mesh = bpy.data.meshes.new("mesh_kind_{0}".format(kind))
-    mesh.from_pydata(verts, [], faces)  
-    mesh.update()
-    for f in mesh.polygons:
-        f.use_smooth = True
-    obj_bond = bpy.data.objects.new("bond_{0}_{1}".format(label, kind), mesh)
-    obj_bond.data = mesh
-    obj_bond.data.materials.append(material)
-    bpy.ops.object.shade_smooth()
-    coll.objects.link(obj_bond)
-    print('bonds: {0}   {1:10.2f} s'.format(kind, time.time() - tstart))
+    with profiler.stage('mesh', bonds = len(datas['centers']), verts = len(verts), faces = len(faces)):
+        obj_bond = get_mesh_object("bond_{0}_{1}".format(label, kind), coll, material)
+        set_mesh_data(obj_bond.data, verts, faces)
+    return obj_bond
     
 
+@profiler.timeit('draw_bonds_2')
 def draw_bonds_2(coll_bond_kinds, bond_kinds, bondlinewidth = 0.10, vertices = None, bsdf_inputs = None, material_style = 'plastic'):
     '''
     Draw atom bonds. Using instancing method
@@ -132,7 +318,6 @@ def draw_bonds_2(coll_bond_kinds, bond_kinds, bondlinewidth = 0.10, vertices = N
         bsdf_inputs = material_styles_dict[material_style]
     vertices = 16
     for kind, datas in bond_kinds.items():
-        tstart = time.time()
         material = bpy.data.materials.new('bond_kind_{0}'.format(kind))
         material.diffuse_color = np.append(datas['color'], datas['transmit'])
         material.use_nodes = True
@@ -166,8 +351,8 @@ def draw_bonds_2(coll_bond_kinds, bond_kinds, bondlinewidth = 0.10, vertices = N
         # STRUCTURE.append(obj_bond)
         bpy.data.collections['instancer'].objects.link(cylinder)
         coll_bond_kinds.objects.link(obj_bond)        
-        print('bonds: {0}   {1:10.2f} s'.format(kind, time.time() - tstart))
 
+@profiler.timeit('draw_polyhedra_kind')
 def draw_polyhedra_kind(kind, 
                         datas, 
                         label = None,
@@ -176,65 +361,32 @@ def draw_polyhedra_kind(kind,
                         bsdf_inputs = None, 
                         material_style = 'blase'):
         """
+        Draw polyhedra of one kind, faces and edges. The objects, meshes and
+        materials are reused if they exist.
         """
         source = bond_source(vertices=4)
-        if not bsdf_inputs:
-            bsdf_inputs = material_styles_dict[material_style]
-        tstart = time.time()
-        material = bpy.data.materials.new('polyhedra_kind_{0}'.format(kind))
-        material.diffuse_color = np.append(datas['color'], datas['transmit'])
-        # material.blend_method = 'BLEND'
-        material.use_nodes = True
-        principled_node = material.node_tree.nodes['Principled BSDF']
-        principled_node.inputs['Base Color'].default_value = np.append(datas['color'], datas['transmit'])
-        principled_node.inputs['Alpha'].default_value = datas['transmit']
-        for key, value in bsdf_inputs.items():
-            principled_node.inputs[key].default_value = value
+        material = set_material('polyhedra_{0}_{1}_face'.format(label, kind), datas['color'], datas['transmit'],
+                                bsdf_inputs = bsdf_inputs, material_style = material_style)
         datas['materials'] = material
         #
-        # create new mesh structure
-        mesh = bpy.data.meshes.new("mesh_kind_{0}".format(kind))
-        # mesh.from_pydata(datas['vertices'], datas['edges'], datas['faces'])  
-        mesh.from_pydata(datas['vertices'], [], datas['faces'])  
-        mesh.update()
-        for f in mesh.polygons:
-            f.use_smooth = True
-        obj_polyhedra = bpy.data.objects.new("polyhedra_{0}_{1}_face".format(label, kind), mesh)
-        obj_polyhedra.data = mesh
-        obj_polyhedra.data.materials.append(material)
-        bpy.ops.object.shade_smooth()
+        obj_polyhedra = get_mesh_object("polyhedra_{0}_{1}_face".format(label, kind), coll, material)
+        set_mesh_data(obj_polyhedra.data, datas['vertices'], datas['faces'])
         #---------------------------------------------------
-        material = bpy.data.materials.new('polyhedra_edge_kind_{0}'.format(kind))
-        material.diffuse_color = np.append(datas['edge_cylinder']['color'], datas['edge_cylinder']['transmit'])
-        # material.blend_method = 'BLEND'
-        material.use_nodes = True
-        principled_node = material.node_tree.nodes['Principled BSDF']
-        principled_node.inputs['Base Color'].default_value = np.append(datas['edge_cylinder']['color'], datas['edge_cylinder']['transmit'])
-        principled_node.inputs['Alpha'].default_value = datas['transmit']
-        for key, value in bsdf_inputs.items():
-            principled_node.inputs[key].default_value = value
+        material = set_material('polyhedra_{0}_{1}_edge'.format(label, kind), datas['edge_cylinder']['color'], datas['transmit'],
+                                bsdf_inputs = bsdf_inputs, material_style = material_style)
         datas['edge_cylinder']['materials'] = material
         verts, faces = cylinder_mesh_from_instance(datas['edge_cylinder']['centers'], datas['edge_cylinder']['normals'], datas['edge_cylinder']['lengths'], 0.01, source)
-        # print(verts)
-        mesh = bpy.data.meshes.new("mesh_kind_{0}".format(kind))
-        mesh.from_pydata(verts, [], faces)  
-        mesh.update()
-        for f in mesh.polygons:
-            f.use_smooth = True
-        obj_edge = bpy.data.objects.new("polyhedra_{0}_{1}_edge".format(label, kind), mesh)
-        obj_edge.data = mesh
-        obj_edge.data.materials.append(material)
-        bpy.ops.object.shade_smooth()
-        # STRUCTURE.append(obj_polyhedra)
-        coll.objects.link(obj_polyhedra)
-        coll.objects.link(obj_edge)
-        print('polyhedras: {0}   {1:10.2f} s'.format(kind, time.time() - tstart))
+        obj_edge = get_mesh_object("polyhedra_{0}_{1}_edge".format(label, kind), coll, material)
+        set_mesh_data(obj_edge.data, verts, faces)
+        profiler.count(verts = len(datas['vertices']) + len(verts), faces = len(datas['faces']) + len(faces))
+        return obj_polyhedra, obj_edge
 
+@profiler.timeit('draw_isosurface')
 def draw_isosurface(coll_isosurface, volume, cell = None, level = None,
                     closed_edges = False, gradient_direction = 'descent',
                     color=(0.85, 0.80, 0.25) , icolor = None, transmit=0.4,
                     verbose = False, step_size = 1, 
-                    bsdf_inputs = None, material_style = 'blase'):
+                    bsdf_inputs = None, material_style = 'blase', label = None):
     """Computes an isosurface from a volume grid.
     
     Parameters:     
@@ -269,8 +421,7 @@ def draw_isosurface(coll_isosurface, volume, cell = None, level = None,
     #material
     if not bsdf_inputs:
         bsdf_inputs = material_styles_dict[material_style]
-    material = bpy.data.materials.new('isosurface')
-    material.name = 'isosurface'
+    material = bpy.data.materials.new('isosurface_%s'%label)
     material.diffuse_color = color + (transmit,)
     # material.alpha_threshold = 0.2
     # material.blend_method = 'BLEND'
@@ -282,16 +433,17 @@ def draw_isosurface(coll_isosurface, volume, cell = None, level = None,
             principled_node.inputs[key].default_value = value
     #
     # create new mesh structure
-    isosurface = bpy.data.meshes.new("isosurface")
+    isosurface = bpy.data.meshes.new("isosurface_%s"%label)
     isosurface.from_pydata(scaled_verts, [], faces)  
     isosurface.update()
     for f in isosurface.polygons:
         f.use_smooth = True
-    iso_object = bpy.data.objects.new("isosurface", isosurface)
+    iso_object = bpy.data.objects.new("isosurface_%s"%label, isosurface)
     iso_object.data = isosurface
     iso_object.data.materials.append(material)
     bpy.ops.object.shade_smooth()
     coll_isosurface.objects.link(iso_object)
+    profiler.count(verts = nverts, faces = len(faces))
 
 def clean_default():
     if 'Camera' in bpy.data.cameras:
@@ -305,21 +457,14 @@ def clean_default():
 
 # draw bonds
 def bond_source(vertices = 16):
-    bpy.ops.mesh.primitive_cylinder_add(vertices = vertices)
-    cyli = bpy.context.view_layer.objects.active
-    me = cyli.data
-    verts = []
-    faces = []
-    for vertices in me.vertices:
-        verts.append(np.array(vertices.co))
-    for poly in me.polygons:
-        face = []
-        for loop_index in range(poly.loop_start, poly.loop_start + poly.loop_total):
-            # print("    Vertex: %d" % me.loops[loop_index].vertex_index)
-            face.append(me.loops[loop_index].vertex_index)
-        faces.append(face)
-    cyli.select_set(True)
-    bpy.ops.object.delete()
+    """
+    Vertices and faces of a cylinder of radius 1 and depth 2.
+    """
+    me = get_cylinder_mesh(vertices)
+    verts = np.empty(len(me.vertices)*3)
+    me.vertices.foreach_get('co', verts)
+    verts = list(verts.reshape(-1, 3))
+    faces = [list(poly.vertices) for poly in me.polygons]
     return [verts, faces]
 # draw atoms
 def atom_source():
@@ -337,8 +482,8 @@ def atom_source():
             # print("    Vertex: %d" % me.loops[loop_index].vertex_index)
             face.append(me.loops[loop_index].vertex_index)
         faces.append(face)
-    sphe.select_set(True)
-    bpy.ops.object.delete()
+    bpy.data.objects.remove(sphe)
+    bpy.data.meshes.remove(me)
     return [verts, faces]
 
 
@@ -361,10 +506,10 @@ def sphere_mesh_from_instance(centers, radius, source):
             face = [x+ i*nvert for x in face]
             faces.append(face)
     return verts, faces
+@profiler.timeit('cylinder_mesh_from_instance')
 def cylinder_mesh_from_instance(centers, normals, lengths, scale, source):
     # verts = np.empty((0, 3), float)
     
-    tstart = time.time()
     verts = []
     faces = []
     vert0, face0 = source
@@ -394,7 +539,5 @@ def cylinder_mesh_from_instance(centers, normals, lengths, scale, source):
         for face in face0:
             face = [x+ i*nvert for x in face]
             faces.append(face)
-    print('cylinder_mesh_from_instance: {0:10.2f} s'.format( time.time() - tstart))
-
     return verts, faces
 
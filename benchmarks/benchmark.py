@@ -0,0 +1,292 @@
+"""Benchmarks for blase.
+
+Time Batoms construction, ``draw()`` for every model_type, ``set_boundary``,
+``load_frames``, ``draw_cavity``, isosurfaces and a Workbench render over the
+shipped datasets and over generated supercells. The ``lod`` benchmark draws
+and renders every level of detail, and records the estimated memory of the
+instanced spheres and the bond meshes, to show the quality trade-off.
+
+Run headless with blender (arguments after ``--`` are for this script):
+
+    blender -b -P benchmarks/benchmark.py -- --output results.json
+
+or with bpy as a python module:
+
+    python benchmarks/benchmark.py --output results.json
+
+Compare with a saved baseline, the exit code is 1 if any benchmark is slower
+than ``--threshold`` times the baseline:
+
+    blender -b -P benchmarks/benchmark.py -- --output new.json --compare results.json
+
+Compare two saved result files without running anything:
+
+    python benchmarks/benchmark.py --output new.json --compare results.json --no-run
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+
+datas_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'docs', 'source', '_static', 'datas')
+
+datasets = {
+        'h2o-2-2-2': 'h2o-2-2-2.in',
+        'h2o-10-10-10': 'h2o-10-10-10.in',
+        'h2o-20-20-20': 'h2o-20-20-20.in',
+        'perovskite': 'perovskite.cif',
+        'tio2': 'tio2.cif',
+        'mof-5': 'mof-5.cif',
+        'atp': 'ATP.pdb',
+        }
+
+# extra bond settings used by the examples in docs/source/_static
+bondsettings = {
+        'tio2': {('Ti', 'O'): [2.5, True, False]},
+        'perovskite': {('Ti', 'O'): [2.5, True, False]},
+        'mof-5': {('Zn', 'O'): [2.5, True, False], ('C', 'H'): [1.4, False, False]},
+        }
+
+supercell_sizes = [1000, 10000, 100000, 1000000]
+
+all_benchmarks = ['build', 'draw_0', 'draw_1', 'draw_2', 'draw_3',
+                  'set_boundary', 'load_frames', 'draw_cavity',
+                  'isosurface', 'render', 'lod']
+
+
+def get_cases(names = None, max_atoms = 1000000):
+    """
+    Return a dict of case name: ase atoms.
+    """
+    from ase.io import read
+    from ase.build import bulk
+    cases = {}
+    for name, filename in datasets.items():
+        if names and name not in names: continue
+        atoms = read(os.path.join(datas_dir, filename))
+        if len(atoms) <= max_atoms:
+            cases[name] = atoms
+    for size in supercell_sizes:
+        if size > max_atoms: continue
+        name = 'pt-%s'%size
+        if names and name not in names: continue
+        n = int(np.ceil((size/4.0)**(1.0/3)))
+        cases[name] = bulk('Pt', cubic = True)*[n, n, n]
+    return cases
+
+def clean_scene():
+    """
+    Remove all objects, collections and orphan data, so that every case
+    starts from the same state.
+    """
+    import bpy
+    for obj in bpy.data.objects:
+        bpy.data.objects.remove(obj, do_unlink = True)
+    for coll in bpy.data.collections:
+        if coll.name != 'Collection':
+            bpy.data.collections.remove(coll)
+    for datas in [bpy.data.meshes, bpy.data.materials, bpy.data.curves]:
+        for data in datas:
+            if data.users == 0:
+                datas.remove(data)
+
+def gaussian_volume(atoms, shape = (40, 40, 40), sigma = 0.5):
+    """
+    A density-like volume for the isosurface benchmark.
+    """
+    from ase.cell import Cell
+    cell = Cell(atoms.cell)
+    grid = np.indices(shape).reshape(3, -1).T/np.array(shape, dtype = float)
+    positions = cell.scaled_positions(atoms.positions)
+    volume = np.zeros(len(grid))
+    for pos in positions:
+        d = grid - pos
+        d -= np.round(d)
+        d = np.dot(d, cell.array)
+        volume += np.exp(-np.sum(d*d, axis = 1)/(2*sigma**2))
+    return volume.reshape(shape)
+
+def timeit(func, repeat = 1):
+    times = []
+    for i in range(repeat):
+        tstart = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - tstart)
+    return times
+
+def run_case(name, atoms, benchmarks, repeat = 1, outdir = None):
+    """
+    Run all benchmarks for one case, return a list of results.
+    """
+    from blase.batoms import Batoms
+    results = []
+    label = 'bench_%s'%name.replace('-', '_')
+    state = {}
+    def build():
+        clean_scene()
+        state['batoms'] = Batoms(label = label, atoms = atoms.copy(), draw = False)
+        for key, value in bondsettings.get(name, {}).items():
+            state['batoms'].bondsetting[key] = value
+    def record(benchmark, times, **extra):
+        result = {'case': name,
+                  'natoms': len(atoms),
+                  'benchmark': benchmark,
+                  'time': min(times),
+                  'times': times,
+                  }
+        result.update(extra)
+        results.append(result)
+        print('{0:20s} {1:15s} {2:10.4f} s'.format(name, benchmark, min(times)))
+    # build is always needed, the others use the Batoms it creates
+    times = timeit(build, repeat)
+    if 'build' in benchmarks:
+        record('build', times)
+    batoms = state['batoms']
+    for model_type in ['0', '1', '2', '3']:
+        benchmark = 'draw_%s'%model_type
+        if benchmark not in benchmarks: continue
+        record(benchmark, timeit(lambda: batoms.draw(model_type = model_type), repeat))
+    if 'set_boundary' in benchmarks and atoms.pbc.any():
+        record('set_boundary', timeit(lambda: batoms.set_boundary([0.05, 0.05, 0.05]), repeat))
+        batoms.set_boundary([0.0, 0.0, 0.0])
+    if 'load_frames' in benchmarks:
+        images = []
+        for i in range(5):
+            image = atoms.copy()
+            image.positions += 0.05*i
+            images.append(image)
+        batoms.images = images
+        record('load_frames', timeit(batoms.load_frames, repeat))
+    if 'draw_cavity' in benchmarks and name == 'mof-5':
+        record('draw_cavity', timeit(lambda: batoms.draw_cavity(9.0), repeat))
+    if 'isosurface' in benchmarks and atoms.pbc.all() and len(atoms) <= 10000:
+        volume = gaussian_volume(atoms)
+        batoms.isosurface = [volume, np.mean(volume)*2]
+        record('isosurface', timeit(batoms.draw_isosurface, repeat))
+        batoms.isosurface = []
+    if not outdir:
+        outdir = tempfile.mkdtemp()
+    output_image = os.path.join(outdir, '%s.png'%label)
+    if 'render' in benchmarks:
+        record('render', timeit(lambda: batoms.render(engine = 'BLENDER_WORKBENCH',
+                    resolution_x = 500, output_image = output_image), repeat))
+    if 'lod' in benchmarks:
+        from blase.bdraw import lod_levels, get_sphere_mesh
+        from blase.btools import estimate_mesh_bytes
+        for quality, lod in lod_levels.items():
+            batoms.quality = quality
+            draw_times = timeit(lambda: batoms.draw(model_type = '1'), repeat)
+            render_times = timeit(lambda: batoms.render(engine = 'BLENDER_WORKBENCH',
+                    resolution_x = 500, output_image = output_image), repeat)
+            sphere = get_sphere_mesh(lod['segments'], lod['ring_count'])
+            # spheres are instanced, but expanded for drawing and rendering
+            sphere_bytes = len(atoms)*estimate_mesh_bytes(len(sphere.vertices), len(sphere.edges),
+                                                          len(sphere.polygons), len(sphere.loops))
+            bond_bytes = batoms.memory_report(verbose = False)['bond']['bytes']
+            record('lod_%s_draw'%quality, draw_times, bytes = sphere_bytes + bond_bytes)
+            record('lod_%s_render'%quality, render_times, bytes = sphere_bytes + bond_bytes)
+        batoms.quality = 'auto'
+    return results
+
+def get_meta():
+    meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            }
+    try:
+        import bpy
+        meta['blender'] = bpy.app.version_string
+    except ImportError:
+        pass
+    try:
+        import blase
+        meta['blase'] = '.'.join(str(x) for x in blase.bl_info['version'])
+    except (ImportError, AttributeError):
+        pass
+    return meta
+
+def compare(results, baseline, threshold = 1.2):
+    """
+    Compare results with a baseline. Return a list of regressions.
+    """
+    old = {(r['case'], r['benchmark']): r for r in baseline['results']}
+    regressions = []
+    print('{0:20s} {1:15s} {2:>10s} {3:>10s} {4:>8s}'.format('case', 'benchmark', 'baseline', 'new', 'ratio'))
+    for r in results['results']:
+        key = (r['case'], r['benchmark'])
+        if key not in old: continue
+        t0 = old[key]['time']
+        ratio = r['time']/t0 if t0 > 0 else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = ' slower'
+            regressions.append({'case': key[0], 'benchmark': key[1],
+                                'baseline': t0, 'time': r['time'], 'ratio': ratio})
+        elif ratio < 1.0/threshold:
+            flag = ' faster'
+        print('{0:20s} {1:15s} {2:10.4f} {3:10.4f} {4:8.2f}{5}'.format(key[0], key[1], t0, r['time'], ratio, flag))
+    return regressions
+
+def get_args(argv):
+    # blender passes its own arguments, ours come after '--'
+    if '--' in argv:
+        argv = argv[argv.index('--') + 1:]
+    else:
+        argv = argv[1:]
+    parser = argparse.ArgumentParser(description = 'Benchmarks for blase.')
+    parser.add_argument('--output', default = 'blase-benchmark.json',
+                        help = 'results file (json)')
+    parser.add_argument('--compare', default = None,
+                        help = 'baseline results file to compare with')
+    parser.add_argument('--threshold', type = float, default = 1.2,
+                        help = 'ratio to the baseline counted as a regression')
+    parser.add_argument('--cases', nargs = '*', default = None,
+                        help = 'cases to run, e.g. tio2 mof-5 pt-10000')
+    parser.add_argument('--benchmarks', nargs = '*', default = all_benchmarks,
+                        choices = all_benchmarks)
+    parser.add_argument('--max-atoms', type = int, default = 1000000,
+                        help = 'skip cases with more atoms')
+    parser.add_argument('--repeat', type = int, default = 1)
+    parser.add_argument('--profile', default = None,
+                        help = 'also write the stage timings as a chrome trace')
+    parser.add_argument('--no-run', action = 'store_true',
+                        help = 'only compare --output with --compare')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = get_args(argv)
+    if args.no_run:
+        with open(args.output) as f:
+            results = json.load(f)
+    else:
+        if args.profile:
+            from blase.profiler import profiler
+            profiler.enable()
+        results = {'meta': get_meta(), 'results': []}
+        cases = get_cases(args.cases, args.max_atoms)
+        for name, atoms in cases.items():
+            results['results'].extend(run_case(name, atoms, args.benchmarks, repeat = args.repeat))
+            # write after every case, large cases may not finish
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent = 2)
+        print('Results saved to %s'%args.output)
+        if args.profile:
+            profiler.write(args.profile, format = 'chrome')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('%s benchmarks slower than %s x baseline.'%(len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
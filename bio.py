@@ -8,6 +8,7 @@ import numpy as np
 from math import pi, sqrt, radians, acos, atan2
 from blase.tools import get_bbox
 from blase.data import default_blase_settings, material_styles_dict
+from blase.profiler import profiler
 import logging
 import sys
 
@@ -60,6 +61,7 @@ class Blase():
             rgb_node.outputs["Color"].default_value = (1, 1, 1, 1)
             node_tree.nodes["Background"].inputs["Strength"].default_value = 1.0
             node_tree.links.new(rgb_node.outputs["Color"], node_tree.nodes["Background"].inputs["Color"])
+    @profiler.timeit('Blase.set_camera')
     def set_camera(self, camera_type = None, camera_lens = None,):
         '''
         Set camera.
@@ -187,6 +189,7 @@ class Blase():
         current_object = bpy.context.object
         current_object.data.materials.append(material)
 
+    @profiler.timeit('Blase.render')
     def render(self, output_image = None):
         """
         """
@@ -224,7 +227,8 @@ class Blase():
             print('saving to {0}.blend'.format(self.output_image))
             bpy.ops.wm.save_as_mainfile('EXEC_SCREEN', filepath = '{0}.blend'.format(self.output_image))
         elif self.run_render:
-            bpy.ops.render.render(write_still = 1, animation = self.animation)
+            with profiler.stage('render.render'):
+                bpy.ops.render.render(write_still = 1, animation = self.animation)
     def export(self, filename = 'blender-ase.obj'):
         # render settings
         if filename.split('.')[-1] == 'obj':
@@ -0,0 +1,402 @@
+"""Geometry nodes backend for atoms.
+
+All atoms of a Batoms are the vertices of one mesh, with per-atom point
+attributes. A geometry nodes modifier puts a sphere on every shown vertex,
+scaled by its radius. The material reads the color and selection of each
+instance, so that styling an atom is an attribute write, and not a new
+species object.
+
+Point attributes:
+
+    radius: float
+        radius of the sphere.
+    color_index: int
+        index of the species, or any other color bucket.
+    color: float color
+        RGBA color.
+    show: bool
+        hidden atoms are not instanced.
+    select: bool
+        selected atoms are highlighted.
+    color_value: float
+        value in [0, 1] mapped to a colormap, see color_by.
+    culled: bool
+        atoms hidden by Batoms.cull.
+    outside: bool
+        atoms hidden because they are outside the camera frustum.
+
+Needs Blender 3.2 or newer (Named Attribute node).
+"""
+import bpy
+import numpy as np
+from blase.bdraw import set_mesh_data, get_mesh_object
+from blase.data import material_styles_dict, colormaps
+from blase.profiler import profiler
+
+atom_attributes = {'radius': 'FLOAT',
+                   'color_index': 'INT',
+                   'color': 'FLOAT_COLOR',
+                   'show': 'BOOLEAN',
+                   'select': 'BOOLEAN',
+                   'color_value': 'FLOAT',
+                   'culled': 'BOOLEAN',
+                   'outside': 'BOOLEAN',
+                   }
+
+attribute_dtypes = {'FLOAT': np.float32,
+                    'INT': np.int32,
+                    'BOOLEAN': bool,
+                    'FLOAT_COLOR': np.float32,
+                    'FLOAT_VECTOR': np.float32,
+                    }
+
+attribute_widths = {'FLOAT_COLOR': 4, 'FLOAT_VECTOR': 3}
+
+def check_version():
+    if bpy.app.version < (3, 2, 0):
+        raise Exception('The geometry nodes backend needs Blender 3.2 or newer, this is %s.'%bpy.app.version_string)
+
+def add_socket(node_group, in_out, socket_type, name, default_value = None):
+    """
+    Add an input or output socket to a node group, for Blender 3.x and 4.x.
+    """
+    if bpy.app.version >= (4, 0, 0):
+        socket = node_group.interface.new_socket(name, in_out = in_out, socket_type = socket_type)
+    elif in_out == 'INPUT':
+        socket = node_group.inputs.new(socket_type, name)
+    else:
+        socket = node_group.outputs.new(socket_type, name)
+    if default_value is not None:
+        socket.default_value = default_value
+    return socket
+
+def get_socket_identifier(node_group, name):
+    """
+    Identifier of a node group input, used as key of the modifier inputs.
+    """
+    if bpy.app.version >= (4, 0, 0):
+        return node_group.interface.items_tree[name].identifier
+    return node_group.inputs[name].identifier
+
+def get_output(node, name):
+    """
+    The enabled output called name. The Named Attribute node has one output
+    per data type with the same name before Blender 4.0.
+    """
+    for output in node.outputs:
+        if output.name == name and output.enabled:
+            return output
+    return node.outputs[name]
+
+def get_input(node, name):
+    """
+    The enabled input called name, e.g. of the Switch node, which has one
+    input per data type before Blender 4.0.
+    """
+    for input in node.inputs:
+        if input.name == name and input.enabled:
+            return input
+    return node.inputs[name]
+
+def named_attribute(nodes, name, data_type):
+    node = nodes.new('GeometryNodeInputNamedAttribute')
+    node.data_type = data_type
+    node.inputs['Name'].default_value = name
+    return node
+
+def get_atoms_node_group(name = 'blase_atoms'):
+    """
+    Return the geometry nodes group instancing spheres on the shown points,
+    build it if it does not exist. It is shared by all Batoms.
+
+    Inputs: Geometry, Material, Segments, Rings, Viewport Points.
+    With Viewport Points, the viewport shows a point cloud instead of the
+    spheres, renders still use the spheres.
+    """
+    if name in bpy.data.node_groups:
+        return bpy.data.node_groups[name]
+    check_version()
+    node_group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    add_socket(node_group, 'INPUT', 'NodeSocketGeometry', 'Geometry')
+    add_socket(node_group, 'INPUT', 'NodeSocketMaterial', 'Material')
+    add_socket(node_group, 'INPUT', 'NodeSocketInt', 'Segments', 32)
+    add_socket(node_group, 'INPUT', 'NodeSocketInt', 'Rings', 16)
+    add_socket(node_group, 'INPUT', 'NodeSocketBool', 'Viewport Points', False)
+    add_socket(node_group, 'OUTPUT', 'NodeSocketGeometry', 'Geometry')
+    nodes = node_group.nodes
+    links = node_group.links
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+    sphere = nodes.new('GeometryNodeMeshUVSphere')
+    sphere.inputs['Radius'].default_value = 1.0
+    links.new(group_input.outputs['Segments'], sphere.inputs['Segments'])
+    links.new(group_input.outputs['Rings'], sphere.inputs['Rings'])
+    smooth = nodes.new('GeometryNodeSetShadeSmooth')
+    links.new(sphere.outputs['Mesh'], smooth.inputs['Geometry'])
+    set_material = nodes.new('GeometryNodeSetMaterial')
+    links.new(smooth.outputs['Geometry'], set_material.inputs['Geometry'])
+    links.new(group_input.outputs['Material'], set_material.inputs['Material'])
+    radius = named_attribute(nodes, 'radius', 'FLOAT')
+    show = named_attribute(nodes, 'show', 'BOOLEAN')
+    instance = nodes.new('GeometryNodeInstanceOnPoints')
+    links.new(group_input.outputs['Geometry'], instance.inputs['Points'])
+    links.new(set_material.outputs['Geometry'], instance.inputs['Instance'])
+    links.new(get_output(show, 'Attribute'), instance.inputs['Selection'])
+    links.new(get_output(radius, 'Attribute'), instance.inputs['Scale'])
+    # point cloud proxy for the viewport
+    points = nodes.new('GeometryNodeMeshToPoints')
+    links.new(group_input.outputs['Geometry'], points.inputs['Mesh'])
+    links.new(get_output(show, 'Attribute'), points.inputs['Selection'])
+    links.new(get_output(radius, 'Attribute'), points.inputs['Radius'])
+    is_viewport = nodes.new('GeometryNodeIsViewport')
+    use_points = nodes.new('FunctionNodeBooleanMath')
+    use_points.operation = 'AND'
+    links.new(is_viewport.outputs[0], use_points.inputs[0])
+    links.new(group_input.outputs['Viewport Points'], use_points.inputs[1])
+    switch = nodes.new('GeometryNodeSwitch')
+    switch.input_type = 'GEOMETRY'
+    links.new(use_points.outputs[0], get_input(switch, 'Switch'))
+    links.new(instance.outputs['Instances'], get_input(switch, 'False'))
+    links.new(points.outputs['Points'], get_input(switch, 'True'))
+    links.new(get_output(switch, 'Output'), group_output.inputs['Geometry'])
+    # layout, only for reading the tree in the editor
+    for i, node in enumerate([group_input, sphere, smooth, set_material]):
+        node.location = (-800 + 200*i, 200)
+    radius.location = (-200, -200)
+    show.location = (-200, -400)
+    instance.location = (100, 0)
+    points.location = (100, -300)
+    is_viewport.location = (100, 300)
+    use_points.location = (300, 300)
+    switch.location = (500, 0)
+    group_output.location = (700, 0)
+    return node_group
+
+def get_atoms_material(name, material_style = 'blase', bsdf_inputs = None,
+                       select_color = (1.0, 0.8, 0.0, 1.0)):
+    """
+    Return the material of a geometry nodes atoms object, build it if it
+    does not exist. The base color is the 'color' attribute of the instance,
+    mixed with select_color for selected atoms.
+    """
+    if name in bpy.data.materials:
+        return bpy.data.materials[name]
+    if not bsdf_inputs:
+        bsdf_inputs = material_styles_dict[material_style]
+    material = bpy.data.materials.new(name)
+    material.use_nodes = True
+    nodes = material.node_tree.nodes
+    links = material.node_tree.links
+    principled_node = nodes['Principled BSDF']
+    for key, value in bsdf_inputs.items():
+        principled_node.inputs[key].default_value = value
+    color = nodes.new('ShaderNodeAttribute')
+    color.attribute_type = 'INSTANCER'
+    color.attribute_name = 'color'
+    select = nodes.new('ShaderNodeAttribute')
+    select.attribute_type = 'INSTANCER'
+    select.attribute_name = 'select'
+    mix = nodes.new('ShaderNodeMixRGB')
+    mix.inputs['Color2'].default_value = select_color
+    links.new(select.outputs['Fac'], mix.inputs['Fac'])
+    links.new(color.outputs['Color'], mix.inputs['Color1'])
+    links.new(mix.outputs['Color'], principled_node.inputs['Base Color'])
+    color.location = (-600, 300)
+    select.location = (-600, 0)
+    mix.location = (-300, 200)
+    return material
+
+def get_colormap_stops(colormap):
+    """
+    Return a list of (position, rgb) of a colormap, from data.colormaps or
+    from matplotlib if it is installed.
+    """
+    if colormap in colormaps:
+        return colormaps[colormap]
+    try:
+        import matplotlib
+        cmap = matplotlib.colormaps[colormap]
+    except (ImportError, AttributeError, KeyError):
+        raise KeyError('Unknown colormap %s, use one of %s, or install matplotlib.'%(colormap, list(colormaps)))
+    return [(x, cmap(x)[:3]) for x in np.linspace(0, 1, 16)]
+
+def get_colormap_node_group(colormap = 'viridis'):
+    """
+    Return the shader node group mapping the 'color_value' attribute of
+    the instance to a color ramp, build it if it does not exist. One group
+    per colormap is shared by all Batoms.
+    """
+    name = 'blase_colormap_%s'%colormap
+    if name in bpy.data.node_groups:
+        return bpy.data.node_groups[name]
+    stops = get_colormap_stops(colormap)
+    node_group = bpy.data.node_groups.new(name, 'ShaderNodeTree')
+    add_socket(node_group, 'OUTPUT', 'NodeSocketColor', 'Color')
+    nodes = node_group.nodes
+    links = node_group.links
+    group_output = nodes.new('NodeGroupOutput')
+    value = nodes.new('ShaderNodeAttribute')
+    value.attribute_type = 'INSTANCER'
+    value.attribute_name = 'color_value'
+    ramp = nodes.new('ShaderNodeValToRGB')
+    elements = ramp.color_ramp.elements
+    elements[0].position = stops[0][0]
+    elements[0].color = list(stops[0][1]) + [1.0]
+    elements[-1].position = stops[-1][0]
+    elements[-1].color = list(stops[-1][1]) + [1.0]
+    for position, color in stops[1:-1]:
+        element = elements.new(position)
+        element.color = list(color) + [1.0]
+    links.new(value.outputs['Fac'], ramp.inputs['Fac'])
+    links.new(ramp.outputs['Color'], group_output.inputs['Color'])
+    value.location = (-500, 0)
+    ramp.location = (-250, 0)
+    return node_group
+
+def set_material_colormap(material, colormap = None):
+    """
+    Color a geometry nodes atoms material by the colormap, or by the 'color'
+    attribute if colormap is None.
+    """
+    nodes = material.node_tree.nodes
+    links = material.node_tree.links
+    mix = [node for node in nodes if node.bl_idname == 'ShaderNodeMixRGB'][0]
+    if colormap is None:
+        color = [node for node in nodes if node.bl_idname == 'ShaderNodeAttribute'
+                 and node.attribute_name == 'color'][0]
+        links.new(color.outputs['Color'], mix.inputs['Color1'])
+        return
+    node = nodes.get('color_by')
+    if node is None:
+        node = nodes.new('ShaderNodeGroup')
+        node.name = 'color_by'
+        node.location = (-600, 500)
+    node.node_tree = get_colormap_node_group(colormap)
+    links.new(node.outputs['Color'], mix.inputs['Color1'])
+
+@bpy.app.handlers.persistent
+def color_by_frame_handler(scene, *args):
+    """
+    Copy the color values of the current frame to 'color_value', for all
+    Batoms colored by per-frame values.
+    """
+    frame = scene.frame_current - scene.frame_start
+    for coll in bpy.data.collections:
+        nframes = coll.blase.color_by_frames
+        if not coll.is_batoms or nframes == 0:
+            continue
+        obj = bpy.data.objects.get('atoms_nodes_%s'%coll.name)
+        if obj is None:
+            continue
+        i = min(max(frame, 0), nframes - 1)
+        values = get_attribute(obj.data, 'color_value_%s'%i, 'FLOAT')
+        set_attribute(obj.data, 'color_value', values)
+
+def register_color_by_frame_handler():
+    handlers = bpy.app.handlers.frame_change_pre
+    for handler in handlers:
+        if handler.__name__ == color_by_frame_handler.__name__:
+            return
+    handlers.append(color_by_frame_handler)
+
+def unregister_color_by_frame_handler():
+    handlers = bpy.app.handlers.frame_change_pre
+    for handler in list(handlers):
+        if handler.__name__ == color_by_frame_handler.__name__:
+            handlers.remove(handler)
+
+def set_modifier_input(modifier, name, value):
+    identifier = get_socket_identifier(modifier.node_group, name)
+    modifier[identifier] = value
+
+def get_modifier_input(modifier, name):
+    identifier = get_socket_identifier(modifier.node_group, name)
+    return modifier[identifier]
+
+@profiler.timeit('draw_atoms_nodes')
+def draw_atoms_nodes(name, coll, positions, attributes = {}, material = None):
+    """
+    Build or update the geometry nodes atoms object.
+
+    positions: array
+        (n, 3)
+    attributes: dict
+        name: values, written to point attributes.
+    """
+    check_version()
+    profiler.count(atoms = len(positions))
+    obj = get_mesh_object(name, coll, material)
+    set_mesh_data(obj.data, np.asarray(positions, dtype = float).reshape(-1, 3))
+    modifier = obj.modifiers.get('blase_atoms')
+    if modifier is None:
+        modifier = obj.modifiers.new('blase_atoms', 'NODES')
+        modifier.node_group = get_atoms_node_group()
+    if material is not None:
+        set_modifier_input(modifier, 'Material', material)
+    for key, values in attributes.items():
+        set_attribute(obj.data, key, values)
+    return obj
+
+def set_attribute(mesh, name, values, index = None):
+    """
+    Write per-atom values to a point attribute, in one call.
+
+    index: list or array
+        only write these atoms.
+
+    >>> set_attribute(mesh, 'radius', 0.5)
+    >>> set_attribute(mesh, 'show', False, index = [0, 3])
+    """
+    data_type = atom_attributes.get(name)
+    if data_type is None:
+        data_type = get_data_type(values)
+    n = len(mesh.vertices)
+    width = attribute_widths.get(data_type, 1)
+    if index is not None:
+        data = get_attribute(mesh, name, data_type)
+        data[np.asarray(index)] = values
+        values = data
+    values = np.broadcast_to(np.asarray(values, dtype = attribute_dtypes[data_type]),
+                             (n, width) if width > 1 else (n,))
+    att = mesh.attributes.get(name)
+    if att is not None and (att.data_type != data_type or att.domain != 'POINT'):
+        mesh.attributes.remove(att)
+        att = None
+    if att is None:
+        att = mesh.attributes.new(name, data_type, 'POINT')
+    key = 'color' if data_type == 'FLOAT_COLOR' else ('vector' if data_type == 'FLOAT_VECTOR' else 'value')
+    att.data.foreach_set(key, np.ascontiguousarray(values).ravel())
+    mesh.update()
+
+def get_attribute(mesh, name, data_type = None):
+    """
+    Return the values of a point attribute as an array. If it does not
+    exist, return the default: 1.0 for radius, True for show, zeros else.
+    """
+    att = mesh.attributes.get(name)
+    if data_type is None:
+        data_type = att.data_type if att is not None else atom_attributes.get(name, 'FLOAT')
+    n = len(mesh.vertices)
+    width = attribute_widths.get(data_type, 1)
+    shape = (n, width) if width > 1 else (n,)
+    dtype = attribute_dtypes[data_type]
+    if att is None:
+        if name in ['radius', 'show']:
+            return np.ones(shape, dtype = dtype)
+        return np.zeros(shape, dtype = dtype)
+    key = 'color' if data_type == 'FLOAT_COLOR' else ('vector' if data_type == 'FLOAT_VECTOR' else 'value')
+    values = np.zeros(n*width, dtype = dtype)
+    att.data.foreach_get(key, values)
+    return values.reshape(shape)
+
+def get_data_type(values):
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return 'BOOLEAN'
+    if np.issubdtype(values.dtype, np.integer):
+        return 'INT'
+    if values.ndim == 2 and values.shape[1] == 4:
+        return 'FLOAT_COLOR'
+    if values.ndim == 2 and values.shape[1] == 3:
+        return 'FLOAT_VECTOR'
+    return 'FLOAT'
@@ -3,4 +3,157 @@ import bpy
 def object_mode():
     for object in bpy.data.objects:
             if object.mode == 'EDIT':
-                bpy.ops.object.mode_set(mode = 'OBJECT')
\ No newline at end of file
+                bpy.ops.object.mode_set(mode = 'OBJECT')
+
+# approximate sizes in bytes of mesh elements, with their default attributes
+vert_bytes = 32    # co, normal, flags
+edge_bytes = 16    # two indices, flags
+loop_bytes = 8     # vertex and edge index
+face_bytes = 16    # loop start, total, material index, flags
+key_bytes = 72     # one BezTriple keyframe point
+attribute_bytes = {'FLOAT': 4, 'INT': 4, 'BOOLEAN': 1, 'INT8': 1,
+                   'FLOAT_VECTOR': 12, 'FLOAT2': 8, 'FLOAT_COLOR': 16,
+                   'BYTE_COLOR': 4, 'STRING': 8, 'QUATERNION': 16,
+                   'INT32_2D': 8, 'FLOAT4X4': 64}
+
+def estimate_mesh_bytes(nverts = 0, nedges = 0, nfaces = 0, nloops = None):
+    """
+    Estimate the memory of a mesh from its size.
+    """
+    if nloops is None:
+        nloops = 4*nfaces
+    return nverts*vert_bytes + nedges*edge_bytes + nfaces*face_bytes + nloops*loop_bytes
+
+def mesh_memory(mesh):
+    """
+    Return vertex/edge/face/loop counts and the estimated bytes of a mesh.
+    """
+    data = {'verts': len(mesh.vertices),
+            'edges': len(mesh.edges),
+            'faces': len(mesh.polygons),
+            'loops': len(mesh.loops),
+            }
+    nbytes = estimate_mesh_bytes(data['verts'], data['edges'], data['faces'], data['loops'])
+    # custom attributes, e.g. per-atom radius
+    if hasattr(mesh, 'attributes'):
+        for att in mesh.attributes:
+            if att.name in ['position', '.select_vert', '.select_edge', '.select_poly']: continue
+            size = attribute_bytes.get(att.data_type, 4)
+            nbytes += size*len(att.data)
+    data['bytes'] = nbytes
+    return data
+
+def animation_memory(id_data):
+    """
+    Return number of fcurves, keyframes and the estimated bytes of the
+    animation data of an object or mesh.
+    """
+    data = {'fcurves': 0, 'keyframes': 0, 'bytes': 0}
+    anim = id_data.animation_data
+    if anim is None or anim.action is None:
+        return data
+    for fcurve in anim.action.fcurves:
+        data['fcurves'] += 1
+        data['keyframes'] += len(fcurve.keyframe_points)
+    data['bytes'] = data['keyframes']*key_bytes
+    return data
+
+def remove_objects(objs):
+    """
+    Remove objects, and their meshes, curves and materials if nothing else
+    uses them any more. Otherwise every redraw leaves orphan datablocks
+    behind (mesh.001, mesh.002, ...).
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    datas = {}
+    materials = {}
+    for obj in objs:
+        for slot in obj.material_slots:
+            if slot.material:
+                materials[slot.material.as_pointer()] = slot.material
+        if obj.data is not None:
+            datas[obj.data.as_pointer()] = obj.data
+            if hasattr(obj.data, 'materials'):
+                for material in obj.data.materials:
+                    if material:
+                        materials[material.as_pointer()] = material
+    bpy.data.batch_remove(objs)
+    orphans = [data for data in datas.values() if data.users == 0]
+    bpy.data.batch_remove(orphans)
+    orphans = [material for material in materials.values() if material.users == 0]
+    bpy.data.batch_remove(orphans)
+
+def purge_orphans(datablocks = None):
+    """
+    Remove all datablocks without users, repeated because removing a mesh
+    can make its materials orphans. Return the number of removed datablocks.
+    """
+    if datablocks is None:
+        datablocks = ['meshes', 'materials', 'curves', 'node_groups']
+    nremoved = 0
+    while True:
+        orphans = []
+        for name in datablocks:
+            for data in getattr(bpy.data, name):
+                if data.users == 0 and not data.use_fake_user:
+                    orphans.append(data)
+        if not orphans:
+            break
+        bpy.data.batch_remove(orphans)
+        nremoved += len(orphans)
+    return nremoved
+
+# Policy for scenes with many atoms. Every undo step stores a copy of the
+# changed meshes, which for millions of vertices costs more time and memory
+# than the draw itself. Above 'natoms', draws use the 'undo' mode, and the
+# undo stack is limited to 'undo_steps' steps and 'undo_memory_limit' MB.
+large_scene_policy = {'natoms': 100000,
+                      'undo': 'none',
+                      'undo_steps': 4,
+                      'undo_memory_limit': 1024,
+                      }
+# user preferences before the policy changed them
+saved_undo_preferences = {}
+
+def set_large_scene_policy(**kwargs):
+    """
+    Change the large scene policy, e.g.
+
+    >>> set_large_scene_policy(natoms = 50000, undo = 'draw')
+    """
+    for key, value in kwargs.items():
+        if key not in large_scene_policy:
+            raise KeyError('%s is not a large scene policy key, use one of %s'%(key, list(large_scene_policy)))
+        large_scene_policy[key] = value
+
+def apply_large_scene_policy(natoms):
+    """
+    Limit the undo stack if natoms is above the policy, restore the user
+    preferences otherwise. Return True for a large scene.
+    """
+    edit = bpy.context.preferences.edit
+    if natoms >= large_scene_policy['natoms']:
+        if not saved_undo_preferences:
+            saved_undo_preferences['undo_steps'] = edit.undo_steps
+            saved_undo_preferences['undo_memory_limit'] = edit.undo_memory_limit
+        edit.undo_steps = min(edit.undo_steps, large_scene_policy['undo_steps'])
+        # 0 means no limit
+        if edit.undo_memory_limit == 0 or edit.undo_memory_limit > large_scene_policy['undo_memory_limit']:
+            edit.undo_memory_limit = large_scene_policy['undo_memory_limit']
+        return True
+    if saved_undo_preferences:
+        edit.undo_steps = saved_undo_preferences['undo_steps']
+        edit.undo_memory_limit = saved_undo_preferences['undo_memory_limit']
+        saved_undo_preferences.clear()
+    return False
+
+def undo_push(message = '', undo = 'draw'):
+    """
+    undo: str
+        'draw', push one undo step. 'none', do not push.
+    """
+    if undo == 'none':
+        return
+    bpy.ops.ed.undo_push(message = message)
@@ -5,6 +5,17 @@ material_styles_dict = {
             'blase'   : {'Metallic': 0.1, 'Specular': 0.2, 'Roughness': 0.2, },
             'mirror'  : {'Metallic': 0.99, 'Specular': 2.0, 'Roughness': 0.001},
             }
+# color ramps used by Batoms.color_by, (position, rgb)
+colormaps = {
+            'viridis' : [(0.0, (0.267, 0.005, 0.329)), (0.25, (0.229, 0.322, 0.546)), (0.5, (0.128, 0.567, 0.551)),
+                         (0.75, (0.369, 0.789, 0.383)), (1.0, (0.993, 0.906, 0.144))],
+            'plasma'  : [(0.0, (0.050, 0.030, 0.528)), (0.25, (0.494, 0.012, 0.658)), (0.5, (0.798, 0.280, 0.470)),
+                         (0.75, (0.973, 0.585, 0.252)), (1.0, (0.940, 0.975, 0.131))],
+            'coolwarm': [(0.0, (0.230, 0.299, 0.754)), (0.5, (0.865, 0.865, 0.865)), (1.0, (0.706, 0.016, 0.150))],
+            'jet'     : [(0.0, (0.0, 0.0, 0.5)), (0.125, (0.0, 0.0, 1.0)), (0.375, (0.0, 1.0, 1.0)),
+                         (0.625, (1.0, 1.0, 0.0)), (0.875, (1.0, 0.0, 0.0)), (1.0, (0.5, 0.0, 0.0))],
+            'gray'    : [(0.0, (0.0, 0.0, 0.0)), (1.0, (1.0, 1.0, 1.0))],
+            }
 default_batoms = {
         'show_unit_cell': 'default',
         'celllinewidth': 0.025,  # radius of the cylinders representing the cell
@@ -35,12 +35,34 @@ class BlaseSettings(bpy.types.PropertyGroup):
     cell: FloatVectorProperty(name="cell", default = [0, 0, 0, 0, 0, 0, 0, 0, 0], size = 9)
     show_unit_cell: BoolProperty(name="show_unit_cell", default = True)
     boundary: FloatVectorProperty(name="boundary", default = [0.0, 0.0, 0.0], size = 3)
+    memory_budget: FloatProperty(name="memory_budget", description = "Warn if a draw needs more memory (MB), 0 for no limit", default = 0.0, min = 0.0)
+    undo: StringProperty(name="undo", description = "Undo steps of a draw: 'draw' one step, 'none' no step", default = 'draw')
+    backend: StringProperty(name="backend", description = "Draw atoms with 'instancer' or 'geometry_nodes'", default = 'instancer')
+    color_by_frames: IntProperty(name="color_by_frames", description = "Number of frames of per-atom color values", default = 0)
+    quality: StringProperty(name="quality", description = "Level of detail: auto, low, medium, high or ultra", default = 'auto')
+    lod: StringProperty(name="lod", description = "Level of detail in use", default = 'high')
+    viewport: StringProperty(name="viewport", description = "Viewport display: auto, full or proxy", default = 'auto')
+    cull: BoolProperty(name="cull", description = "Hide buried atoms and bonds", default = False)
+    cull_resolution: FloatProperty(name="cull_resolution", default = 0.2)
+    frustum: BoolProperty(name="frustum", description = "Only build atoms, bonds and polyhedra seen by the camera", default = False)
+    frustum_margin: FloatProperty(name="frustum_margin", default = 2.0, min = 0.0)
+    chunk_size: FloatProperty(name="chunk_size", description = "Size of the chunk objects of every species, 0 for one object per species", default = 0.0, min = 0.0)
+    replicate: IntVectorProperty(name="replicate", description = "Cells shown along every cell vector, as instances of the unit cell", default = [1, 1, 1], size = 3, min = 1)
+    symmetry: BoolProperty(name="symmetry", description = "Draw the asymmetric unit, and the rest of the cell as instances", default = False)
+    symprec: FloatProperty(name="symprec", description = "Tolerance of the symmetry search", default = 1e-5, min = 0.0)
+    bond_key: StringProperty(name="bond_key", default = '')
+    polyhedra_key: StringProperty(name="polyhedra_key", default = '')
 
 class BatomSettings(bpy.types.PropertyGroup):
     label: StringProperty(name="label", default = '')
     species: StringProperty(name="species", default = 'X')
     element: StringProperty(name="element", default = '')
     scale: FloatProperty(name="scale", default = 1.0)
+    radius: FloatProperty(name="radius", description = "Radius of the atom, the instancer is a shared unit sphere", default = 0.0)
+    chunk_size: FloatProperty(name="chunk_size", description = "Size of the chunk objects, 0 for one object per species", default = 0.0, min = 0.0)
+    chunk_cell: FloatVectorProperty(name="chunk_cell", size = 9, default = [0]*9)
+    chunk_id: IntProperty(name="chunk_id", default = 0)
+    boundary: FloatVectorProperty(name="boundary", description = "Boundary of the cached images", default = [0.0, 0.0, 0.0], size = 3)
 
 class BlaseAtom(bpy.types.PropertyGroup):
     symbol: StringProperty(name="symbol")
@@ -80,6 +102,8 @@ class Blase_PT_prepare(Panel):
         row.prop(blpanel, "model_type", expand  = True)
         row = box.row()
         row.prop(blpanel, "scale")
+        row = box.row()
+        row.prop(blpanel, "viewport", expand  = True)
 
         
         box = layout.box()
@@ -146,6 +170,11 @@ class BlaseProperties(bpy.types.PropertyGroup):
         modify_scale(blpanel.collection_list, blpanel.scale)
     
     
+    def Callback_modify_viewport(self, context):
+        blpanel = bpy.context.scene.blpanel
+        print('Callback_modify_viewport')
+        modify_viewport(blpanel.collection_list, blpanel.viewport)
+    
     def Callback_render_atoms(self, context):
         blpanel = bpy.context.scene.blpanel
         print('Callback_render_atoms')
@@ -192,6 +221,14 @@ class BlaseProperties(bpy.types.PropertyGroup):
     scale: FloatProperty(
         name="scale", default=1.0,
         description = "scale", update = Callback_modify_scale)
+    viewport: EnumProperty(
+        name="Viewport",
+        description="Viewport display, renders always use full spheres",
+        items=(('auto',"Auto", "Proxy above the atom count of the viewport policy"),
+               ('full',"Full", "Spheres and bonds"),
+               ('proxy',"Proxy", "Boxes or points for atoms, bounding boxes for bonds")),
+        default='auto', 
+        update=Callback_modify_viewport)
     single: BoolProperty(
         name="Single", default=False,
         description = "Do you split into single atoms?")
@@ -492,6 +529,9 @@ def modify_model_type(collection_name, model_type):
     # Modify atom scale (all selected)
     batoms = Batoms(from_collection = collection_name)
     batoms.model_type = model_type
+def modify_viewport(collection_name, viewport):
+    batoms = Batoms(from_collection = collection_name)
+    batoms.viewport = viewport
 def modify_scale(collection_name, scale, batoms = None):
     # Modify atom scale (all selected)
     batoms = Batoms(from_collection = collection_name)
@@ -159,7 +159,5 @@ def modify_boundary(collection_name, cutoff, batoms = None):
     if not batoms:
         batoms = read_batoms_collection(coll)
     print('drawing atoms')
-    batoms.coll.blase.boundary = cutoff
-    # if batoms.atoms.pbc.any():
-        # batoms.draw_atoms_boundary(cutoff=cutoff)
-    batoms.draw()
\ No newline at end of file
+    # only the images and the bonds which changed are updated
+    batoms.boundary = cutoff
\ No newline at end of file
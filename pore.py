@@ -0,0 +1,108 @@
+"""Pore analysis for porous materials.
+
+The pore space is the part of the cell where a probe sphere fits without
+overlapping the atoms, the atoms being spheres of their van der Waals
+radii. It is found on a grid from the distance of every grid point to the
+closest atom surface, see blase.tools.get_grid_distances. The grid points
+are queried in chunks against kd-trees of the atoms and their periodic
+images, so MOF supercells with tens of thousands of atoms and steps of a
+few tenths of an Å fit in memory.
+
+For every pore:
+
+    center: array
+        center of the largest included sphere.
+    radius: float
+        radius of the largest included sphere, the largest distance of a
+        pore point to the atom surfaces.
+    volume: float
+        volume of the pore space (the space of the probe center), in Å^3.
+    percolation: bool (3)
+        the pore is infinite along the cell vector, e.g. a channel.
+
+>>> from ase.io import read
+>>> from blase.pore import get_pores, pores_report
+>>> atoms = read('docs/source/_static/datas/mof-5.cif')
+>>> pores = get_pores(atoms, step = 0.5, probe = 1.2)
+>>> print(pores_report(pores))
+"""
+import numpy as np
+from ase.data import vdw_radii, covalent_radii
+from blase.tools import get_grid_distances, label_pores
+from blase.profiler import profiler
+
+
+def get_atom_radii(numbers):
+    """
+    Van der Waals radii of the atoms, covalent radii where the van der
+    Waals radius is unknown.
+    """
+    numbers = np.asarray(numbers, dtype = int)
+    radii = vdw_radii[numbers]
+    return np.where(np.isnan(radii), covalent_radii[numbers], radii)
+
+@profiler.timeit('get_pores')
+def get_pores(atoms, step = 0.5, probe = 0.0, radii = None, min_volume = 0.0,
+              chunk = 1000000, workers = -1):
+    """
+    Find the pores of atoms.
+
+    step: float
+        grid step in Å.
+    probe: float
+        radius of the probe sphere in Å, e.g. 1.2 for hydrogen. Pores
+        narrower than the probe are not connected.
+    radii: array
+        radii of the atoms, default get_atom_radii.
+    min_volume: float
+        drop pores smaller than this, in Å^3.
+    workers: int
+        cores used by the kd-tree queries, -1 for all of them.
+
+    Return a dict of arrays, one item per pore: 'centers', 'radii',
+    'volumes', 'percolation', and the grid 'labels' (0 outside the pores,
+    i + 1 for pore i) and 'distances' to the atom surfaces.
+    """
+    cell = atoms.cell
+    if radii is None:
+        radii = get_atom_radii(atoms.numbers)
+    radii = np.broadcast_to(np.asarray(radii, dtype = float), (len(atoms), ))
+    with profiler.stage('get_grid_distances') as stage:
+        distances = get_grid_distances(cell, atoms.positions, step = step, radii = radii,
+                                       pbc = atoms.pbc, chunk = chunk, workers = workers)
+        stage.count(points = distances.size)
+    with profiler.stage('label_pores') as stage:
+        labels, npores, percolation = label_pores(distances > probe, atoms.pbc)
+        stage.count(pores = npores)
+    shape = distances.shape
+    flat = labels.ravel()
+    points = np.where(flat > 0)[0]
+    volumes = np.bincount(flat[points] - 1, minlength = npores)*cell.volume/distances.size
+    # the grid point of every pore farthest from the atoms
+    points = points[np.lexsort((-distances.ravel()[points], flat[points]))]
+    first = np.unique(flat[points], return_index = True)[1]
+    grid = np.array(np.unravel_index(points[first], shape)).T
+    centers = np.dot(grid/np.array(shape, dtype = float), cell.array).reshape(-1, 3)
+    pore_radii = distances.ravel()[points[first]].astype(float)
+    keep = volumes >= min_volume
+    # renumber the pores which are kept
+    index = np.zeros(npores + 1, dtype = int)
+    index[1:][keep] = np.arange(1, keep.sum() + 1)
+    return {'centers': centers[keep],
+            'radii': pore_radii[keep],
+            'volumes': volumes[keep],
+            'percolation': percolation[keep],
+            'labels': index[labels],
+            'distances': distances,
+            }
+
+def pores_report(pores):
+    """
+    Table of the pores, largest first.
+    """
+    s = '{0:>5s} {1:>28s} {2:>10s} {3:>12s} {4:>12s}\n'.format('pore', 'center', 'radius', 'volume', 'percolation')
+    for i in np.argsort(-pores['radii']):
+        axes = ''.join(axis for axis, p in zip('abc', pores['percolation'][i]) if p) or '-'
+        s += '{0:5d} {1[0]:9.3f} {1[1]:9.3f} {1[2]:9.3f} {2:10.3f} {3:12.2f} {4:>12s}\n'.format(
+                i, pores['centers'][i], pores['radii'][i], pores['volumes'][i], axes)
+    return s
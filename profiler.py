@@ -0,0 +1,192 @@
+"""Stage timing for drawing and rendering.
+
+The profiler records nested stages (e.g. ``Batoms.draw`` > ``draw_bonds`` >
+``get_bondpairs``) together with counts (atoms, bonds, polyhedra, verts,
+faces). It is off by default, in which case a stage costs one attribute
+lookup. Set the environment variable ``BLASE_PROFILE=1`` or call
+``profiler.enable()`` to switch it on.
+
+>>> from ase.build import molecule
+>>> from blase.batoms import Batoms
+>>> from blase.profiler import profiler
+>>> profiler.enable()
+>>> h2o = Batoms(label = 'h2o', atoms = molecule('H2O'), model_type = '1')
+>>> print(profiler.report())
+>>> profiler.write('h2o-profile.json')
+>>> profiler.write('h2o-trace.json', format = 'chrome')
+
+The chrome trace can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import os
+import json
+import time
+import functools
+
+
+class Stage():
+    """
+    One timed stage. Children are the stages opened while this one is running.
+    """
+    def __init__(self, profiler, name, counts):
+        self.profiler = profiler
+        self.name = name
+        self.counts = dict(counts)
+        self.children = []
+        self.start = None
+        self.end = None
+    def __enter__(self):
+        stack = self.profiler._stack
+        if stack:
+            stack[-1].children.append(self)
+        else:
+            self.profiler.stages.append(self)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        self.profiler._stack.pop()
+        return False
+    @property
+    def duration(self):
+        if self.end is None:
+            return time.perf_counter() - self.start
+        return self.end - self.start
+    def count(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+    def get_totals(self):
+        """
+        counts summed over this stage and all its children.
+        """
+        totals = dict(self.counts)
+        for child in self.children:
+            for key, value in child.get_totals().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+    def as_dict(self, t0 = 0.0):
+        return {'name': self.name,
+                'start': self.start - t0,
+                'duration': self.duration,
+                'counts': self.counts,
+                'totals': self.get_totals(),
+                'children': [child.as_dict(t0) for child in self.children],
+                }
+
+
+class NullStage():
+    """
+    Returned when the profiler is disabled.
+    """
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+    def count(self, **counts):
+        pass
+
+null_stage = NullStage()
+
+
+class Profiler():
+    """
+    Registry of timed stages.
+
+    >>> with profiler.stage('draw_cell'):
+            ...
+    >>> @profiler.timeit('Batoms.draw')
+        def draw(self):
+            ...
+    """
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.stages = []
+        self._stack = []
+        self.t0 = time.perf_counter()
+    def enable(self):
+        self.enabled = True
+    def disable(self):
+        self.enabled = False
+    def reset(self):
+        self.stages = []
+        self._stack = []
+        self.t0 = time.perf_counter()
+    def stage(self, name, **counts):
+        """
+        Context manager timing the code inside it.
+        """
+        if not self.enabled:
+            return null_stage
+        return Stage(self, name, counts)
+    def timeit(self, name = None):
+        """
+        Decorator timing every call of a function.
+        """
+        def decorator(func):
+            stage_name = name or func.__qualname__
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Stage(self, stage_name, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+    def count(self, **counts):
+        """
+        Add counts to the innermost running stage.
+        """
+        if self.enabled and self._stack:
+            self._stack[-1].count(**counts)
+    def as_dict(self):
+        return {'stages': [stage.as_dict(self.t0) for stage in self.stages]}
+    def to_json(self, indent = 2):
+        return json.dumps(self.as_dict(), indent = indent)
+    def to_chrome_trace(self):
+        """
+        Chrome trace event format, one complete ('X') event per stage.
+        """
+        events = []
+        pid = os.getpid()
+        def add(stage):
+            events.append({'name': stage.name,
+                           'ph': 'X',
+                           'ts': (stage.start - self.t0)*1e6,
+                           'dur': stage.duration*1e6,
+                           'pid': pid,
+                           'tid': 0,
+                           'args': stage.counts,
+                           })
+            for child in stage.children:
+                add(child)
+        for stage in self.stages:
+            add(stage)
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+    def write(self, filename, format = 'json'):
+        """
+        format: str
+            'json' or 'chrome'
+        """
+        if format == 'json':
+            text = self.to_json()
+        elif format == 'chrome':
+            text = self.to_chrome_trace()
+        else:
+            raise ValueError('Unknown format %s, use json or chrome.'%format)
+        with open(filename, 'w') as f:
+            f.write(text)
+    def report(self):
+        lines = ['{0:40s} {1:>10s}   {2}'.format('stage', 'time (s)', 'counts')]
+        def add(stage, depth):
+            counts = ', '.join('%s=%s'%(key, value) for key, value in stage.get_totals().items())
+            lines.append('{0:40s} {1:10.4f}   {2}'.format('  '*depth + stage.name, stage.duration, counts))
+            for child in stage.children:
+                add(child, depth + 1)
+        for stage in self.stages:
+            add(stage, 0)
+        return '\n'.join(lines)
+    def __repr__(self):
+        return 'Profiler(enabled=%s, stages=%s)'%(self.enabled, len(self.stages))
+
+
+profiler = Profiler(enabled = os.environ.get('BLASE_PROFILE', '0') not in ['', '0'])
@@ -3,7 +3,7 @@ import numpy as np
 from ase import Atoms, Atom
 from ase.data import covalent_radii, atomic_numbers, chemical_symbols
 from ase.visualize import view
-import time
+from blase.profiler import profiler
 
 def get_bondpairs(atoms, bondsetting):
     """
@@ -12,19 +12,34 @@ def get_bondpairs(atoms, bondsetting):
     remove_bonds
     """
     from ase.neighborlist import neighbor_list
-    tstart = time.time()
-    cutoff = {}
-    for key, data in bondsetting.items():
-        cutoff[key] = data[0]
-    nli, nlj, nlS = neighbor_list('ijS', atoms, cutoff=cutoff, self_interaction=False)
-    bondpairs = {i: [] for i in set(nli)}
-    if 'species' not in atoms.info:
-        atoms.info['species'] = atoms.get_chemical_symbols()
-    for i, j, offset in zip(nli, nlj, nlS):
-        bondpairs[i].append([j, offset])
-    print('get_bondpairs: {0:10.2f} s'.format(time.time() - tstart))
+    with profiler.stage('get_bondpairs', atoms = len(atoms)) as stage:
+        cutoff = {}
+        for key, data in bondsetting.items():
+            cutoff[key] = data[0]
+        nli, nlj, nlS = neighbor_list('ijS', atoms, cutoff=cutoff, self_interaction=False)
+        bondpairs = {i: [] for i in set(nli)}
+        if 'species' not in atoms.info:
+            atoms.info['species'] = atoms.get_chemical_symbols()
+        for i, j, offset in zip(nli, nlj, nlS):
+            bondpairs[i].append([j, offset])
+        stage.count(bonds = len(nli))
     return bondpairs
 
+def get_hash(*datas):
+    """
+    Return a hash of arrays and values, used to check whether geometry
+    has to be rebuilt.
+    """
+    import hashlib
+    h = hashlib.sha1()
+    for data in datas:
+        if isinstance(data, np.ndarray):
+            h.update(str(data.shape).encode())
+            h.update(np.ascontiguousarray(data).tobytes())
+        else:
+            h.update(repr(data).encode())
+    return h.hexdigest()
+
 def default_element_prop(element, color_style = "JMOL"):
     """
     """
@@ -103,30 +118,34 @@ def getEquidistantPoints(p1, p2, n):
 
 def search_pbc(positions, cell, boundary = [0.01, 0.01, 0.01]):
     """
-    boundarys: float or list
+    Search the images of atoms within boundary of the cell faces, for all
+    atoms and the 26 neighbour cells at once.
+
+    boundary: float or list
+        width along every cell vector, in scaled coordinates. An image is
+        kept if its scaled coordinates are in (-boundary, 1 + boundary).
+
+    Return (positions, index, offsets): the positions of the images, the
+    index of their atom and their cell offsets, so that
+    positions = positions[index] + offsets.cell.
     """
     from ase.cell import Cell
     cell = Cell(cell)
-    if isinstance(boundary, float):
+    if isinstance(boundary, (int, float)):
         boundary = [boundary]*3
-    boundary = 0.5 - np.array(boundary)
-    print('Search pbc: ')
-    positions = cell.scaled_positions(positions)
-    natoms = len(positions)
-    bdpos = []
-    for i in range(natoms):
-        dv = 0.5 - positions[i]
-        flag = abs(dv) > boundary
-        # print(dv, boundary,  flag)
-        flag = flag*1 + 1
-        for l in range(flag[0]):
-            for m in range(flag[1]):
-                for n in range(flag[2]):
-                    if l == 0 and m == 0 and n == 0: continue
-                    temp_pos = positions[i] + np.sign(dv)*[l, m, n]
-                    temp_pos = temp_pos.dot(cell)
-                    bdpos.append(temp_pos)
-    return np.array(bdpos)
+    boundary = np.array(boundary, dtype = float)
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    scaled = cell.scaled_positions(positions)
+    offsets = np.array([[l, m, n] for l in [-1, 0, 1] for m in [-1, 0, 1]
+                        for n in [-1, 0, 1] if l or m or n])
+    # (natoms, 26, 3), an axis without offset is always kept
+    images = scaled[:, None, :] + offsets[None, :, :]
+    inside = (images > -boundary) & (images < 1 + boundary)
+    mask = np.all(inside | (offsets == 0), axis = 2)
+    index, ioffset = np.nonzero(mask)
+    offsets = offsets[ioffset]
+    bdpos = positions[index] + np.dot(offsets, cell.array)
+    return bdpos, index, offsets
 
 def get_cell_vertices(cell):
     """
@@ -166,33 +185,781 @@ def get_bbox(bbox, atoms, show_unit_cell = True):
             bbox[i] = [P1, P2]
         bbox = bbox
     return bbox
-def find_cage(cell, positions, radius, step = 1.0):
+def get_periodic_images(positions, cell, pbc, cutoff):
+    """
+    Wrap the atoms into the cell along the periodic axes, and add their
+    images within cutoff of the cell faces, as many cells away as needed.
+
+    Return (points, index, offsets), with points = positions[index] +
+    offsets.cell.
+    """
+    from ase.cell import Cell
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    pbc = np.asarray(pbc, dtype = bool)
+    cell = Cell(cell).complete()
+    scaled = cell.scaled_positions(positions)
+    shifts = np.zeros((len(positions), 3), dtype = int)
+    shifts[:, pbc] = -np.floor(scaled[:, pbc]).astype(int)
+    scaled = scaled + shifts
+    heights = 1.0/np.linalg.norm(cell.reciprocal(), axis = 1)
+    boundary = np.where(pbc, cutoff/heights, 0.0)
+    ranges = [np.arange(-n, n + 1) for n in np.ceil(boundary).astype(int)]
+    cells = np.array(np.meshgrid(*ranges, indexing = 'ij')).reshape(3, -1).T
+    index = []
+    offsets = []
+    for offset in cells:
+        images = scaled + offset
+        # an axis without offset is always kept
+        inside = (images > -boundary) & (images < 1 + boundary)
+        select = np.where(np.all(inside | (offset == 0), axis = 1))[0]
+        index.append(select)
+        offsets.append(shifts[select] + offset)
+    index = np.concatenate(index)
+    offsets = np.concatenate(offsets)
+    return positions[index] + np.dot(offsets, cell.array), index, offsets
+
+def get_grid_shape(cell, step):
+    """
+    Number of grid points along the cell vectors, step (Å) apart.
+    """
     from ase.cell import Cell
-    from scipy.spatial import distance
+    return tuple(max(1, int(np.ceil(length/step))) for length in Cell(cell).lengths())
+
+def get_grid_distances(cell, positions, step = 1.0, radii = None, pbc = True,
+                       cutoff = None, chunk = 1000000, workers = -1):
+    """
+    Distance from every point of a grid over the cell to the closest atom,
+    or to the closest atom surface if radii is given. The grid point
+    (i, j, k) is at the scaled position (i/na, j/nb, k/nc).
+
+    The grid is queried in chunks against kd-trees of the atoms and their
+    periodic images, one tree per radius, so the memory is bounded by the
+    chunk and the grid, not by grid x atoms.
+
+    cutoff: float
+        distances are exact up to cutoff, larger ones are set to cutoff.
+        Default: half the sum of the cell vectors, no point of a periodic
+        cell is farther from the closest image of an atom, so all
+        distances are exact.
+    workers: int
+        cores used by the kd-tree queries, -1 for all of them.
 
+    Return the distances as a float32 array of the grid shape.
+    """
+    from scipy.spatial import cKDTree
+    from ase.cell import Cell
     cell = Cell(cell)
-    a, b, c, alpha, beta, gamma = cell.cellpar()
-    na, nb, nc = int(a/step),int(b/step), int(c/step)
-    x = np.linspace(0, 1, na)
-    y = np.linspace(0, 1, nb)
-    z = np.linspace(0, 1, nc)
-    positions_v = np.vstack(np.meshgrid(x, y, z)).reshape(3,-1).T
-    positions_v = np.dot(positions_v, cell)
-    dists = distance.cdist(positions_v, positions)
-    # dists<3.0
-    flag = np.min(dists, axis = 1) >radius
-    return positions_v[flag]
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    if radii is None:
+        radii = np.zeros(len(positions))
+    radii = np.broadcast_to(np.asarray(radii, dtype = float), (len(positions), ))
+    pbc = np.broadcast_to(np.asarray(pbc, dtype = bool), (3, ))
+    if cutoff is None:
+        cutoff = 0.5*sum(cell.lengths())
+    shape = get_grid_shape(cell, step)
+    distances = np.full(np.prod(shape), cutoff, dtype = np.float32)
+    if len(positions) == 0:
+        return distances.reshape(shape)
+    points, index, offsets = get_periodic_images(positions, cell, pbc, cutoff + radii.max())
+    trees = []
+    for radius in np.unique(radii):
+        trees.append((radius, cKDTree(points[radii[index] == radius])))
+    for start in range(0, len(distances), chunk):
+        grid = np.array(np.unravel_index(np.arange(start, min(start + chunk, len(distances))), shape)).T
+        grid = np.dot(grid/np.array(shape, dtype = float), cell.array)
+        d = distances[start:start + chunk]
+        for radius, tree in trees:
+            dist, i = tree.query(grid, distance_upper_bound = cutoff + radius, workers = workers)
+            np.minimum(d, dist - radius, out = d)
+    return distances.reshape(shape)
+
+def label_pores(mask, pbc = True):
+    """
+    Label the connected regions of a boolean grid over the cell, the grid
+    is periodic along the pbc axes. Regions which touch across a cell face
+    are merged with get_molecules. A pore which meets one of its own
+    periodic images is infinite, it percolates along the axes of the
+    offset to that image.
+
+    Return (labels, npores, percolation): labels is 0 outside the pores and
+    1..npores inside, percolation is a (npores, 3) bool array.
+    """
+    from scipy import ndimage
+    pbc = np.broadcast_to(np.asarray(pbc, dtype = bool), (3, ))
+    labels, n = ndimage.label(mask)
+    if n == 0:
+        return labels, 0, np.zeros((0, 3), dtype = bool)
+    # regions on the last slice bonded to regions on the first slice of
+    # the next cell
+    bondlist = {}
+    for axis in range(3):
+        if not pbc[axis]:
+            continue
+        a = labels.take(-1, axis = axis).ravel()
+        b = labels.take(0, axis = axis).ravel()
+        touch = (a > 0) & (b > 0)
+        offset = np.zeros(3, dtype = int)
+        offset[axis] = 1
+        for u, v in set(zip(a[touch] - 1, b[touch] - 1)):
+            bondlist.setdefault(u, []).append([v, offset])
+            bondlist.setdefault(v, []).append([u, -offset])
+    ids, offsets = get_molecules(n, bondlist)
+    npores = ids.max() + 1
+    # a bond which does not agree with the unwrapped regions closes a loop
+    # through the periodic images
+    percolation = np.zeros((npores, 3), dtype = bool)
+    for u, pairs in bondlist.items():
+        for v, offset in pairs:
+            percolation[ids[u]] |= (offsets[u] + offset - offsets[v]) != 0
+    ids = np.concatenate([[0], ids + 1])
+    return ids[labels], npores, percolation
+
+def find_cage(cell, positions, radius, step = 1.0, pbc = True, chunk = 1000000, workers = -1):
+    """
+    Find the cavities: the points of a grid over the cell farther than
+    radius from any atom, including periodic images. Connected points are
+    merged into pores, the center of a pore is its point farthest from the
+    atoms. Steps well below 1 Å are fine, the memory is bounded by the
+    chunk of grid points queried at once, see get_grid_distances.
+
+    Return the centers of the pores.
+    """
+    # no cutoff, a capped distance could be picked as the farthest point
+    distances = get_grid_distances(cell, positions, step = step, pbc = pbc,
+                                   chunk = chunk, workers = workers)
+    labels, npores, percolation = label_pores(distances > radius, pbc)
+    if npores == 0:
+        return np.zeros((0, 3))
+    labels = labels.ravel()
+    points = np.where(labels > 0)[0]
+    # the farthest point of every pore
+    points = points[np.lexsort((-distances.ravel()[points], labels[points]))]
+    first = np.unique(labels[points], return_index = True)[1]
+    grid = np.array(np.unravel_index(points[first], distances.shape)).T
+    return np.dot(grid/np.array(distances.shape, dtype = float), np.asarray(cell))
+
+
+class VoxelGrid():
+    """
+    Voxel grid around a set of spheres, used by get_buried_atoms. The grid
+    is built in slabs along x, only the outside mask is kept for the whole
+    grid, one bit per voxel.
+    """
+    def __init__(self, positions, radii, resolution = 0.2):
+        rmax = np.max(radii)
+        self.h = resolution
+        self.origin = positions.min(axis = 0) - rmax - 2*resolution
+        extent = positions.max(axis = 0) + rmax + 2*resolution - self.origin
+        self.shape = tuple(int(n) for n in np.ceil(extent/self.h) + 1)
+        # half diagonal of a voxel
+        self.half = self.h*np.sqrt(3)/2
+        self.outside = np.zeros((int(np.prod(self.shape)) + 7)//8, dtype = np.uint8)
+    def slabs(self, max_voxels):
+        """
+        Ranges of x planes with about max_voxels voxels, a multiple of 8
+        planes so that every slab starts on a byte of the outside mask.
+        """
+        n = max(8, max_voxels//(self.shape[1]*self.shape[2])//8*8)
+        return [(i0, min(i0 + n, self.shape[0])) for i0 in range(0, self.shape[0], n)]
+    def fill(self, solid, i0, points, radius, chunk = 5000000):
+        """
+        Set the voxels of the slab solid, starting at plane i0, whose
+        center is within radius of any point. Every (x, y) column of a
+        sphere is an interval in z, the intervals are added to a difference
+        array and summed along z.
+        """
+        nx, ny, nz = solid.shape
+        n = int(np.ceil(radius/self.h)) + 1
+        r = np.arange(-n, n + 1)
+        disk = np.array(np.meshgrid(r, r, indexing = 'ij')).reshape(2, -1).T
+        disk = disk[np.linalg.norm(disk, axis = 1) <= n]
+        diff = np.zeros((nx, ny, nz + 1), dtype = np.int16)
+        flat = diff.reshape(-1)
+        nchunk = max(1, chunk//len(disk))
+        for j0 in range(0, len(points), nchunk):
+            p = points[j0:j0 + nchunk]
+            c0 = np.round((p[:, :2] - self.origin[:2])/self.h).astype(int)
+            x = c0[:, None, 0] + disk[None, :, 0] - i0
+            y = c0[:, None, 1] + disk[None, :, 1]
+            rho2 = ((x + i0)*self.h + self.origin[0] - p[:, None, 0])**2 + \
+                   (y*self.h + self.origin[1] - p[:, None, 1])**2
+            ip, iv = np.nonzero((rho2 < radius*radius) & (x >= 0) & (x < nx))
+            x = x[ip, iv]
+            y = y[ip, iv]
+            dz = np.sqrt(radius*radius - rho2[ip, iv])/self.h
+            zc = (p[ip, 2] - self.origin[2])/self.h
+            z0 = np.clip(np.ceil(zc - dz).astype(int), 0, nz)
+            z1 = np.clip(np.floor(zc + dz).astype(int) + 1, 0, nz)
+            base = (x*ny + y)*(nz + 1)
+            np.add.at(flat, base + z0, 1)
+            np.add.at(flat, base + z1, -1)
+        solid |= np.cumsum(diff, axis = 2, dtype = np.int16)[:, :, :nz] > 0
+    def apply(self, points, radius, func, inner = 0.0, chunk = 5000000):
+        """
+        For every point, find the voxels whose center is between inner and
+        radius, and call func(point index, flat voxel index) in chunks.
+        Return a mask of the points too close to the border of the grid,
+        which are skipped.
+        """
+        n = int(np.ceil(radius/self.h)) + 1
+        r = np.arange(-n, n + 1)
+        stencil = np.array(np.meshgrid(r, r, r, indexing = 'ij')).reshape(3, -1).T
+        norm = np.linalg.norm(stencil, axis = 1)*self.h
+        stencil = stencil[(norm <= radius + self.half*2) & (norm >= inner - self.half*2)]
+        offsets = stencil*self.h
+        o2 = np.sum(offsets**2, axis = 1)
+        strides = np.array([self.shape[1]*self.shape[2], self.shape[2], 1])
+        flat_offsets = np.dot(stencil, strides)
+        skipped = np.zeros(len(points), dtype = bool)
+        nchunk = max(1, chunk//len(offsets))
+        for i0 in range(0, len(points), nchunk):
+            p = points[i0:i0 + nchunk]
+            c0 = np.round((p - self.origin)/self.h).astype(int)
+            border = np.any((c0 - n < 0) | (c0 + n >= self.shape), axis = 1)
+            skipped[i0:i0 + nchunk] = border
+            # squared distances, |e + o|^2 with e the rounding error
+            e = c0*self.h + self.origin - p
+            d2 = np.sum(e*e, axis = 1)[:, None] + 2*np.dot(e, offsets.T) + o2[None, :]
+            d2[border] = np.inf
+            ip, iv = np.nonzero((d2 < radius*radius) & (d2 >= inner*inner))
+            index = np.dot(c0, strides)[ip] + flat_offsets[iv]
+            func(ip + i0, index)
+        return skipped
+    def near(self, points, radius, inner = 0.0):
+        """
+        True for points with an outside voxel between inner and radius.
+        """
+        points = np.asarray(points, dtype = float).reshape(-1, 3)
+        result = np.zeros(len(points), dtype = bool)
+        def func(ip, index):
+            bits = (self.outside[index >> 3] >> (7 - (index & 7))) & 1
+            result[ip[bits == 1]] = True
+        skipped = self.apply(points, radius, func, inner)
+        # points at the border of the grid are outside of everything
+        result[skipped] = True
+        return result
+
+def get_buried_atoms(positions, radii, resolution = 0.2, max_voxels = 20000000):
+    """
+    Find atoms which can not be seen from any direction, when all atoms are
+    opaque spheres.
 
+    Space is split into voxels of size resolution, a voxel is solid if it
+    lies completely inside a sphere. Empty voxels connected to the outside
+    are flood filled, an atom is buried if no outside voxel touches its
+    sphere. Voxels only make the test conservative: a visible atom is never
+    buried, but the gaps between touching spheres stay open, use
+    get_bulk_atoms for those. The grid is labelled in slabs of about
+    max_voxels voxels, which bounds the memory at any resolution.
+
+    Return the buried mask and the voxel grid.
+    """
+    from scipy import ndimage, sparse
+    from scipy.sparse.csgraph import connected_components
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    radii = np.broadcast_to(np.asarray(radii, dtype = float), (len(positions), ))
+    structure = np.ones((3, 3, 3))
+    with profiler.stage('get_buried_atoms', atoms = len(positions)) as stage:
+        grid = VoxelGrid(positions, radii, resolution)
+        slabs = grid.slabs(max_voxels)
+        x = positions[:, 0] - grid.origin[0]
+        def get_solid(i0, i1):
+            solid = np.zeros((i1 - i0, ) + grid.shape[1:], dtype = bool)
+            for radius in np.unique(radii):
+                r = radius - grid.half
+                index = np.where((radii == radius) & (x + r >= (i0 - 1)*grid.h) & (x - r <= i1*grid.h))[0]
+                if r > 0 and len(index) > 0:
+                    grid.fill(solid, i0, positions[index], r)
+            return solid
+        # label the empty voxels of every slab, and join the labels of
+        # neighbouring voxels across the slabs
+        starts = []
+        edges = []
+        nlabel = 1
+        last = None
+        for i0, i1 in slabs:
+            labels, n = ndimage.label(~get_solid(i0, i1), structure = structure)
+            labels[labels > 0] += nlabel - 1
+            starts.append(nlabel - 1)
+            nlabel += n
+            if last is not None:
+                first = labels[0]
+                ny, nz = first.shape
+                for dy in (-1, 0, 1):
+                    for dz in (-1, 0, 1):
+                        a = last[max(0, dy):ny + min(0, dy), max(0, dz):nz + min(0, dz)]
+                        b = first[max(0, -dy):ny + min(0, -dy), max(0, -dz):nz + min(0, -dz)]
+                        both = (a > 0) & (b > 0)
+                        edges.append(np.array([a[both], b[both]]))
+            last = labels[-1].copy()
+            del labels
+        edges = np.concatenate(edges, axis = 1) if edges else np.zeros((2, 0), dtype = int)
+        graph = sparse.coo_matrix((np.ones(edges.shape[1]), (edges[0], edges[1])), shape = (nlabel, nlabel))
+        ncomponent, component = connected_components(graph, directed = False)
+        # the corner is empty, the grid has a margin around all spheres, its
+        # label is 1
+        outside = component == component[1]
+        outside[0] = False
+        plane = grid.shape[1]*grid.shape[2]
+        for (i0, i1), start in zip(slabs, starts):
+            labels, n = ndimage.label(~get_solid(i0, i1), structure = structure)
+            labels[labels > 0] += start
+            grid.outside[i0*plane//8:(i1*plane + 7)//8] = np.packbits(outside[labels].ravel())
+            del labels
+        buried = np.zeros(len(positions), dtype = bool)
+        for radius in np.unique(radii):
+            index = np.where(radii == radius)[0]
+            # voxels closer than radius - half are solid
+            buried[index] = ~grid.near(positions[index], radius + grid.half, radius - grid.half)
+        stage.count(buried = int(buried.sum()), voxels = int(np.prod(grid.shape)), slabs = len(slabs))
+    return buried, grid
+
+def get_bulk_atoms(natoms, bondlist, coordination = 12, mask = None):
+    """
+    Find atoms buried by coordination: the atom and all its neighbours
+    have at least coordination neighbours. Works at any radius, also for
+    touching spheres, where get_buried_atoms leaves gaps open. It is not
+    exact: between touching spheres, e.g. along the channels of a close
+    packed crystal, slivers of these atoms can be seen at grazing angles.
+    Only bonds inside the cell are counted, so atoms at a periodic boundary
+    are never buried.
+
+    bondlist: dict
+        {i: [[j, offset], ...]}, see get_bondpairs.
+    mask: bool array
+        only these atoms are drawn, the others do not count as neighbours.
+
+    Return the buried mask.
+    """
+    if mask is None:
+        mask = np.ones(natoms, dtype = bool)
+    nli, nlj, nlS = get_bond_arrays(bondlist)
+    if len(nli) == 0:
+        return np.zeros(natoms, dtype = bool)
+    keep = ~nlS.any(axis = 1) & mask[nli] & mask[nlj]
+    nli = nli[keep]
+    nlj = nlj[keep]
+    full = (np.bincount(nli, minlength = natoms) >= coordination) & mask
+    # a neighbour with fewer bonds leaves a gap in the second shell
+    gap = np.zeros(natoms, dtype = bool)
+    gap[nli[~full[nlj]]] = True
+    return full & ~gap
+
+def get_frustum_mask(positions, matrix_world, camera_type = 'ORTHO', ortho_scale = 10.0,
+                     lens = 50.0, sensor_width = 36.0, aspect = 1.0,
+                     clip_start = 0.1, clip_end = 1000.0, margin = 0.0):
+    """
+    Return a mask of the positions inside the view frustum of a camera,
+    widened by margin (a float, or an array with one margin per position,
+    e.g. margin + radius).
+
+    matrix_world: array
+        4x4 matrix of the camera, which looks along its -z axis.
+    aspect: float
+        width/height of the image. The larger side gets ortho_scale or
+        sensor_width, as with sensor fit 'AUTO'.
+    """
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    margin = np.broadcast_to(np.asarray(margin, dtype = float), (len(positions), ))
+    matrix = np.linalg.inv(np.asarray(matrix_world, dtype = float))
+    local = np.dot(positions, matrix[:3, :3].T) + matrix[:3, 3]
+    x = np.abs(local[:, 0])
+    y = np.abs(local[:, 1])
+    depth = -local[:, 2]
+    mask = (depth > clip_start - margin) & (depth < clip_end + margin)
+    if camera_type == 'ORTHO':
+        half = ortho_scale/2.0
+        half_x, half_y = (half, half/aspect) if aspect >= 1 else (half*aspect, half)
+        mask &= (x <= half_x + margin) & (y <= half_y + margin)
+    else:
+        tan = sensor_width/2.0/lens
+        tan_x, tan_y = (tan, tan/aspect) if aspect >= 1 else (tan*aspect, tan)
+        # distance to a side plane is (depth*tan - x)*cos
+        cos_x = 1/np.sqrt(1 + tan_x**2)
+        cos_y = 1/np.sqrt(1 + tan_y**2)
+        mask &= (x <= depth*tan_x + margin/cos_x) & (y <= depth*tan_y + margin/cos_y)
+    return mask
+
+def get_chunk_ids(positions, cell = None, size = 10.0):
+    """
+    Return the chunk of every position, on a grid aligned with the cell
+    with about size Angstrom per chunk along every cell vector. Without a
+    cell the grid is aligned with x, y and z. Atoms outside the cell get
+    the chunks next to it, so that a chunk id only depends on the position.
+
+    The id is one integer per position, (i, j, k) shifted by 512 along
+    every axis.
+    """
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    cell = np.zeros((3, 3)) if cell is None else np.asarray(cell, dtype = float).reshape(3, 3)
+    if abs(np.linalg.det(cell)) < 1e-6:
+        ijk = np.floor(positions/size)
+    else:
+        scaled = np.linalg.solve(cell.T, positions.T).T
+        n = np.maximum(1, np.ceil(np.linalg.norm(cell, axis = 1)/size))
+        ijk = np.floor(scaled*n)
+    ijk = np.clip(ijk, -512, 511).astype(np.int64) + 512
+    return ((ijk[:, 0]*1024 + ijk[:, 1])*1024 + ijk[:, 2]).astype(np.int32)
+
+def get_symmetry_groups(atoms, symprec = 1e-5):
+    """
+    Split the cell into images of the asymmetric unit, using the symmetry
+    operations found by spglib.
+
+    Every atom of the cell is the image of one atom a of the asymmetric
+    unit by one operation: scaled position R.x_a + t + L, with L the
+    lattice vector which wraps it into the cell. Atoms with the same
+    operation and the same L share one transform.
+
+    Return (asym, groups): the indices of the asymmetric unit, and a list
+    of (matrix, indices), with matrix the 4x4 cartesian transform and
+    indices the atoms of the asymmetric unit it is applied to.
+    """
+    try:
+        import spglib
+    except ImportError:
+        raise ImportError('The symmetry mode needs spglib, install it with: pip install spglib')
+    cell = np.array(atoms.cell)
+    scaled = atoms.get_scaled_positions(wrap = False)
+    dataset = spglib.get_symmetry_dataset((cell, scaled, atoms.numbers), symprec = symprec)
+    if dataset is None:
+        raise ValueError('spglib could not find the symmetry of the atoms.')
+    # spglib >= 2.5 returns a dataclass
+    if isinstance(dataset, dict):
+        rotations, translations = dataset['rotations'], dataset['translations']
+        equivalent = dataset['equivalent_atoms']
+    else:
+        rotations, translations = dataset.rotations, dataset.translations
+        equivalent = dataset.equivalent_atoms
+    asym = np.unique(equivalent)
+    natoms = len(atoms)
+    # images of the asymmetric unit by every operation, (nop, nasym, 3)
+    images = np.einsum('gij,aj->gai', rotations, scaled[asym]) + translations[:, None, :]
+    # the atom of the cell at every image, in blocks of operations to
+    # bound the memory of the distance array
+    nop = len(rotations)
+    block = max(1, int(1e6//(len(asym)*natoms)))
+    target = np.empty((nop, len(asym)), dtype = int)
+    error = 0.0
+    for g0 in range(0, nop, block):
+        diff = images[g0:g0 + block, :, None, :] - scaled[None, None, :, :]
+        diff -= np.round(diff)
+        dist = np.linalg.norm(np.dot(diff, cell), axis = -1)
+        target[g0:g0 + block] = np.argmin(dist, axis = -1)
+        error = max(error, dist.min(axis = -1).max())
+    if error > max(symprec, 1e-3)*10:
+        raise ValueError('The symmetry operations do not map the atoms onto each other, '
+                         'try a larger symprec.')
+    shifts = np.round(scaled[target] - images).astype(int)
+    # one image per atom, several operations can map an atom on the same site
+    done = np.zeros(natoms, dtype = bool)
+    groups = {}
+    for g in range(len(rotations)):
+        for a in range(len(asym)):
+            j = target[g, a]
+            if done[j]: continue
+            done[j] = True
+            groups.setdefault((g, ) + tuple(shifts[g, a]), []).append(asym[a])
+    if not done.all():
+        raise ValueError('%s atoms are not images of the asymmetric unit.'%(natoms - done.sum()))
+    inv = np.linalg.inv(cell)
+    results = []
+    for key, indices in groups.items():
+        g, shift = key[0], np.array(key[1:])
+        # cartesian rows: x' = x.inv(C).R^T.C + (t + L).C
+        matrix = np.eye(4)
+        matrix[:3, :3] = np.dot(np.dot(inv, rotations[g].T), cell).T
+        matrix[:3, 3] = np.dot(translations[g] + shift, cell)
+        results.append((matrix, np.array(indices)))
+    return asym, results
+
+def get_image_items(indices, image_index):
+    """
+    Items (bonds, vertices, ...) belong to atoms, indices[i] is the atom of
+    item i. Return (select, image): every item of the atom of every image,
+    and the image it is copied for.
+    """
+    indices = np.asarray(indices, dtype = int)
+    image_index = np.asarray(image_index, dtype = int)
+    order = np.argsort(indices, kind = 'stable')
+    sorted_indices = indices[order]
+    starts = np.searchsorted(sorted_indices, image_index, 'left')
+    counts = np.searchsorted(sorted_indices, image_index, 'right') - starts
+    image = np.repeat(np.arange(len(image_index)), counts)
+    # position in the run of items of every image
+    run = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    select = order[np.repeat(starts, counts) + run]
+    return select, image
+
+def get_image_bonds(bond_kinds, image_index, image_offsets, cell):
+    """
+    Half bonds of the images of atoms, translated from the half bonds of
+    their atoms, without a new bond search. bond_kinds has the 'indices'
+    of the atom of every bond.
+
+    Return a new dict of bond kinds.
+    """
+    shifts = np.dot(np.asarray(image_offsets).reshape(-1, 3), np.asarray(cell).reshape(3, 3))
+    image_kinds = {}
+    for kind, datas in bond_kinds.items():
+        if not datas.get('indices'):
+            continue
+        select, image = get_image_items(datas['indices'], image_index)
+        if len(select) == 0:
+            continue
+        image_datas = {key: value for key, value in datas.items()
+                       if key not in ['centers', 'normals', 'lengths', 'verts', 'faces', 'indices']}
+        image_datas['centers'] = list(np.array(datas['centers'])[select] + shifts[image])
+        image_datas['normals'] = list(np.array(datas['normals'])[select])
+        image_datas['lengths'] = list(np.array(datas['lengths'])[select])
+        image_datas['indices'] = list(np.asarray(image_index)[image])
+        image_datas['verts'] = []
+        image_datas['faces'] = []
+        image_kinds[kind] = image_datas
+    return image_kinds
+
+def get_image_polyhedra(polyhedra_kinds, image_index, image_offsets, cell):
+    """
+    Polyhedra of the images of center atoms, translated from the polyhedra
+    of their atoms. polyhedra_kinds has the 'indices' of the center of
+    every vertex, and of every edge cylinder.
+
+    Return a new dict of polyhedra kinds.
+    """
+    shifts = np.dot(np.asarray(image_offsets).reshape(-1, 3), np.asarray(cell).reshape(3, 3))
+    image_kinds = {}
+    for kind, datas in polyhedra_kinds.items():
+        if not datas.get('indices'):
+            continue
+        indices = np.asarray(datas['indices'])
+        vselect, vimage = get_image_items(indices, image_index)
+        if len(vselect) == 0:
+            continue
+        nvert = len(indices)
+        vertices = np.array(datas['vertices'])[vselect] + shifts[vimage]
+        # new number of (image, old vertex)
+        keys = vimage*nvert + vselect
+        order = np.argsort(keys)
+        faces = np.array(datas['faces'], dtype = int).reshape(-1, 3)
+        fselect, fimage = get_image_items(indices[faces[:, 0]], image_index)
+        fkeys = fimage[:, None]*nvert + faces[fselect]
+        faces = order[np.searchsorted(keys[order], fkeys)]
+        edges = np.concatenate([faces[:, [0, 1]], faces[:, [0, 2]], faces[:, [1, 2]]], axis = 1).reshape(-1, 2)
+        edge_cylinder = datas['edge_cylinder']
+        eselect, eimage = get_image_items(edge_cylinder['indices'], image_index)
+        image_datas = {key: value for key, value in datas.items()
+                       if key not in ['vertices', 'edges', 'faces', 'indices', 'edge_cylinder']}
+        image_datas['vertices'] = list(vertices)
+        image_datas['faces'] = list(faces)
+        image_datas['edges'] = list(edges)
+        image_datas['indices'] = list(np.asarray(image_index)[vimage])
+        image_datas['edge_cylinder'] = {key: value for key, value in edge_cylinder.items()
+                       if key not in ['centers', 'normals', 'lengths', 'indices']}
+        image_datas['edge_cylinder']['centers'] = list(np.array(edge_cylinder['centers'])[eselect] + shifts[eimage])
+        image_datas['edge_cylinder']['normals'] = list(np.array(edge_cylinder['normals'])[eselect])
+        image_datas['edge_cylinder']['lengths'] = list(np.array(edge_cylinder['lengths'])[eselect])
+        image_datas['edge_cylinder']['indices'] = list(np.asarray(image_index)[eimage])
+        image_kinds[kind] = image_datas
+    return image_kinds
+
+def get_bond_arrays(bondlist):
+    """
+    Return the arrays (i, j, offsets) of a bondlist {i: [[j, offset], ...]}.
+    """
+    nli = np.array([i for i, pairs in bondlist.items() for bond in pairs], dtype = int)
+    nlj = np.array([bond[0] for pairs in bondlist.values() for bond in pairs], dtype = int)
+    nlS = np.array([bond[1] for pairs in bondlist.values() for bond in pairs], dtype = int).reshape(-1, 3)
+    return nli, nlj, nlS
+
+def search_bonded_images(bondlist, species, search_pairs, index, offsets, max_images = None):
+    """
+    Breadth-first search over the periodic bond graph. Start from the atoms
+    at (index, offsets), follow the bonds (species1, species2) in
+    search_pairs from species1 to species2, and add the bonded images which
+    are not there yet, until molecules or polyhedra are complete. The cost
+    is linear in the number of added images.
+
+    bondlist: dict
+        {i: [[j, offset], ...]} of the atoms in the cell, see get_bondpairs.
+    species: list of str
+        species of the atoms in the cell.
+    max_images: int
+        stop if more images are added, e.g. when the search bonds form an
+        infinite network. Default: 10 times the number of atoms.
+
+    Return (index, offsets) of the added images.
+    """
+    species = np.asarray(species)
+    natoms = len(species)
+    if max_images is None:
+        max_images = 10*natoms
+    names, sid = np.unique(species, return_inverse = True)
+    follow = np.zeros((len(names), len(names)), dtype = bool)
+    lookup = {name: i for i, name in enumerate(names)}
+    for s1, s2 in search_pairs:
+        if s1 in lookup and s2 in lookup:
+            follow[lookup[s1], lookup[s2]] = True
+    # bond arrays, only the bonds to follow
+    nli, nlj, nlS = get_bond_arrays(bondlist)
+    empty = (np.zeros(0, dtype = int), np.zeros((0, 3), dtype = int))
+    if len(nli) == 0:
+        return empty
+    mask = follow[sid[nli], sid[nlj]]
+    nli, nlj, nlS = nli[mask], nlj[mask], nlS[mask]
+    if len(nli) == 0:
+        return empty
+    # one integer per (index, offset), offsets up to +-1000 cells
+    def get_keys(index, offsets):
+        offsets = np.asarray(offsets, dtype = np.int64) + 1024
+        return ((np.asarray(index, dtype = np.int64)*2048 + offsets[:, 0])*2048
+                + offsets[:, 1])*2048 + offsets[:, 2]
+    index = np.asarray(index, dtype = int)
+    offsets = np.asarray(offsets, dtype = int).reshape(-1, 3)
+    visited = np.unique(get_keys(index, offsets))
+    frontier = (index, offsets)
+    added_index = []
+    added_offsets = []
+    nadded = 0
+    while len(frontier[0]) > 0:
+        select, image = get_image_items(nli, frontier[0])
+        new_index = nlj[select]
+        new_offsets = frontier[1][image] + nlS[select]
+        keys, first = np.unique(get_keys(new_index, new_offsets), return_index = True)
+        new = ~np.isin(keys, visited, assume_unique = True)
+        first = first[new]
+        if len(first) == 0:
+            break
+        frontier = (new_index[first], new_offsets[first])
+        visited = np.union1d(visited, keys[new])
+        added_index.append(frontier[0])
+        added_offsets.append(frontier[1])
+        nadded += len(first)
+        if nadded > max_images:
+            import warnings
+            warnings.warn('Search bonds added more than %s images, stopped. '
+                          'The search bonds may form an infinite network.'%max_images)
+            break
+    if not added_index:
+        return empty
+    return np.concatenate(added_index), np.concatenate(added_offsets)
+
+def get_molecules(natoms, bondlist):
+    """
+    Find the molecules, the connected components of the bond graph, and the
+    cell offsets of the atoms which make every molecule whole across the
+    periodic boundary.
+
+    The offsets are summed along a breadth-first spanning tree of each
+    molecule, from its first atom, by pointer jumping: every step doubles
+    the length of the summed paths, so the cost is O(n log(depth)).
+
+    bondlist: dict
+        {i: [[j, offset], ...]}, see get_bondpairs.
+
+    Return (ids, offsets), the molecule id and the integer cell offset of
+    every atom. Molecules which are bonded to their own images, e.g.
+    polymers and frameworks, are unwrapped along the tree only.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components, breadth_first_order
+    nli, nlj, nlS = get_bond_arrays(bondlist)
+    graph = coo_matrix((np.ones(len(nli), dtype = np.int8), (nli, nlj)), shape = (natoms, natoms)).tocsr()
+    nmol, ids = connected_components(graph, directed = False)
+    offsets = np.zeros((natoms + 1, 3), dtype = int)
+    if len(nli) == 0:
+        return ids, offsets[:natoms]
+    # a root node bonded to the first atom of every molecule, so that one
+    # search gives the spanning trees of all molecules
+    first = np.unique(ids, return_index = True)[1]
+    rows = np.concatenate([nli, nlj, np.full(nmol, natoms)])
+    cols = np.concatenate([nlj, nli, first])
+    tree = coo_matrix((np.ones(len(rows), dtype = np.int8), (rows, cols)),
+                      shape = (natoms + 1, natoms + 1)).tocsr()
+    order, parent = breadth_first_order(tree, natoms, directed = True, return_predecessors = True)
+    parent[natoms] = natoms
+    # offset of each tree edge parent -> atom, from the bond parent -> atom
+    keys = nli.astype(np.int64)*natoms + nlj
+    sort = np.argsort(keys)
+    child = np.arange(natoms)
+    edge = np.searchsorted(keys[sort], parent[:natoms].astype(np.int64)*natoms + child)
+    edge = np.minimum(edge, len(keys) - 1)
+    inner = parent[:natoms] != natoms
+    offsets[:natoms][inner] = nlS[sort[edge[inner]]]
+    # pointer jumping: offsets[a] becomes the sum from the root to a
+    while (parent != natoms).any():
+        offsets += offsets[parent]
+        parent = parent[parent]
+    return ids, offsets[:natoms]
+
+def get_neighbor_pairs(positions, cell, pbc, cutoff, index1, index2):
+    """
+    Pairs of atoms (i in index1, j in index2) closer than cutoff. The atoms
+    are wrapped into the cell, and a kd-tree is built over the atoms of
+    index2 and their images within cutoff of the cell faces, see
+    get_periodic_images.
+
+    Return (i, j, offsets, vectors), with vectors = positions[j] +
+    offsets.cell - positions[i].
+    """
+    from scipy.spatial import cKDTree
+    from ase.cell import Cell
+    positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+    index1 = np.asarray(index1, dtype = int)
+    index2 = np.asarray(index2, dtype = int)
+    if len(index1) == 0 or len(index2) == 0:
+        return (np.zeros(0, dtype = int), np.zeros(0, dtype = int),
+                np.zeros((0, 3), dtype = int), np.zeros((0, 3)))
+    cell = Cell(cell).complete()
+    queries, qindex, qoffsets = get_periodic_images(positions[index1], cell, pbc, 0.0)
+    points, pindex, poffsets = get_periodic_images(positions[index2], cell, pbc, cutoff)
+    pairs = cKDTree(queries).sparse_distance_matrix(cKDTree(points), cutoff, output_type = 'ndarray')
+    i = index1[qindex[pairs['i']]]
+    j = index2[pindex[pairs['j']]]
+    S = poffsets[pairs['j']] - qoffsets[pairs['i']]
+    mask = (i != j) | S.any(axis = 1)
+    i, j, S = i[mask], j[mask], S[mask]
+    vectors = positions[j] + np.dot(S, cell.array) - positions[i]
+    return i, j, S, vectors
+
+def get_hydrogen_bonds(atoms, distance = 2.5, angle = 120.0, donors = ['N', 'O', 'F'],
+                       acceptors = ['N', 'O', 'F'], dh = 1.2):
+    """
+    Search hydrogen bonds D-H...A. A hydrogen atom belongs to the closest
+    donor D within dh. The bond is kept if H...A is shorter than distance
+    and the angle D-H...A is larger than angle (degree).
+
+    Return (i, j, offsets): the hydrogen atoms, the acceptors and the cell
+    offsets of the acceptors.
+    """
+    symbols = np.array(atoms.get_chemical_symbols())
+    natoms = len(symbols)
+    hydrogens = np.where(symbols == 'H')[0]
+    heavy = np.where(np.isin(symbols, list(set(donors) | set(acceptors))))[0]
+    with profiler.stage('get_hydrogen_bonds', atoms = natoms) as stage:
+        i, j, S, vectors = get_neighbor_pairs(atoms.positions, atoms.cell, atoms.pbc,
+                                              max(distance, dh), hydrogens, heavy)
+        d = np.linalg.norm(vectors, axis = 1)
+        # the donor of every hydrogen
+        pairs = np.where(np.isin(symbols[j], donors) & (d < dh))[0]
+        pairs = pairs[np.lexsort((d[pairs], i[pairs]))]
+        hs, first = np.unique(i[pairs], return_index = True)
+        pairs = pairs[first]
+        donor = np.zeros((natoms, 3))
+        donor[hs] = vectors[pairs]
+        mask = np.isin(symbols[j], acceptors) & (d < distance)
+        mask[pairs] = False
+        mask &= np.isin(i, hs)
+        i, j, S, vectors, d = i[mask], j[mask], S[mask], vectors[mask], d[mask]
+        # angle at H between H->D and H->A
+        cos = np.sum(donor[i]*vectors, axis = 1)/(np.linalg.norm(donor[i], axis = 1)*d)
+        mask = cos <= np.cos(np.radians(angle))
+        i, j, S = i[mask], j[mask], S[mask]
+        stage.count(bonds = len(i))
+    return i, j, S
 
 
 if __name__ == "__main__":
-    from ase.build import bulk
-    from ase.atoms import Atoms
     from ase.io import read
-    from ase.visualize import view
-    # pt = bulk('Pt', cubic = True)
     atoms = read('docs/source/_static/datas/mof-5.cif')
-    # view(atoms)
     positions = find_cage(atoms.cell, atoms.positions, 9.0, step = 1.0)
-    vatoms = Atoms(['Au']*len(positions), positions=positions)
-    view(atoms + vatoms)
+    print(positions)